@@ -1,16 +1,21 @@
-from fastapi import APIRouter, Depends, Query
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, Query, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
 
 from ..database import get_db
 from ..dependencies import get_current_user
-from ..models.user import User
-from ..schemas.chat_room import ChatRoomCreate, ChatRoomResponse, ChatRoomDetailResponse
-from ..schemas.message import MessageCreate, MessageDetailResponse
+from ..exceptions import RoomPermissionException
+from ..schemas.chat_room import ChatRoomCreate, ChatRoomResponse, ChatRoomDetailResponse, RoomPresenceResponse
+from ..schemas.message import MessageCreate, MessageDetailResponse, MessageImportResponse
+from ..serialization import message_list_response
+from ..services.principals import Principal
 from ..services.chat import (
     get_chat_rooms, get_chat_room, create_chat_room, get_room_details, 
-    get_room_messages, create_message, search_chat_rooms, search_messages
+    get_room_messages, create_message, search_chat_rooms, search_messages,
+    get_room_presence
 )
+from ..services.transfer import export_messages, import_messages
 
 router = APIRouter(prefix="/chat", tags=["Chat"])
 
@@ -19,38 +24,49 @@ async def read_chat_rooms(
     skip: int = 0, 
     limit: int = 100, 
     search: Optional[str] = None,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_user)
 ):
     """
     Retrieve all available chat rooms.
     Optional search parameter to filter rooms by name.
     """
     if search:
-        return search_chat_rooms(db, search, skip, limit)
-    return get_chat_rooms(db, skip, limit)
+        return await search_chat_rooms(db, search, skip, limit)
+    return await get_chat_rooms(db, skip, limit)
 
 @router.post("/rooms", response_model=ChatRoomResponse, status_code=201)
 async def create_new_chat_room(
     chat_room: ChatRoomCreate,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_user)
 ):
     """
     Create a new chat room.
     """
-    return create_chat_room(db, chat_room, current_user.id)
+    return await create_chat_room(db, chat_room, current_user.id)
 
 @router.get("/rooms/{room_id}", response_model=ChatRoomDetailResponse)
 async def read_chat_room(
     room_id: int,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_user)
 ):
     """
     Get details of a specific chat room.
     """
-    return get_room_details(db, room_id)
+    return await get_room_details(db, room_id)
+
+@router.get("/rooms/{room_id}/presence", response_model=RoomPresenceResponse)
+async def read_room_presence(
+    room_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    """
+    Users currently connected to a chat room, on any worker.
+    """
+    return await get_room_presence(db, room_id)
 
 @router.get("/rooms/{room_id}/messages", response_model=List[MessageDetailResponse])
 async def read_room_messages(
@@ -58,25 +74,72 @@ async def read_room_messages(
     skip: int = 0,
     limit: int = 100,
     search: Optional[str] = None,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_user)
 ):
     """
-    Retrieve messages from a chat room.
+    Retrieve messages from a chat room, newest first.
     Optional search parameter to filter messages by content.
+    Pass before_id/after_id, or the cursor returned in the X-Next-Cursor
+    header, to page through history; after_id pages run oldest first.
     """
     if search:
-        return search_messages(db, room_id, search, skip, limit)
-    return get_room_messages(db, room_id, skip, limit)
+        messages, next_cursor = await search_messages(db, room_id, search, skip, limit, before_id, after_id, cursor)
+    else:
+        messages, next_cursor = await get_room_messages(db, room_id, skip, limit, before_id, after_id, cursor)
+    return message_list_response(messages, next_cursor)
 
 @router.post("/rooms/{room_id}/messages", response_model=MessageDetailResponse, status_code=201)
 async def create_room_message(
     room_id: int,
     message: MessageCreate,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_user)
 ):
     """
     Post a new message to a chat room.
     """
-    return create_message(db, message, current_user.id, room_id)
\ No newline at end of file
+    return await create_message(db, message, current_user.id, room_id)
+
+@router.get("/rooms/{room_id}/export")
+async def export_room_messages(
+    room_id: int,
+    gzip: bool = False,
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    """
+    Stream every message of a chat room as NDJSON, oldest first.
+    With gzip=true the stream is gzip-compressed.
+    """
+    await get_chat_room(db, room_id)
+    filename = f"room-{room_id}.ndjson" + (".gz" if gzip else "")
+    return StreamingResponse(
+        export_messages(room_id, gzip),
+        media_type="application/gzip" if gzip else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@router.post("/rooms/{room_id}/import", response_model=MessageImportResponse)
+async def import_room_messages(
+    room_id: int,
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    """
+    Add the messages of an NDJSON export to a chat room, matching authors
+    by username. Send gzip bodies with Content-Encoding: gzip.
+    Only the room's creator can import.
+    """
+    room = await get_chat_room(db, room_id)
+    if room.created_by != current_user.id:
+        raise RoomPermissionException()
+    compressed = (
+        request.headers.get("content-encoding") == "gzip"
+        or request.headers.get("content-type") == "application/gzip"
+    )
+    return await import_messages(db, room_id, request.stream(), compressed)
\ No newline at end of file
@@ -0,0 +1,146 @@
+import time
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from ..config import settings
+from ..log import dropped_records
+from ..metrics import PrometheusText, db_metrics, realtime_metrics, resident_memory_bytes
+from ..services.archive import message_archive
+from ..services.history import recent_messages
+from ..services.passwords import password_hasher
+from ..services.persistence import message_writer
+from ..services.principals import principal_cache
+from ..services.rooms import room_directory
+from ..websockets.backplane import backplane
+from ..websockets.connection import manager
+from ..websockets.presence import presence_tracker
+from ..websockets.sharding import shard_router
+
+router = APIRouter(tags=["Metrics"])
+
+def collect_metrics() -> str:
+    page = PrometheusText()
+
+    # Sockets
+    page.metric("chat_ws_connections", "gauge", "Open WebSocket connections per room", [
+        ({"room": room_id}, len(connections)) for room_id, connections in manager.active_connections.items()
+    ])
+    page.gauge("chat_ws_connections_total", "Open WebSocket connections", len(manager.outbound))
+    page.gauge("chat_ws_connected_users", "Users with at least one open WebSocket", len(manager.user_connections))
+    page.metric("chat_ws_tracked_sockets", "gauge", "Entries in the connection manager's per-socket maps; all should match chat_ws_connections_total", [
+        ({"map": "rooms"}, sum(len(connections) for connections in manager.active_connections.values())),
+        ({"map": "users"}, sum(len(connections) for connections in manager.user_connections.values())),
+        ({"map": "owners"}, len(manager.connection_owners)),
+        ({"map": "last_seen"}, len(manager.last_seen))
+    ])
+    now = time.monotonic()
+    page.gauge(
+        "chat_ws_quiet_connections",
+        "Sockets that have sent nothing for a heartbeat interval",
+        sum(1 for seen_at in manager.last_seen.values() if now - seen_at >= settings.WS_HEARTBEAT_INTERVAL)
+    )
+    page.counter("chat_ws_pings_total", "Heartbeat pings sent to quiet sockets", realtime_metrics.pings)
+    page.metric("chat_ws_reaped_total", "counter", "Sockets closed by the heartbeat sweep", [
+        ({"reason": reason}, count) for reason, count in realtime_metrics.reaped.items()
+    ])
+    page.gauge("chat_process_resident_memory_bytes", "Resident memory of this worker", resident_memory_bytes())
+
+    presence = presence_tracker.stats()
+    page.gauge("chat_presence_local_users", "Users online in a room through this worker, grace period included", presence["local_users"])
+    page.gauge("chat_presence_remote_workers", "Other workers whose presence view this worker holds", presence["remote_workers"])
+    page.counter("chat_presence_events_total", "Presence diffs sent to rooms", realtime_metrics.presence_events)
+
+    shards = shard_router.stats()
+    page.metric("chat_ws_shard_routed_total", "counter", "Sockets for rooms owned by another shard", [
+        ({"mode": mode}, count) for mode, count in shards["routed"].items()
+    ])
+    page.gauge("chat_ws_shard_proxied_connections", "Sockets relayed to their room's owner", shards["proxying"])
+    page.counter("chat_ws_shard_proxy_failures_total", "Sockets whose room's owner could not be reached", shards["proxy_failures"])
+
+    # Outbound queues
+    depths = [outbound.queue.qsize() for outbound in manager.outbound.values()]
+    page.gauge("chat_ws_outbound_queued_messages", "Messages waiting in outbound socket queues", sum(depths))
+    page.gauge("chat_ws_outbound_queue_depth_max", "Deepest outbound socket queue", max(depths, default=0))
+    page.gauge(
+        "chat_ws_outbound_queues_half_full",
+        "Outbound socket queues at least half full",
+        sum(1 for outbound, depth in zip(manager.outbound.values(), depths) if depth * 2 >= outbound.queue.maxsize)
+    )
+
+    # Message flow
+    page.counter("chat_ws_messages_received_total", "Chat messages received from WebSockets", realtime_metrics.messages_received)
+    page.counter("chat_ws_broadcasts_total", "Broadcasts started on this worker", realtime_metrics.broadcasts)
+    page.counter("chat_ws_deliveries_total", "Payloads queued for a socket", realtime_metrics.deliveries)
+    page.counter("chat_ws_dropped_total", "Payloads dropped because a socket queue was full", realtime_metrics.dropped)
+    page.counter("chat_ws_send_failures_total", "Failed socket writes", realtime_metrics.send_failures)
+    page.counter("chat_ws_coalesced_frames_total", "Batched frames queued for coalescing sockets", realtime_metrics.coalesced_frames)
+    page.counter("chat_ws_coalesced_events_total", "Events carried by batched frames", realtime_metrics.coalesced_events)
+    page.counter(
+        "chat_ws_slow_consumer_disconnects_total",
+        "Sockets closed by the slow consumer policy",
+        realtime_metrics.slow_consumer_disconnects
+    )
+    page.histogram(
+        "chat_ws_fanout_seconds",
+        "Time to queue a broadcast for every local socket in the room",
+        realtime_metrics.fanout_time
+    )
+    page.histogram(
+        "chat_ws_delivery_seconds",
+        "Time from queueing a payload for a socket until it is sent",
+        realtime_metrics.delivery_time
+    )
+
+    # Persistence
+    writer = message_writer.stats()
+    page.gauge("chat_message_writer_queued", "Messages waiting to be stored", writer["queued"])
+    page.counter("chat_message_writer_flushed_total", "Messages stored by the message writer", writer["flushed"])
+    page.counter("chat_message_writer_failed_total", "Messages dropped after failed retries", writer["failed"])
+    page.histogram(
+        "chat_message_persist_seconds",
+        "Time from a WebSocket message being queued for storage until it is committed",
+        realtime_metrics.persist_time
+    )
+    page.histogram("chat_message_flush_seconds", "Time to insert one batch of messages", realtime_metrics.flush_time)
+    relay = backplane.stats()
+    page.counter("chat_backplane_events_dropped_total", "Backplane events a peer worker never received", relay["dropped"])
+    page.counter("chat_backplane_events_fragmented_total", "Backplane events sent in several datagrams", relay.get("fragmented", 0))
+    archive = message_archive.stats()
+    page.counter("chat_archive_messages_moved_total", "Messages moved from the table to the archive", archive["moved"])
+    page.metric("chat_archive_frame_reads_total", "counter", "Archive frames needed by reads", [
+        ({"result": "hit"}, archive["cache_hits"]),
+        ({"result": "miss"}, archive["frame_reads"])
+    ])
+    page.gauge("chat_archive_cached_frames", "Decompressed archive frames in memory", archive["cached_frames"])
+
+    # Database pool
+    pool = db_metrics.stats(top=0)["pool"]
+    page.gauge("chat_db_pool_checked_out", "Database connections in use", pool["checked_out"])
+    page.gauge("chat_db_pool_overflow", "Database connections open beyond the pool size", pool.get("overflow", 0))
+    page.counter("chat_db_pool_checkout_timeouts_total", "Checkouts that timed out waiting for a connection", pool["checkout_timeouts"])
+    page.histogram("chat_db_pool_checkout_seconds", "Time to check out a database connection", db_metrics.checkout_wait)
+
+    # Caches and authentication
+    for name, stats in (
+        ("history", recent_messages.stats()),
+        ("principal", principal_cache.stats())
+    ):
+        page.metric(f"chat_{name}_cache_requests_total", "counter", f"Lookups in the {name} cache", [
+            ({"result": "hit"}, stats["hits"]),
+            ({"result": "miss"}, stats["misses"])
+        ])
+    page.gauge("chat_room_directory_rooms", "Rooms in the room directory", room_directory.stats()["rooms"])
+    hasher = password_hasher.stats()
+    page.gauge("chat_password_hashes_pending", "Password hashes running or waiting", hasher["in_flight"] + hasher["queued"])
+    page.counter("chat_password_hashes_rejected_total", "Logins and registrations refused as too busy", hasher["rejected"])
+    page.histogram("chat_password_hash_seconds", "Time to hash or verify a password", password_hasher.hash_time)
+    page.counter("chat_log_records_dropped_total", "Log records dropped because the log queue was full", dropped_records())
+
+    return page.render()
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def read_metrics():
+    """
+    Runtime metrics of this worker in the Prometheus text format.
+    """
+    return PlainTextResponse(collect_metrics(), media_type="text/plain; version=0.0.4")
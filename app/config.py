@@ -14,12 +14,20 @@ class Settings:
     MYSQL_PORT: str = os.getenv("MYSQL_PORT", "3306")
     MYSQL_DB: str = os.getenv("MYSQL_DB")
 
-    if not all([MYSQL_USER, MYSQL_PASSWORD, MYSQL_DB]):
-        raise ValueError("Missing one or more required database environment variables.")
-    
-    DATABASE_URL: str = (
-        f"mysql+mysqlconnector://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}:{MYSQL_PORT}/{MYSQL_DB}"
-    )
+    # DATABASE_URL overrides the MySQL settings, e.g. with
+    # sqlite+aiosqlite:///./chat.db for local runs and benchmarks
+    DATABASE_URL: str = os.getenv("DATABASE_URL")
+    if not DATABASE_URL:
+        if not all([MYSQL_USER, MYSQL_PASSWORD, MYSQL_DB]):
+            raise ValueError("Missing one or more required database environment variables.")
+        DATABASE_URL = f"mysql+aiomysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}:{MYSQL_PORT}/{MYSQL_DB}"
+
+    # Connection pool, per worker
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "10"))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+    DB_POOL_TIMEOUT: float = float(os.getenv("DB_POOL_TIMEOUT", "30"))  # seconds to wait for a connection
+    DB_POOL_RECYCLE: int = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # seconds, below MySQL's wait_timeout
+    DB_POOL_PRE_PING: bool = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
     
     # JWT Authentication
     SECRET_KEY: str = os.getenv("SECRET_KEY")
@@ -28,8 +36,148 @@ class Settings:
     
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24  # 24 hours
+    REVOCATION_SYNC_INTERVAL: float = float(os.getenv("REVOCATION_SYNC_INTERVAL", "30"))  # seconds
+    REVOCATION_PRUNE_INTERVAL: float = float(os.getenv("REVOCATION_PRUNE_INTERVAL", "600"))  # seconds
+    PRINCIPAL_CACHE_SIZE: int = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+    PRINCIPAL_CACHE_TTL: float = float(os.getenv("PRINCIPAL_CACHE_TTL", "300"))  # seconds
+    # Users who may read the /api/admin endpoints, comma separated
+    ADMIN_USERNAMES: set = {name.strip() for name in os.getenv("ADMIN_USERNAMES", "").split(",") if name.strip()}
+    # bcrypt cost; stored hashes with another cost are rehashed on login
+    BCRYPT_ROUNDS: int = int(os.getenv("BCRYPT_ROUNDS", "12"))
+    # Threads hashing passwords, and how many hashes may wait for one
+    # before logins and registrations are turned away
+    PASSWORD_HASH_WORKERS: int = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+    PASSWORD_HASH_MAX_PENDING: int = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "32"))
 
     # WebSocket
-    WS_MESSAGE_QUEUE_SIZE: int = 100
+    WS_MESSAGE_QUEUE_SIZE: int = int(os.getenv("WS_MESSAGE_QUEUE_SIZE", "100"))
+    # What to do when a client's outbound queue overflows: "drop" the message
+    # for that client, or "disconnect" the client
+    WS_SLOW_CONSUMER_POLICY: str = os.getenv("WS_SLOW_CONSUMER_POLICY", "drop")
+    if WS_SLOW_CONSUMER_POLICY not in ("drop", "disconnect"):
+        raise ValueError("WS_SLOW_CONSUMER_POLICY must be 'drop' or 'disconnect'.")
+    # Protocol-level pings, answered by every client's WebSocket library; a
+    # socket whose pong is late is closed by the server
+    WS_PING_INTERVAL: float = float(os.getenv("WS_PING_INTERVAL", "20"))  # seconds
+    WS_PING_TIMEOUT: float = float(os.getenv("WS_PING_TIMEOUT", "20"))  # seconds
+    # Every WS_HEARTBEAT_INTERVAL seconds, sockets whose last send failed are
+    # closed; 0 turns this off. Opt-in: with a WS_IDLE_TIMEOUT, sockets that
+    # have sent nothing for an interval are also sent a ping event, and are
+    # closed once they have sent nothing for WS_IDLE_TIMEOUT seconds
+    WS_HEARTBEAT_INTERVAL: float = float(os.getenv("WS_HEARTBEAT_INTERVAL", "25"))  # seconds
+    WS_IDLE_TIMEOUT: float = float(os.getenv("WS_IDLE_TIMEOUT", "0"))  # seconds
+    if WS_IDLE_TIMEOUT > 0 and WS_IDLE_TIMEOUT <= WS_HEARTBEAT_INTERVAL:
+        raise ValueError("WS_IDLE_TIMEOUT must be longer than WS_HEARTBEAT_INTERVAL.")
+    if WS_IDLE_TIMEOUT > 0 and WS_HEARTBEAT_INTERVAL <= 0:
+        raise ValueError("WS_IDLE_TIMEOUT needs a WS_HEARTBEAT_INTERVAL.")
+    # Clients connecting with ?batch=true get the room events of each window
+    # in one frame; 0 turns batching off. A window flushes early once it
+    # holds WS_COALESCE_MAX_EVENTS events
+    WS_COALESCE_WINDOW: float = float(os.getenv("WS_COALESCE_WINDOW", "0.02"))  # seconds
+    WS_COALESCE_MAX_EVENTS: int = int(os.getenv("WS_COALESCE_MAX_EVENTS", "200"))
+
+    # Presence: how long a user stays online after their last socket closes,
+    # how often changes are sent to rooms, and how often each worker
+    # republishes its whole view to the others
+    PRESENCE_LEAVE_GRACE: float = float(os.getenv("PRESENCE_LEAVE_GRACE", "5"))  # seconds
+    PRESENCE_FLUSH_INTERVAL: float = float(os.getenv("PRESENCE_FLUSH_INTERVAL", "1"))  # seconds
+    PRESENCE_SYNC_INTERVAL: float = float(os.getenv("PRESENCE_SYNC_INTERVAL", "30"))  # seconds
+
+    # Backplane relaying room events between workers: "memory" for a single
+    # process, "ipc" for several workers on one host
+    WS_BACKPLANE: str = os.getenv("WS_BACKPLANE", "memory")
+    if WS_BACKPLANE not in ("memory", "ipc"):
+        raise ValueError("WS_BACKPLANE must be 'memory' or 'ipc'.")
+    WS_BACKPLANE_IPC_DIR: str = os.getenv("WS_BACKPLANE_IPC_DIR", "/tmp/chat-backplane")
+
+    # Room sharding, set up by `python -m app.launcher`: rooms are spread over
+    # WS_SHARD_COUNT worker processes by consistent hashing, and a room's
+    # sockets are served by its owner only. Sockets opened on another worker
+    # are relayed to the owner over its Unix socket in WS_SHARD_IPC_DIR
+    # ("proxy") or told to reconnect to it ("redirect")
+    WS_SHARD_COUNT: int = int(os.getenv("WS_SHARD_COUNT", "1"))
+    WS_SHARD_INDEX: int = int(os.getenv("WS_SHARD_INDEX", "0"))
+    if not 0 <= WS_SHARD_INDEX < WS_SHARD_COUNT:
+        raise ValueError("WS_SHARD_INDEX must be at least 0 and below WS_SHARD_COUNT.")
+    if WS_SHARD_COUNT > 1 and WS_BACKPLANE != "ipc":
+        raise ValueError("WS_SHARD_COUNT above 1 needs WS_BACKPLANE=ipc.")
+    WS_SHARD_MODE: str = os.getenv("WS_SHARD_MODE", "proxy")
+    if WS_SHARD_MODE not in ("proxy", "redirect"):
+        raise ValueError("WS_SHARD_MODE must be 'proxy' or 'redirect'.")
+    WS_SHARD_IPC_DIR: str = os.getenv("WS_SHARD_IPC_DIR", "/tmp/chat-shards")
+    # Redirects point at the host the client connected to, on port
+    # WS_SHARD_BASE_PORT + shard, unless WS_SHARD_URLS lists the public base
+    # URL of each shard, comma separated
+    WS_SHARD_BASE_PORT: int = int(os.getenv("WS_SHARD_BASE_PORT", "8000"))
+    WS_SHARD_URLS: list = [url.strip() for url in os.getenv("WS_SHARD_URLS", "").split(",") if url.strip()]
+    if WS_SHARD_URLS and len(WS_SHARD_URLS) != WS_SHARD_COUNT:
+        raise ValueError("WS_SHARD_URLS must list one URL per shard.")
+
+    # Search: "like" (substring scan), "fulltext" (MySQL FULLTEXT index,
+    # ranked) or "memory" (in-process inverted index, ranked)
+    SEARCH_BACKEND: str = os.getenv("SEARCH_BACKEND", "fulltext")
+    if SEARCH_BACKEND not in ("like", "fulltext", "memory"):
+        raise ValueError("SEARCH_BACKEND must be 'like', 'fulltext' or 'memory'.")
+    SEARCH_INDEX_MAX_ROOMS: int = int(os.getenv("SEARCH_INDEX_MAX_ROOMS", "100"))
+    # How long the index keeps looking for a message whose id was skipped,
+    # since a transaction may commit a lower id after a higher one
+    SEARCH_INDEX_GAP_TIMEOUT: float = float(os.getenv("SEARCH_INDEX_GAP_TIMEOUT", "60"))  # seconds
+
+    # In-process room directory serving the room list and room search
+    ROOM_DIRECTORY_CHECK_INTERVAL: float = float(os.getenv("ROOM_DIRECTORY_CHECK_INTERVAL", "5"))  # seconds
+    ROOM_DIRECTORY_RELOAD_INTERVAL: float = float(os.getenv("ROOM_DIRECTORY_RELOAD_INTERVAL", "300"))  # seconds
+
+    # Recent message cache serving the first page of room history
+    HISTORY_CACHE_MESSAGES_PER_ROOM: int = int(os.getenv("HISTORY_CACHE_MESSAGES_PER_ROOM", "100"))
+    HISTORY_CACHE_MAX_BYTES: int = int(os.getenv("HISTORY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+    HISTORY_CACHE_IDLE_TTL: float = float(os.getenv("HISTORY_CACHE_IDLE_TTL", "600"))  # seconds
+
+    # Write-behind message persistence
+    MESSAGE_WRITE_BATCH_SIZE: int = int(os.getenv("MESSAGE_WRITE_BATCH_SIZE", "200"))
+    MESSAGE_WRITE_FLUSH_INTERVAL: float = float(os.getenv("MESSAGE_WRITE_FLUSH_INTERVAL", "0.05"))  # seconds
+    MESSAGE_WRITE_QUEUE_SIZE: int = int(os.getenv("MESSAGE_WRITE_QUEUE_SIZE", "10000"))
+    MESSAGE_WRITE_MAX_RETRIES: int = int(os.getenv("MESSAGE_WRITE_MAX_RETRIES", "3"))
+
+    # Room history export and import: rows fetched per round trip from the
+    # server-side cursor, and rows per insert statement and transaction
+    MESSAGE_EXPORT_BATCH_SIZE: int = int(os.getenv("MESSAGE_EXPORT_BATCH_SIZE", "1000"))
+    MESSAGE_IMPORT_BATCH_SIZE: int = int(os.getenv("MESSAGE_IMPORT_BATCH_SIZE", "1000"))
+
+    # Cold archive: messages older than MESSAGE_ARCHIVE_AFTER_DAYS are moved
+    # out of the messages table into compressed files per room and month
+    # (0 keeps everything in the table). Reads decompress whole frames of
+    # MESSAGE_ARCHIVE_FRAME_ROWS messages and keep the most recent
+    # MESSAGE_ARCHIVE_CACHE_FRAMES of them
+    MESSAGE_ARCHIVE_AFTER_DAYS: int = int(os.getenv("MESSAGE_ARCHIVE_AFTER_DAYS", "0"))
+    MESSAGE_ARCHIVE_DIR: str = os.getenv("MESSAGE_ARCHIVE_DIR", "archive")
+    MESSAGE_ARCHIVE_INTERVAL: float = float(os.getenv("MESSAGE_ARCHIVE_INTERVAL", "3600"))  # seconds
+    MESSAGE_ARCHIVE_FRAME_ROWS: int = int(os.getenv("MESSAGE_ARCHIVE_FRAME_ROWS", "5000"))
+    MESSAGE_ARCHIVE_CACHE_FRAMES: int = int(os.getenv("MESSAGE_ARCHIVE_CACHE_FRAMES", "32"))
+
+    # Recount of the per-room message counters, to correct any drift
+    ROOM_STATS_RECONCILE_INTERVAL: float = float(os.getenv("ROOM_STATS_RECONCILE_INTERVAL", "3600"))  # seconds
+    ROOM_STATS_RECONCILE_BATCH: int = int(os.getenv("ROOM_STATS_RECONCILE_BATCH", "500"))  # rooms per query
+
+    # Logging, written to stdout from a background thread
+    LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO").upper()
+    if LOG_LEVEL not in ("DEBUG", "INFO", "WARNING", "ERROR"):
+        raise ValueError("LOG_LEVEL must be DEBUG, INFO, WARNING or ERROR.")
+    LOG_FORMAT: str = os.getenv("LOG_FORMAT", "json")
+    if LOG_FORMAT not in ("json", "text"):
+        raise ValueError("LOG_FORMAT must be 'json' or 'text'.")
+    # Records waiting for the writer thread; further records are dropped
+    LOG_QUEUE_SIZE: int = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+    # Share of high-rate events that are logged, as event=rate pairs
+    LOG_SAMPLE_RATES: dict = {
+        event.strip(): float(rate)
+        for event, rate in (
+            pair.split("=") for pair in os.getenv(
+                "LOG_SAMPLE_RATES",
+                "ws.receive=0.01,ws.broadcast=0.01,ws.message_queued=0.01,backplane.peer_behind=0.01"
+            ).split(",") if pair.strip()
+        )
+    }
+    # Mask tokens, passwords and message content in log records
+    LOG_REDACT: bool = os.getenv("LOG_REDACT", "true").lower() == "true"
 
 settings = Settings()
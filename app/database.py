@@ -1,21 +1,56 @@
-from sqlalchemy import create_engine
+import time
+from sqlalchemy import exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from .config import settings
+from .metrics import db_metrics
 
-# Create a SQLAlchemy engine
-engine = create_engine(settings.DATABASE_URL)
 
-# Create a session factory
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """
+    Queue pool that records how long each checkout waited for a connection.
+    """
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            db_metrics.observe_checkout(time.perf_counter() - started, timed_out=True)
+            raise
+        db_metrics.observe_checkout(time.perf_counter() - started)
+        return connection
+
+
+def engine_options(database_url: str) -> dict:
+    url = make_url(database_url)
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        # An in-memory database only exists within its single connection
+        return {}
+    return {
+        "poolclass": InstrumentedQueuePool,
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING
+    }
+
+# Create a SQLAlchemy engine. Bound parameters, such as message content, are
+# kept out of error messages and so out of the logs.
+engine = create_async_engine(settings.DATABASE_URL, hide_parameters=True, **engine_options(settings.DATABASE_URL))
+db_metrics.instrument(engine)
+
+# Create a session factory. Attributes stay loaded after commit, since
+# refreshing them lazily would need IO outside of an await.
+SessionLocal = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
 
 # Base class for models
 Base = declarative_base()
 
 # Dependency to get DB session
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
\ No newline at end of file
@@ -1,28 +1,25 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from .database import get_db
-from .models.user import User
-from .models.token import RevokedToken
 from .schemas.token import TokenData
 from .config import settings
+from .exceptions import AdminRequiredException
+from .services.auth import get_token_id
+from .services.principals import Principal, resolve_principal
+from .services.revocation import revocation_list
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/login")
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     
-    # Check if token is revoked
-    revoked_token = db.query(RevokedToken).filter(RevokedToken.jti == token).first()
-    if revoked_token:
-        raise credentials_exception
-    
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
         username: str = payload.get("sub")
@@ -32,8 +29,18 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     except JWTError:
         raise credentials_exception
     
-    user = db.query(User).filter(User.username == token_data.username).first()
-    if user is None:
+    # Check if token is revoked
+    jti = get_token_id(payload, token)
+    if revocation_list.is_revoked(jti):
         raise credentials_exception
     
-    return user
\ No newline at end of file
+    principal = await resolve_principal(db, jti, token_data.username)
+    if principal is None:
+        raise credentials_exception
+    
+    return principal
+
+async def get_admin_user(current_user: Principal = Depends(get_current_user)):
+    if current_user.username not in settings.ADMIN_USERNAMES:
+        raise AdminRequiredException()
+    return current_user
@@ -0,0 +1,125 @@
+"""
+Start a fixed set of worker processes with the chat rooms sharded across them.
+
+    python -m app.launcher --workers 4 --host 0.0.0.0 --port 8000
+
+Worker i serves HTTP on port + i, and on a Unix socket in WS_SHARD_IPC_DIR
+through which the other workers relay WebSockets of the rooms it owns. Every
+worker answers every REST request; put the ports behind one load balancer.
+The workers share events over the ipc backplane. A worker that exits is
+started again with the same shard, so room ownership never changes.
+"""
+import argparse
+import multiprocessing
+import os
+import signal
+import socket
+import time
+
+RESTART_DELAY = 1.0  # seconds
+# uvicorn's exit code for a failed startup
+STARTUP_FAILURE = 3
+
+
+def _tcp_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    return sock
+
+
+def _unix_socket(path: str) -> socket.socket:
+    # Left behind by a worker that did not shut down cleanly
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    return sock
+
+
+def serve_shard(index: int, count: int, host: str, port: int, mode: str, log_level: str):
+    # Settings are read on import, so the environment is set first
+    os.environ.update({
+        "WS_SHARD_COUNT": str(count),
+        "WS_SHARD_INDEX": str(index),
+        "WS_SHARD_BASE_PORT": str(port),
+        "WS_SHARD_MODE": mode,
+        "WS_BACKPLANE": "ipc"
+    })
+    import uvicorn
+    from .config import settings
+    from .websockets.sharding import shard_socket_path
+
+    os.makedirs(settings.WS_SHARD_IPC_DIR, exist_ok=True)
+    sockets = [_tcp_socket(host, port + index), _unix_socket(shard_socket_path(settings.WS_SHARD_IPC_DIR, index))]
+    config = uvicorn.Config(
+        "app.main:app",
+        ws="websockets",
+        ws_per_message_deflate=True,
+        ws_ping_interval=settings.WS_PING_INTERVAL,
+        ws_ping_timeout=settings.WS_PING_TIMEOUT,
+        log_level=log_level
+    )
+    server = uvicorn.Server(config)
+    server.run(sockets=sockets)
+    if not server.started:
+        # Exit now so the launcher starts the shard again; threads left by the
+        # failed startup would keep the process alive
+        os._exit(STARTUP_FAILURE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--mode", choices=("proxy", "redirect"), default=os.getenv("WS_SHARD_MODE", "proxy"))
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    # Imported here, not at the top, as spawned workers import this module
+    # again before setting their environment
+    from .log import configure_logging, get_logger
+    configure_logging()
+    logger = get_logger("launcher")
+
+    # Fresh interpreters, so no worker inherits another's event loop or settings
+    context = multiprocessing.get_context("spawn")
+
+    def start(index: int):
+        process = context.Process(
+            target=serve_shard,
+            args=(index, args.workers, args.host, args.port, args.mode, args.log_level),
+            name=f"shard-{index}"
+        )
+        process.start()
+        return process
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    workers = {index: start(index) for index in range(args.workers)}
+    logger.info("launcher.started", shards=args.workers, first_port=args.port, last_port=args.port + args.workers - 1, mode=args.mode)
+    while not stopping:
+        time.sleep(RESTART_DELAY)
+        for index, process in list(workers.items()):
+            if not process.is_alive() and not stopping:
+                logger.warning("launcher.shard_restarted", index=index, exitcode=process.exitcode)
+                workers[index] = start(index)
+
+    for process in workers.values():
+        process.terminate()
+    for process in workers.values():
+        process.join()
+
+
+if __name__ == "__main__":
+    main()
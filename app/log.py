@@ -0,0 +1,142 @@
+import atexit
+import json
+import logging
+import queue
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+from .config import settings
+
+# Field values never written out as they are
+REDACTED_FIELDS = {"token", "password", "content", "payload", "data"}
+
+
+def _redact(key: str, value):
+    if key == "token" and isinstance(value, str):
+        # Enough to tell tokens apart in the logs, not enough to use one
+        return f"{value[:6]}..." if len(value) > 6 else "..."
+    if isinstance(value, (str, bytes)):
+        return f"<{len(value)} chars>"
+    return "<redacted>"
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    Renders an event and its fields as one JSON object per line, or as
+    key=value pairs, redacting sensitive fields.
+    """
+
+    def __init__(self, output: str, redact: bool):
+        super().__init__()
+        self.output = output
+        self.redact = redact
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = dict(getattr(record, "fields", {}))
+        if self.redact:
+            for key in REDACTED_FIELDS.intersection(fields):
+                fields[key] = _redact(key, fields[key])
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "event": record.getMessage(),
+            **fields
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+
+        if self.output == "json":
+            return json.dumps(entry, default=str)
+        head = f"{entry.pop('ts')} {entry.pop('level').upper():7} {entry.pop('logger')} {entry.pop('event')}"
+        return " ".join([head] + [f"{key}={value}" for key, value in entry.items()])
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    Hands records to the listener thread without ever blocking the event
+    loop: when the queue is full the record is dropped and counted.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Formatting happens on the listener thread
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class StructuredLogger:
+    """
+    Logs events with keyword fields, e.g.
+    logger.info("ws.connect", room_id=1, user_id=2). High-rate events listed
+    in LOG_SAMPLE_RATES are only logged once every 1/rate occurrences.
+    """
+
+    def __init__(self, logger: logging.Logger, sample_rates: Dict[str, float]):
+        self.logger = logger
+        self.sample_every = {event: max(1, round(1 / rate)) for event, rate in sample_rates.items() if rate > 0}
+        self.seen: Dict[str, int] = {}
+
+    def debug(self, event: str, **fields):
+        self._log(logging.DEBUG, event, fields)
+
+    def info(self, event: str, **fields):
+        self._log(logging.INFO, event, fields)
+
+    def warning(self, event: str, **fields):
+        self._log(logging.WARNING, event, fields)
+
+    def error(self, event: str, exc_info: bool = False, **fields):
+        self._log(logging.ERROR, event, fields, exc_info)
+
+    def _log(self, level: int, event: str, fields: dict, exc_info: bool = False):
+        if not self.logger.isEnabledFor(level):
+            return
+        every = self.sample_every.get(event)
+        if every is not None and every > 1:
+            count = self.seen.get(event, 0)
+            self.seen[event] = count + 1
+            if count % every:
+                return
+            fields["sampled"] = f"1/{every}"
+        self.logger.log(level, event, extra={"fields": fields}, exc_info=exc_info)
+
+
+_handler: Optional[DroppingQueueHandler] = None
+_listener: Optional[QueueListener] = None
+
+def configure_logging():
+    """
+    Route the app's loggers through a bounded queue to a writer thread.
+    """
+    global _handler, _listener
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(StructuredFormatter(settings.LOG_FORMAT, settings.LOG_REDACT))
+    _handler = DroppingQueueHandler(queue.Queue(maxsize=settings.LOG_QUEUE_SIZE))
+    _listener = QueueListener(_handler.queue, output)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    root = logging.getLogger("chat")
+    root.setLevel(settings.LOG_LEVEL)
+    root.addHandler(_handler)
+    root.propagate = False
+
+def dropped_records() -> int:
+    return _handler.dropped if _handler is not None else 0
+
+def get_logger(name: str) -> StructuredLogger:
+    return StructuredLogger(logging.getLogger(f"chat.{name}"), settings.LOG_SAMPLE_RATES)
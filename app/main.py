@@ -1,27 +1,64 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, WebSocket, Depends, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
 import uvicorn
 
-from .database import engine, Base, get_db
+from .database import engine, Base
 from .config import settings
-from .api import auth, chat
-from .websockets.connection import websocket_endpoint
+from .dependencies import get_admin_user
+from .log import configure_logging
+from .metrics import db_metrics
+from .api import auth, chat, metrics
+from .services.archive import message_archive
+from .services.passwords import password_hasher
+from .services.persistence import message_writer
+from .services.principals import Principal, principal_cache
+from .services.revocation import revocation_list
+from .services.room_stats import room_stats_reconciler
+from .services.rooms import room_directory
+from .websockets.backplane import backplane
+from .websockets.connection import manager, websocket_endpoint
+from .websockets.presence import presence_tracker
 
-# Create database tables
-Base.metadata.create_all(bind=engine)
+configure_logging()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Create database tables
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    await backplane.start()
+    await revocation_list.start()
+    message_writer.start()
+    await room_stats_reconciler.start()
+    await message_archive.start()
+    await room_directory.start()
+    await presence_tracker.start()
+    await manager.start()
+    yield
+    # Flush messages that are still waiting to be written
+    await message_writer.stop()
+    await room_stats_reconciler.stop()
+    await message_archive.stop()
+    await room_directory.stop()
+    await revocation_list.stop()
+    await manager.stop()
+    await presence_tracker.stop()
+    await backplane.stop()
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
     version=settings.PROJECT_VERSION,
     docs_url="/api/docs",
     redoc_url="/api/redoc",
-    openapi_url="/api/openapi.json"
+    openapi_url="/api/openapi.json",
+    lifespan=lifespan
 )
 
 # Include routers
 app.include_router(auth.router, prefix="/api")
 app.include_router(chat.router, prefix="/api")
+app.include_router(metrics.router, prefix="/api")
 
 # WebSocket endpoint
 @app.websocket("/ws/{room_id}")
@@ -29,9 +66,9 @@ async def websocket_chat_endpoint(
     websocket: WebSocket,
     room_id: int,
     token: str = Query(...),
-    db: Session = Depends(get_db)
+    batch: bool = Query(False)
 ):
-    await websocket_endpoint(websocket, room_id, token, db)
+    await websocket_endpoint(websocket, room_id, token, batch)
 
 @app.get("/api/health", tags=["Health"])
 async def health_check():
@@ -40,5 +77,26 @@ async def health_check():
     """
     return {"status": "ok", "version": settings.PROJECT_VERSION}
 
+@app.get("/api/admin/db-stats", tags=["Admin"])
+async def database_stats(top: int = 20, current_user: Principal = Depends(get_admin_user)):
+    """
+    Connection pool usage and the slowest statements by total time.
+    """
+    return db_metrics.stats(top=top)
+
+@app.get("/api/admin/auth-stats", tags=["Admin"])
+async def authentication_stats(current_user: Principal = Depends(get_admin_user)):
+    """
+    Password hashing queue depth and principal cache hit rate.
+    """
+    return {"password_hasher": password_hasher.stats(), "principal_cache": principal_cache.stats()}
+
 if __name__ == "__main__":
-    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    uvicorn.run(
+        "app.main:app",
+        host="0.0.0.0",
+        port=8000,
+        reload=True,
+        ws_ping_interval=settings.WS_PING_INTERVAL,
+        ws_ping_timeout=settings.WS_PING_TIMEOUT
+    )
\ No newline at end of file
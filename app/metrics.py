@@ -0,0 +1,258 @@
+import os
+import resource
+import sys
+import time
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+# Latency buckets in seconds, from half a millisecond to ten seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# For in-memory work such as queueing a broadcast, from 10us to 100ms
+FAST_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1)
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram of observed values, cheap enough to update on
+    every statement. Quantiles are estimated as the upper bound of the bucket
+    they fall in.
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        # One count per bucket plus one for values above the last bound
+        self.counts: List[int] = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        """
+        Summary in milliseconds.
+        """
+        return {
+            "count": self.count,
+            "total_ms": round(self.sum * 1000, 3),
+            "mean_ms": round(self.sum / self.count * 1000, 3) if self.count else 0.0,
+            "p50_ms": round(self.quantile(0.5) * 1000, 3),
+            "p95_ms": round(self.quantile(0.95) * 1000, 3),
+            "p99_ms": round(self.quantile(0.99) * 1000, 3),
+            "max_ms": round(self.max * 1000, 3)
+        }
+
+
+class DatabaseMetrics:
+    """
+    Connection pool and statement statistics of the engine, collected from
+    SQLAlchemy events. Statements are keyed by their SQL with placeholders,
+    so each query the app issues gets its own latency histogram.
+    """
+
+    MAX_STATEMENTS = 200
+
+    def __init__(self):
+        self.checkout_wait = Histogram()
+        self.checkout_timeouts = 0
+        self.checked_out = 0
+        self.max_checked_out = 0
+        self.connections_created = 0
+        self.connections_invalidated = 0
+        self.statements: Dict[str, Histogram] = {}
+        self.engine = None
+
+    def instrument(self, engine):
+        self.engine = engine
+        sync_engine = engine.sync_engine
+        event.listen(sync_engine, "before_cursor_execute", self._before_execute)
+        event.listen(sync_engine, "after_cursor_execute", self._after_execute)
+        event.listen(sync_engine, "handle_error", self._on_error)
+        event.listen(sync_engine.pool, "connect", self._on_connect)
+        event.listen(sync_engine.pool, "checkout", self._on_checkout)
+        event.listen(sync_engine.pool, "checkin", self._on_checkin)
+        event.listen(sync_engine.pool, "invalidate", self._on_invalidate)
+
+    def observe_checkout(self, seconds: float, timed_out: bool = False):
+        self.checkout_wait.observe(seconds)
+        if timed_out:
+            self.checkout_timeouts += 1
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("statement_started", []).append(time.perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["statement_started"].pop()
+        self._statement_histogram(statement, context).observe(time.perf_counter() - started)
+
+    def _on_error(self, exception_context):
+        connection = exception_context.connection
+        if connection is not None and connection.info.get("statement_started"):
+            connection.info["statement_started"].pop()
+
+    def _statement_histogram(self, statement: str, context) -> Histogram:
+        # The compiled string keeps expanding IN parameters as one placeholder
+        if context is not None and context.compiled is not None:
+            statement = context.compiled.string
+        key = " ".join(statement.split())
+        histogram = self.statements.get(key)
+        if histogram is None:
+            if len(self.statements) >= self.MAX_STATEMENTS:
+                key = "other"
+                histogram = self.statements.get(key)
+            if histogram is None:
+                histogram = self.statements[key] = Histogram()
+        return histogram
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        self.connections_created += 1
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        self.checked_out += 1
+        if self.checked_out > self.max_checked_out:
+            self.max_checked_out = self.checked_out
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        self.checked_out -= 1
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        self.connections_invalidated += 1
+
+    def stats(self, top: Optional[int] = None):
+        # The pool is replaced when the engine is disposed, so look it up now
+        pool = self.engine.sync_engine.pool if self.engine is not None else None
+        pool_stats = {
+            "class": type(pool).__name__ if pool is not None else None,
+            "checked_out": self.checked_out,
+            "max_checked_out": self.max_checked_out,
+            "connections_created": self.connections_created,
+            "connections_invalidated": self.connections_invalidated,
+            "checkout_timeouts": self.checkout_timeouts,
+            "checkout_wait": self.checkout_wait.snapshot()
+        }
+        if isinstance(pool, QueuePool):
+            pool_stats.update({
+                "size": pool.size(),
+                "checked_in": pool.checkedin(),
+                "overflow": max(pool.overflow(), 0)
+            })
+
+        statements = sorted(self.statements.items(), key=lambda item: item[1].sum, reverse=True)
+        if top is not None:
+            statements = statements[:top]
+        return {
+            "pool": pool_stats,
+            "statements": [{"statement": key, **histogram.snapshot()} for key, histogram in statements]
+        }
+
+
+class RealtimeMetrics:
+    """
+    Counters and latency histograms of the WebSocket path. They are only
+    updated from the event loop thread, so plain attributes need no locks.
+    """
+
+    def __init__(self):
+        self.messages_received = 0
+        self.broadcasts = 0
+        # Payloads queued for a socket, i.e. broadcasts times recipients
+        self.deliveries = 0
+        self.dropped = 0
+        self.send_failures = 0
+        self.slow_consumer_disconnects = 0
+        self.pings = 0
+        # Sockets closed by the heartbeat sweep, by reason
+        self.reaped: Dict[str, int] = {}
+        # Presence diffs sent to rooms
+        self.presence_events = 0
+        # Batched frames sent to coalescing sockets, and the events they held
+        self.coalesced_frames = 0
+        self.coalesced_events = 0
+        # Queueing a broadcast for every local socket in the room
+        self.fanout_time = Histogram(FAST_BUCKETS)
+        # From queueing a payload for a socket until it has been sent
+        self.delivery_time = Histogram()
+        # From handing a message to the message writer until it is committed
+        self.persist_time = Histogram()
+        self.flush_time = Histogram()
+
+
+def resident_memory_bytes() -> int:
+    """
+    Resident set size of this process; the peak size where /proc is not
+    available.
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on macOS
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labels: Dict[str, object]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label(value)}"' for key, value in labels.items()) + "}"
+
+
+class PrometheusText:
+    """
+    Builds a page in the Prometheus text exposition format.
+    """
+
+    def __init__(self):
+        self.lines: List[str] = []
+
+    def metric(self, name: str, kind: str, help_text: str, samples: Iterable[Tuple[Dict[str, object], float]]):
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            self.lines.append(f"{name}{_format_labels(labels)} {value}")
+
+    def counter(self, name: str, help_text: str, value: float):
+        self.metric(name, "counter", help_text, [({}, value)])
+
+    def gauge(self, name: str, help_text: str, value: float):
+        self.metric(name, "gauge", help_text, [({}, value)])
+
+    def histogram(self, name: str, help_text: str, histogram: Histogram):
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} histogram")
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            self.lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+        self.lines.append(f'{name}_bucket{{le="+Inf"}} {histogram.count}')
+        self.lines.append(f"{name}_sum {histogram.sum}")
+        self.lines.append(f"{name}_count {histogram.count}")
+
+    def render(self) -> str:
+        return "\n".join(self.lines) + "\n"
+
+
+db_metrics = DatabaseMetrics()
+realtime_metrics = RealtimeMetrics()
@@ -10,6 +10,9 @@ class ChatRoom(Base):
     name = Column(String(100), unique=True, nullable=False)
     created_by = Column(Integer, ForeignKey("users.id"), nullable=False)
     created_at = Column(DateTime, default=func.now())
+    # Maintained by both message write paths, see services/room_stats.py
+    message_count = Column(Integer, nullable=False, default=0, server_default="0")
+    last_message_at = Column(DateTime, nullable=True)
     
     # Relationships
     creator = relationship("User", back_populates="chat_rooms")
@@ -7,4 +7,6 @@ class RevokedToken(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     jti = Column(String(255), unique=True, nullable=False)
-    revoked_at = Column(DateTime, default=func.now())
\ No newline at end of file
+    revoked_at = Column(DateTime, default=func.now())
+    # Expiry of the revoked token; the row can be deleted after this
+    expires_at = Column(DateTime, nullable=True, index=True)
\ No newline at end of file
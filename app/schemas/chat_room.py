@@ -1,6 +1,6 @@
 from pydantic import BaseModel, Field
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 
 class ChatRoomBase(BaseModel):
     name: str = Field(..., min_length=1, max_length=100)
@@ -12,10 +12,20 @@ class ChatRoomResponse(ChatRoomBase):
     id: int
     created_by: int
     created_at: datetime
+    message_count: int = 0
+    last_message_at: Optional[datetime] = None
     
     class Config:
         from_attributes = True
 
 class ChatRoomDetailResponse(ChatRoomResponse):
     creator_username: Optional[str] = None
-    message_count: Optional[int] = None
\ No newline at end of file
+
+class PresenceUser(BaseModel):
+    user_id: int
+    username: str
+
+class RoomPresenceResponse(BaseModel):
+    room_id: int
+    count: int
+    users: List[PresenceUser]
\ No newline at end of file
@@ -18,4 +18,8 @@ class MessageResponse(MessageBase):
         from_attributes = True
 
 class MessageDetailResponse(MessageResponse):
-    username: str
\ No newline at end of file
+    username: str
+
+class MessageImportResponse(BaseModel):
+    imported: int
+    skipped: int
\ No newline at end of file
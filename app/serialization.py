@@ -0,0 +1,48 @@
+import json
+from typing import List, Optional
+
+import orjson
+from fastapi import Response
+
+# Field order of MessageDetailResponse. Message dicts are built in this order
+# so they encode to the same bytes FastAPI would produce for the response model
+MESSAGE_FIELDS = ("content", "id", "user_id", "room_id", "timestamp", "username")
+
+
+def message_dict(row) -> dict:
+    return {
+        "content": row.content,
+        "id": row.id,
+        "user_id": row.user_id,
+        "room_id": row.room_id,
+        "timestamp": row.timestamp,
+        "username": row.username
+    }
+
+
+def encode_messages(messages: List[dict]) -> bytes:
+    """
+    A list of messages as the JSON array the MessageDetailResponse list model
+    would render, without validating each message through it again.
+    """
+    if any(tuple(message) != MESSAGE_FIELDS for message in messages):
+        messages = [{field: message[field] for field in MESSAGE_FIELDS} for message in messages]
+    return orjson.dumps(messages)
+
+
+def message_list_response(messages: List[dict], next_cursor: Optional[str] = None) -> Response:
+    response = Response(encode_messages(messages), media_type="application/json")
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return response
+
+
+def encode_event(event: dict) -> str:
+    """
+    A WebSocket or backplane event as JSON text.
+    """
+    try:
+        return orjson.dumps(event).decode()
+    except orjson.JSONEncodeError:
+        # orjson refuses lone surrogates, which the json module escapes
+        return json.dumps(event)
@@ -0,0 +1,408 @@
+import asyncio
+import fcntl
+import heapq
+import itertools
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import orjson
+import zstandard
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..config import settings
+from ..database import SessionLocal
+from ..log import get_logger
+from ..models.chat_room import ChatRoom
+from ..models.message import Message
+from ..models.user import User
+from ..serialization import message_dict
+
+logger = get_logger("archive")
+
+# Messages are ordered by (timestamp, id) everywhere, as on idx_messages_room_ts_id
+Key = Tuple[datetime, int]
+
+ZSTD_LEVEL = 9
+# How often a worker looks for manifests rewritten by another worker
+MANIFEST_CHECK_INTERVAL = 1.0  # seconds
+DELETE_CHUNK = 1000
+
+
+def message_key(message: dict) -> Key:
+    return message["timestamp"], message["id"]
+
+
+def _decode(line: bytes) -> dict:
+    message = orjson.loads(line)
+    message["timestamp"] = datetime.fromisoformat(message["timestamp"])
+    return message
+
+
+class _Frame:
+    """
+    One zstd frame of a month file: a batch of messages in key order. A
+    frame stays pending until its rows have been deleted from the table.
+    """
+
+    __slots__ = ("month", "offset", "length", "count", "first", "last", "min_id", "max_id", "pending")
+
+    def __init__(self, month: str, offset: int, length: int, messages: List[dict], pending: bool = True):
+        self.month = month
+        self.offset = offset
+        self.length = length
+        self.count = len(messages)
+        self.first = message_key(messages[0])
+        self.last = message_key(messages[-1])
+        ids = [message["id"] for message in messages]
+        self.min_id = min(ids)
+        self.max_id = max(ids)
+        self.pending = pending
+
+    def to_json(self) -> dict:
+        return {
+            "month": self.month,
+            "offset": self.offset,
+            "length": self.length,
+            "count": self.count,
+            "first": [self.first[0].isoformat(), self.first[1]],
+            "last": [self.last[0].isoformat(), self.last[1]],
+            "min_id": self.min_id,
+            "max_id": self.max_id,
+            "pending": self.pending
+        }
+
+    @classmethod
+    def from_json(cls, data: dict) -> "_Frame":
+        frame = cls.__new__(cls)
+        frame.month = data["month"]
+        frame.offset = data["offset"]
+        frame.length = data["length"]
+        frame.count = data["count"]
+        frame.first = (datetime.fromisoformat(data["first"][0]), data["first"][1])
+        frame.last = (datetime.fromisoformat(data["last"][0]), data["last"][1])
+        frame.min_id = data["min_id"]
+        frame.max_id = data["max_id"]
+        frame.pending = data["pending"]
+        return frame
+
+
+class _Manifest:
+    def __init__(self, frames: List[_Frame], mtime: Optional[float]):
+        self.frames = frames
+        self.mtime = mtime
+        self.checked_at = time.monotonic()
+
+
+class MessageArchive:
+    """
+    Cold storage for messages older than MESSAGE_ARCHIVE_AFTER_DAYS, as
+    zstd-compressed NDJSON on local disk: one file per room and month under
+    MESSAGE_ARCHIVE_DIR, made of frames of up to MESSAGE_ARCHIVE_FRAME_ROWS
+    messages in key order. Each room has a manifest listing its frames with
+    their key and id ranges, so a page read only decompresses the frames it
+    needs. Frames are appended and listed in the manifest before their rows
+    are deleted from the table; a crash in between leaves duplicates, which
+    reads drop by id, and the next run finishes the delete.
+
+    Every worker reads the archive; archiving runs on one worker per host at
+    a time, under a file lock. Several hosts need MESSAGE_ARCHIVE_DIR on
+    shared storage.
+    """
+
+    def __init__(self, directory: str, archive_after_days: int, interval: float, frame_rows: int, cache_frames: int):
+        self.directory = directory
+        self.archive_after_days = archive_after_days
+        self.interval = interval
+        self.frame_rows = frame_rows
+        self.cache_frames = cache_frames
+        self.manifests: Dict[int, _Manifest] = {}
+        self.frame_cache: "OrderedDict[Tuple[int, str, int], List[dict]]" = OrderedDict()
+        self.lock_file = None
+        self.task: Optional[asyncio.Task] = None
+        self.moved = 0
+        self.frame_reads = 0
+        self.cache_hits = 0
+
+    # Manifests
+
+    def _room_directory(self, room_id: int) -> str:
+        return os.path.join(self.directory, str(room_id))
+
+    def _manifest_path(self, room_id: int) -> str:
+        return os.path.join(self._room_directory(room_id), "manifest.json")
+
+    def _frames(self, room_id: int) -> List[_Frame]:
+        manifest = self.manifests.get(room_id)
+        if manifest is None or time.monotonic() - manifest.checked_at >= MANIFEST_CHECK_INTERVAL:
+            manifest = self._load_manifest(room_id, manifest)
+        return manifest.frames
+
+    def _load_manifest(self, room_id: int, manifest: Optional[_Manifest]) -> _Manifest:
+        path = self._manifest_path(room_id)
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            mtime = None
+        if manifest is not None and manifest.mtime == mtime:
+            manifest.checked_at = time.monotonic()
+            return manifest
+        frames = []
+        if mtime is not None:
+            with open(path, "rb") as manifest_file:
+                frames = [_Frame.from_json(frame) for frame in orjson.loads(manifest_file.read())["frames"]]
+        manifest = self.manifests[room_id] = _Manifest(frames, mtime)
+        return manifest
+
+    def _save_manifest(self, room_id: int, frames: List[_Frame]):
+        path = self._manifest_path(room_id)
+        temporary = path + ".tmp"
+        with open(temporary, "wb") as manifest_file:
+            manifest_file.write(orjson.dumps({"frames": [frame.to_json() for frame in frames]}))
+            manifest_file.flush()
+            os.fsync(manifest_file.fileno())
+        os.replace(temporary, path)
+        self.manifests[room_id] = _Manifest(frames, os.stat(path).st_mtime)
+
+    def has_messages(self, room_id: int) -> bool:
+        return bool(self._frames(room_id))
+
+    def settled(self, room_id: int) -> bool:
+        """
+        Whether no frame of the room is waiting for its rows to be deleted
+        from the table, so the archive and the table do not overlap.
+        """
+        return not any(frame.pending for frame in self._frames(room_id))
+
+    def count(self, room_id: int) -> int:
+        return sum(frame.count for frame in self._frames(room_id))
+
+    def last_timestamp(self, room_id: int) -> Optional[datetime]:
+        return max((frame.last[0] for frame in self._frames(room_id)), default=None)
+
+    def key_range(self, room_id: int) -> Optional[Tuple[Key, Key]]:
+        frames = self._frames(room_id)
+        if not frames:
+            return None
+        return min(frame.first for frame in frames), max(frame.last for frame in frames)
+
+    # Reading
+
+    def _read_frame(self, room_id: int, frame: _Frame) -> List[dict]:
+        with open(os.path.join(self._room_directory(room_id), f"{frame.month}.ndjson.zst"), "rb") as month_file:
+            month_file.seek(frame.offset)
+            data = zstandard.ZstdDecompressor().decompress(month_file.read(frame.length))
+        return [_decode(line) for line in data.splitlines()]
+
+    async def _read(self, room_id: int, frame: _Frame, cache: bool = True) -> List[dict]:
+        cache_key = (room_id, frame.month, frame.offset)
+        messages = self.frame_cache.get(cache_key)
+        if messages is not None:
+            self.frame_cache.move_to_end(cache_key)
+            self.cache_hits += 1
+            return messages
+        self.frame_reads += 1
+        messages = await asyncio.to_thread(self._read_frame, room_id, frame)
+        if cache:
+            self.frame_cache[cache_key] = messages
+            while len(self.frame_cache) > self.cache_frames:
+                self.frame_cache.popitem(last=False)
+        return messages
+
+    async def page(self, room_id: int, direction: str, key: Optional[Key], limit: int, skip: int = 0) -> List[dict]:
+        """
+        Archived messages of a room past key: newest first for "before",
+        oldest first for "after". Without a key the page starts at the
+        newest or oldest message.
+        """
+        newest_first = direction == "before"
+        wanted = skip + limit
+        if newest_first:
+            frames = sorted((f for f in self._frames(room_id) if key is None or f.first < key), key=lambda f: f.last, reverse=True)
+        else:
+            frames = sorted((f for f in self._frames(room_id) if key is None or f.last > key), key=lambda f: f.first)
+
+        found: Dict[int, dict] = {}
+        ordered: List[dict] = []
+        for frame in frames:
+            if len(ordered) >= wanted:
+                boundary = message_key(ordered[wanted - 1])
+                # Frames are visited by their nearest key, so no later one can do better
+                if (frame.last < boundary) if newest_first else (frame.first > boundary):
+                    break
+            for message in await self._read(room_id, frame):
+                if key is None or ((message_key(message) < key) if newest_first else (message_key(message) > key)):
+                    found[message["id"]] = message
+            ordered = sorted(found.values(), key=message_key, reverse=newest_first)[:wanted]
+            found = {message["id"]: message for message in ordered}
+        return ordered[skip:wanted]
+
+    async def find(self, room_id: int, message_id: int) -> Optional[dict]:
+        for frame in self._frames(room_id):
+            if frame.min_id <= message_id <= frame.max_id:
+                for message in await self._read(room_id, frame):
+                    if message["id"] == message_id:
+                        return message
+        return None
+
+    async def iter_messages(self, room_id: int) -> AsyncIterator[dict]:
+        """
+        Every archived message of a room, oldest first, holding only the
+        frames whose key ranges overlap in memory.
+        """
+        frames = sorted(self._frames(room_id), key=lambda f: f.first)
+        heap: List[tuple] = []
+        sequence = itertools.count()
+        position = 0
+        last_id = None
+        while position < len(frames) or heap:
+            while position < len(frames) and (not heap or frames[position].first <= heap[0][0]):
+                for message in await self._read(room_id, frames[position], cache=False):
+                    heapq.heappush(heap, (message_key(message), next(sequence), message))
+                position += 1
+            _, _, message = heapq.heappop(heap)
+            if message["id"] != last_id:
+                last_id = message["id"]
+                yield message
+
+    # Archiving
+
+    def _append_frame(self, room_id: int, month: str, messages: List[dict]) -> _Frame:
+        os.makedirs(self._room_directory(room_id), exist_ok=True)
+        path = os.path.join(self._room_directory(room_id), f"{month}.ndjson.zst")
+        # Anything past the last listed frame was left by an interrupted run
+        committed = max((f.offset + f.length for f in self._frames(room_id) if f.month == month), default=0)
+        data = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(
+            b"".join(orjson.dumps(message, option=orjson.OPT_APPEND_NEWLINE) for message in messages)
+        )
+        with open(path, "ab") as month_file:
+            month_file.truncate(committed)
+            month_file.write(data)
+            month_file.flush()
+            os.fsync(month_file.fileno())
+        frame = _Frame(month, committed, len(data), messages)
+        self._save_manifest(room_id, self._frames(room_id) + [frame])
+        return frame
+
+    async def _finish(self, db: AsyncSession, room_id: int, frame: _Frame, ids: List[int]):
+        for start in range(0, len(ids), DELETE_CHUNK):
+            await db.execute(delete(Message).where(Message.id.in_(ids[start:start + DELETE_CHUNK])))
+        await db.commit()
+        frame.pending = False
+        await asyncio.to_thread(self._save_manifest, room_id, self._frames(room_id))
+
+    async def archive_room(self, db: AsyncSession, room_id: int, cutoff: datetime) -> int:
+        self._load_manifest(room_id, None)
+        moved = 0
+        for frame in [f for f in self._frames(room_id) if f.pending]:
+            messages = await self._read(room_id, frame, cache=False)
+            await self._finish(db, room_id, frame, [message["id"] for message in messages])
+            moved += len(messages)
+
+        while True:
+            rows = (await db.execute(
+                select(Message.id, Message.content, Message.user_id, Message.room_id, Message.timestamp, User.username)
+                .join(User, User.id == Message.user_id)
+                .where(Message.room_id == room_id, Message.timestamp < cutoff)
+                .order_by(Message.timestamp, Message.id)
+                .limit(self.frame_rows)
+            )).all()
+            if not rows:
+                return moved
+            messages = [message_dict(row) for row in rows]
+            for month, group in itertools.groupby(messages, key=lambda message: message["timestamp"].strftime("%Y-%m")):
+                group = list(group)
+                frame = await asyncio.to_thread(self._append_frame, room_id, month, group)
+                await self._finish(db, room_id, frame, [message["id"] for message in group])
+            moved += len(rows)
+
+    async def archive(self, db: AsyncSession) -> int:
+        """
+        Move every message older than the cutoff into the archive, room by
+        room. Returns how many were moved.
+        """
+        cutoff = datetime.utcnow() - timedelta(days=self.archive_after_days)
+        moved = 0
+        last_id = 0
+        while True:
+            room_ids = (await db.scalars(
+                select(ChatRoom.id).where(ChatRoom.id > last_id).order_by(ChatRoom.id).limit(500)
+            )).all()
+            if not room_ids:
+                break
+            last_id = room_ids[-1]
+            for room_id in room_ids:
+                moved += await self.archive_room(db, room_id, cutoff)
+        self.moved += moved
+        logger.info("archive.run", moved=moved, cutoff=cutoff.isoformat())
+        return moved
+
+    def _try_lock(self) -> bool:
+        if self.lock_file is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self.lock_file = open(os.path.join(self.directory, ".lock"), "w")
+        try:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+
+    async def start(self):
+        if self.archive_after_days > 0:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def _run(self):
+        while True:
+            try:
+                if self._try_lock():
+                    try:
+                        async with SessionLocal() as db:
+                            await self.archive(db)
+                    finally:
+                        fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+            except Exception as e:
+                logger.error("archive.run_failed", error=str(e))
+            await asyncio.sleep(self.interval)
+
+    def stats(self):
+        return {
+            "moved": self.moved,
+            "frame_reads": self.frame_reads,
+            "cache_hits": self.cache_hits,
+            "cached_frames": len(self.frame_cache)
+        }
+
+
+async def merge_sorted(first: AsyncIterator[dict], second: AsyncIterator[dict]) -> AsyncIterator[dict]:
+    """
+    Merge two streams of messages in key order, dropping duplicates.
+    """
+    left = await anext(first, None)
+    right = await anext(second, None)
+    while left is not None or right is not None:
+        if right is None or (left is not None and message_key(left) <= message_key(right)):
+            message, left = left, await anext(first, None)
+        else:
+            message, right = right, await anext(second, None)
+        if left is not None and left["id"] == message["id"]:
+            left = await anext(first, None)
+        if right is not None and right["id"] == message["id"]:
+            right = await anext(second, None)
+        yield message
+
+
+message_archive = MessageArchive(
+    directory=settings.MESSAGE_ARCHIVE_DIR,
+    archive_after_days=settings.MESSAGE_ARCHIVE_AFTER_DAYS,
+    interval=settings.MESSAGE_ARCHIVE_INTERVAL,
+    frame_rows=settings.MESSAGE_ARCHIVE_FRAME_ROWS,
+    cache_frames=settings.MESSAGE_ARCHIVE_CACHE_FRAMES
+)
@@ -1,58 +1,87 @@
+import uuid
 from datetime import datetime, timedelta
-from jose import jwt
-from passlib.context import CryptContext
-from sqlalchemy.orm import Session
+from jose import ExpiredSignatureError, JWTError, jwt
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import HTTPException, status
 
 from ..models.user import User
 from ..models.token import RevokedToken
 from ..config import settings
-from ..exceptions import UserNotFoundException, InvalidPasswordException, UserAlreadyExistsException
+from ..log import get_logger
+from ..exceptions import CredentialsException, UserNotFoundException, InvalidPasswordException, UserAlreadyExistsException
+from .passwords import password_hasher
+from .principals import principal_cache
+from .revocation import revocation_list
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+logger = get_logger("auth")
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password, hashed_password):
+    return await password_hasher.verify_and_update(plain_password, hashed_password)
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def get_password_hash(password):
+    return await password_hasher.hash(password)
 
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "jti": uuid.uuid4().hex})
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
-def authenticate_user(db: Session, username: str, password: str):
-    user = db.query(User).filter(User.username == username).first()
+async def authenticate_user(db: AsyncSession, username: str, password: str):
+    user = await db.scalar(select(User).where(User.username == username))
     if not user:
+        logger.info("auth.login_failed", username=username, reason="unknown user")
         raise UserNotFoundException()
-    if not verify_password(password, user.password):
+    valid, new_hash = await verify_password(password, user.password)
+    if not valid:
+        logger.info("auth.login_failed", username=username, reason="invalid password")
         raise InvalidPasswordException()
+    if new_hash:
+        # Stored with an outdated cost factor
+        user.password = new_hash
+        await db.commit()
+        logger.info("auth.password_rehashed", user_id=user.id)
     return user
 
-def register_user(db: Session, username: str, email: str, password: str):
+async def register_user(db: AsyncSession, username: str, email: str, password: str):
     # Check if username or email already exists
-    existing_user = db.query(User).filter(
+    existing_user = await db.scalar(select(User).where(
         (User.username == username) | (User.email == email)
-    ).first()
+    ))
     
     if existing_user:
         raise UserAlreadyExistsException()
     
     # Create new user
-    hashed_password = get_password_hash(password)
+    hashed_password = await get_password_hash(password)
     db_user = User(username=username, email=email, password=hashed_password)
     
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     
     return db_user
 
-def revoke_token(db: Session, token: str):
-    revoked_token = RevokedToken(jti=token)
-    db.add(revoked_token)
-    db.commit()
+def get_token_id(payload: dict, token: str) -> str:
+    # Tokens issued before jti was added are identified by the token itself
+    return payload.get("jti") or token
+
+async def revoke_token(db: AsyncSession, token: str):
+    try:
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+    except ExpiredSignatureError:
+        # Nothing to revoke, the token is no longer accepted anyway
+        return {"message": "Successfully logged out"}
+    except JWTError:
+        raise CredentialsException()
+
+    jti = get_token_id(payload, token)
+    if not revocation_list.is_revoked(jti):
+        expires_at = datetime.utcfromtimestamp(payload["exp"])
+        db.add(RevokedToken(jti=jti, expires_at=expires_at))
+        await db.commit()
+        await revocation_list.revoke(jti, expires_at)
+    principal_cache.invalidate_token(jti)
     return {"message": "Successfully logged out"}
\ No newline at end of file
@@ -1,5 +1,6 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from datetime import datetime
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
 from typing import List, Optional
 
 from ..models.chat_room import ChatRoom
@@ -8,143 +9,163 @@ from ..models.user import User
 from ..exceptions import ChatRoomNotFoundException
 from ..schemas.chat_room import ChatRoomCreate
 from ..schemas.message import MessageCreate
+from .history import recent_messages
+from .pagination import encode_cursor, paginate_messages
+from .room_stats import record_messages
+from .rooms import room_directory
+from .search import search_backend
+from ..websockets.presence import presence_tracker
 
-def get_chat_rooms(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(ChatRoom).offset(skip).limit(limit).all()
+async def get_chat_rooms(db: AsyncSession, skip: int = 0, limit: int = 100):
+    return await room_directory.list_rooms(db, skip, limit)
 
-def search_chat_rooms(db: Session, query: str, skip: int = 0, limit: int = 100):
-    search_pattern = f"%{query}%"
-    return db.query(ChatRoom).filter(ChatRoom.name.like(search_pattern)).offset(skip).limit(limit).all()
+async def search_chat_rooms(db: AsyncSession, query: str, skip: int = 0, limit: int = 100):
+    return await room_directory.search(db, query, skip, limit)
 
-def get_chat_room(db: Session, room_id: int):
-    room = db.query(ChatRoom).filter(ChatRoom.id == room_id).first()
+async def get_chat_room(db: AsyncSession, room_id: int):
+    room = await db.scalar(select(ChatRoom).where(ChatRoom.id == room_id))
     if not room:
         raise ChatRoomNotFoundException()
     return room
 
-def create_chat_room(db: Session, chat_room: ChatRoomCreate, user_id: int):
+async def get_room_presence(db: AsyncSession, room_id: int):
+    # Served from the room directory and the presence tracker, both in memory
+    if await room_directory.get(db, room_id) is None:
+        raise ChatRoomNotFoundException()
+    users = presence_tracker.online(room_id)
+    return {
+        "room_id": room_id,
+        "count": len(users),
+        "users": [{"user_id": user_id, "username": username} for user_id, username in sorted(users.items())]
+    }
+
+async def create_chat_room(db: AsyncSession, chat_room: ChatRoomCreate, user_id: int):
     db_chat_room = ChatRoom(name=chat_room.name, created_by=user_id)
     db.add(db_chat_room)
-    db.commit()
-    db.refresh(db_chat_room)
+    await db.commit()
+    await db.refresh(db_chat_room)
+    await room_directory.add(db_chat_room)
     return db_chat_room
 
-def get_room_details(db: Session, room_id: int):
-    room = db.query(ChatRoom).filter(ChatRoom.id == room_id).first()
-    if not room:
+async def get_room_details(db: AsyncSession, room_id: int):
+    # Room and creator in one query; the message count is kept on the room
+    result = await db.execute(
+        select(ChatRoom, User.username).outerjoin(User, User.id == ChatRoom.created_by).where(ChatRoom.id == room_id)
+    )
+    row = result.first()
+    if not row:
         raise ChatRoomNotFoundException()
-    
-    # Get username of creator
-    creator = db.query(User).filter(User.id == room.created_by).first()
-    creator_username = creator.username if creator else None
-    
-    # Get message count
-    message_count = db.query(func.count(Message.id)).filter(Message.room_id == room_id).scalar()
-    
+    room, creator_username = row
+
     return {
         "id": room.id,
         "name": room.name,
         "created_by": room.created_by,
         "created_at": room.created_at,
         "creator_username": creator_username,
-        "message_count": message_count
+        "message_count": room.message_count,
+        "last_message_at": room.last_message_at
     }
 
-def get_room_messages(db: Session, room_id: int, skip: int = 0, limit: int = 100):
+async def get_room_messages(
+    db: AsyncSession,
+    room_id: int,
+    skip: int = 0,
+    limit: int = 100,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    cursor: Optional[str] = None
+):
+    # Serve the first page from the recent message cache when possible
+    first_page = skip == 0 and before_id is None and after_id is None and cursor is None
+    if first_page:
+        cached_page = recent_messages.get_page(room_id, limit)
+        if cached_page is not None:
+            return cached_page
+
     # Check if room exists
-    room = db.query(ChatRoom).filter(ChatRoom.id == room_id).first()
+    room = await db.scalar(select(ChatRoom.id).where(ChatRoom.id == room_id))
     if not room:
         raise ChatRoomNotFoundException()
-    
+
     # Get messages with usernames
-    messages = db.query(
-        Message.id, 
-        Message.content, 
-        Message.user_id, 
-        Message.room_id, 
+    query = select(
+        Message.id,
+        Message.content,
+        Message.user_id,
+        Message.room_id,
         Message.timestamp,
         User.username
-    ).join(User).filter(
+    ).join(User).where(
         Message.room_id == room_id
-    ).order_by(
-        Message.timestamp.desc()
-    ).offset(skip).limit(limit).all()
-    
-    # Format messages
-    formatted_messages = []
-    for msg in messages:
-        formatted_messages.append({
-            "id": msg.id,
-            "content": msg.content,
-            "user_id": msg.user_id,
-            "room_id": msg.room_id,
-            "timestamp": msg.timestamp,
-            "username": msg.username
-        })
-    
-    return formatted_messages
-
-def create_message(db: Session, message: MessageCreate, user_id: int, room_id: int):
+    )
+
+    if not first_page or limit > recent_messages.per_room:
+        # A page longer than the buffer is never served from it, so it is
+        # not worth seeding
+        return await paginate_messages(db, query, room_id, skip, limit, before_id, after_id, cursor, include_archive=True)
+
+    # Seed the cache with a full buffer of the newest messages
+    fetch = max(limit, recent_messages.per_room)
+    recent_messages.begin_seed(room_id)
+    messages, _ = await paginate_messages(db, query, room_id, 0, fetch, None, None, None, include_archive=True)
+    recent_messages.finish_seed(room_id, messages, whole_room=len(messages) < fetch)
+
+    page = messages[:limit]
+    next_cursor = None
+    if len(page) == limit and page:
+        next_cursor = encode_cursor("before", page[-1]["timestamp"], page[-1]["id"])
+    return page, next_cursor
+
+async def create_message(db: AsyncSession, message: MessageCreate, user_id: int, room_id: int):
     # Check if room exists
-    room = db.query(ChatRoom).filter(ChatRoom.id == room_id).first()
+    room = await db.scalar(select(ChatRoom.id).where(ChatRoom.id == room_id))
     if not room:
         raise ChatRoomNotFoundException()
-    
-    # Create message
+
+    # Create message. Whole seconds, as stored by the TIMESTAMP column, so
+    # cursors carry the same timestamp on every backend
     db_message = Message(
         content=message.content,
         user_id=user_id,
-        room_id=room_id
+        room_id=room_id,
+        timestamp=datetime.utcnow().replace(microsecond=0)
     )
-    
+
     db.add(db_message)
-    db.commit()
-    db.refresh(db_message)
-    
+    await db.flush()
+    await record_messages(db, {room_id: 1})
+    await db.commit()
+
     # Get username
-    user = db.query(User).filter(User.id == user_id).first()
-    
-    return {
-        "id": db_message.id,
+    username = await db.scalar(select(User.username).where(User.id == user_id))
+
+    stored_message = {
         "content": db_message.content,
+        "id": db_message.id,
         "user_id": db_message.user_id,
         "room_id": db_message.room_id,
         "timestamp": db_message.timestamp,
-        "username": user.username
+        "username": username
     }
+    await recent_messages.append([stored_message])
+    room_directory.record_messages([stored_message])
+    return stored_message
 
-def search_messages(db: Session, room_id: int, query: str, skip: int = 0, limit: int = 100):
+async def search_messages(
+    db: AsyncSession,
+    room_id: int,
+    query: str,
+    skip: int = 0,
+    limit: int = 100,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    cursor: Optional[str] = None
+):
     # Check if room exists
-    room = db.query(ChatRoom).filter(ChatRoom.id == room_id).first()
+    room = await db.scalar(select(ChatRoom.id).where(ChatRoom.id == room_id))
     if not room:
         raise ChatRoomNotFoundException()
-    
+
     # Search messages
-    search_pattern = f"%{query}%"
-    messages = db.query(
-        Message.id, 
-        Message.content, 
-        Message.user_id, 
-        Message.room_id, 
-        Message.timestamp,
-        User.username
-    ).join(User).filter(
-        Message.room_id == room_id,
-        Message.content.like(search_pattern)
-    ).order_by(
-        Message.timestamp.desc()
-    ).offset(skip).limit(limit).all()
-    
-    # Format messages
-    formatted_messages = []
-    for msg in messages:
-        formatted_messages.append({
-            "id": msg.id,
-            "content": msg.content,
-            "user_id": msg.user_id,
-            "room_id": msg.room_id,
-            "timestamp": msg.timestamp,
-            "username": msg.username
-        })
-    
-    return formatted_messages
\ No newline at end of file
+    return await search_backend.search_messages(db, room_id, query, skip, limit, before_id, after_id, cursor)
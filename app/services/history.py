@@ -0,0 +1,179 @@
+import time
+from bisect import insort
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List
+
+from ..config import settings
+from ..websockets.backplane import backplane
+from .pagination import encode_cursor
+
+# Rough per-message overhead of the cached dict on top of its strings
+MESSAGE_OVERHEAD_BYTES = 400
+
+def _message_key(message: dict):
+    return (message["timestamp"], message["id"])
+
+def _message_size(message: dict) -> int:
+    return MESSAGE_OVERHEAD_BYTES + len(message["content"]) + len(message["username"])
+
+
+class _RoomBuffer:
+    def __init__(self):
+        # Oldest first, keyed by (timestamp, id)
+        self.keys: List[tuple] = []
+        self.messages: Dict[tuple, dict] = {}
+        self.size = 0
+        self.seeded = False
+        # True while the buffer holds every message of the room
+        self.whole_room = False
+        self.touched_at = time.monotonic()
+
+
+class RecentMessageCache:
+    """
+    Ring buffer of the newest messages of each room, with usernames attached,
+    used to serve the first page of room history without a database query.
+    A room's buffer is seeded from the database on its first read and then
+    kept current by both write paths, including those of other workers via the
+    backplane. Rooms not touched for HISTORY_CACHE_IDLE_TTL seconds, and the
+    least recently used rooms whenever the cache grows past
+    HISTORY_CACHE_MAX_BYTES, are evicted.
+    """
+
+    def __init__(self, per_room: int, max_bytes: int, idle_ttl: float):
+        self.per_room = per_room
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.rooms: "OrderedDict[int, _RoomBuffer]" = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        backplane.subscribe("history", self._on_history)
+
+    def get_page(self, room_id: int, limit: int):
+        """
+        The newest `limit` messages of the room, newest first, with the cursor
+        of the next page; None if the buffer cannot answer.
+        """
+        buffer = self.rooms.get(room_id)
+        if buffer is None or not buffer.seeded or (len(buffer.keys) < limit and not buffer.whole_room):
+            self.misses += 1
+            return None
+
+        self._touch(room_id, buffer)
+        self.hits += 1
+        page = [buffer.messages[key] for key in buffer.keys[:-limit - 1:-1]]
+        next_cursor = None
+        if len(page) == limit and page:
+            next_cursor = encode_cursor("before", page[-1]["timestamp"], page[-1]["id"])
+        return page, next_cursor
+
+    def begin_seed(self, room_id: int):
+        """
+        Start collecting writes for a room about to be read from the database,
+        so none committed during the read are lost.
+        """
+        if room_id not in self.rooms:
+            self.rooms[room_id] = _RoomBuffer()
+
+    def finish_seed(self, room_id: int, messages: List[dict], whole_room: bool):
+        buffer = self.rooms.get(room_id)
+        if buffer is None:
+            return
+        for message in messages:
+            self._add(buffer, message)
+        buffer.seeded = True
+        buffer.whole_room = whole_room and len(buffer.keys) <= self.per_room
+        self._trim(buffer)
+        self._touch(room_id, buffer)
+        self._evict()
+
+    async def append(self, messages: List[dict]):
+        """
+        Record newly stored messages here and on the other workers.
+        """
+        self._append(messages)
+        await backplane.publish("history", {
+            "messages": [{**message, "timestamp": message["timestamp"].isoformat()} for message in messages]
+        })
+
+    async def invalidate(self, room_id: int):
+        """
+        Drop a room's buffer here and on the other workers, after writes too
+        large to send message by message, such as an import.
+        """
+        self._drop(room_id)
+        await backplane.publish("history", {"messages": [], "invalidate": room_id})
+
+    def _on_history(self, event: dict):
+        if event.get("invalidate") is not None:
+            self._drop(event["invalidate"])
+        self._append([
+            {**message, "timestamp": datetime.fromisoformat(message["timestamp"])}
+            for message in event["messages"]
+        ])
+
+    def _append(self, messages: List[dict]):
+        for message in messages:
+            buffer = self.rooms.get(message["room_id"])
+            if buffer is None:
+                continue
+            self._add(buffer, message)
+            self._trim(buffer)
+            self._touch(message["room_id"], buffer)
+        self._evict()
+
+    def _add(self, buffer: _RoomBuffer, message: dict):
+        key = _message_key(message)
+        if key in buffer.messages:
+            return
+        buffer.messages[key] = message
+        insort(buffer.keys, key)
+        size = _message_size(message)
+        buffer.size += size
+        self.total_bytes += size
+
+    def _trim(self, buffer: _RoomBuffer):
+        while len(buffer.keys) > self.per_room:
+            key = buffer.keys.pop(0)
+            size = _message_size(buffer.messages.pop(key))
+            buffer.size -= size
+            self.total_bytes -= size
+            buffer.whole_room = False
+
+    def _touch(self, room_id: int, buffer: _RoomBuffer):
+        buffer.touched_at = time.monotonic()
+        self.rooms.move_to_end(room_id)
+
+    def _drop(self, room_id: int):
+        buffer = self.rooms.pop(room_id, None)
+        if buffer is not None:
+            self.total_bytes -= buffer.size
+
+    def _evict(self):
+        cutoff = time.monotonic() - self.idle_ttl
+        while self.rooms:
+            room_id, buffer = next(iter(self.rooms.items()))
+            if buffer.touched_at >= cutoff and self.total_bytes <= self.max_bytes:
+                break
+            del self.rooms[room_id]
+            self.total_bytes -= buffer.size
+            self.evictions += 1
+
+    def stats(self):
+        return {
+            "rooms": len(self.rooms),
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+
+recent_messages = RecentMessageCache(
+    per_room=settings.HISTORY_CACHE_MESSAGES_PER_ROOM,
+    max_bytes=settings.HISTORY_CACHE_MAX_BYTES,
+    idle_ttl=settings.HISTORY_CACHE_IDLE_TTL
+)
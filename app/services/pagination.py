@@ -0,0 +1,134 @@
+import base64
+from datetime import datetime
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import and_, func, or_, select
+from typing import List, Optional, Tuple
+
+from ..models.message import Message
+from ..exceptions import InvalidCursorException, MessageNotFoundException
+from ..serialization import message_dict
+from .archive import message_archive, message_key
+
+# Cursors are opaque to clients. "before"/"after" cursors carry the
+# (timestamp, id) of the last message returned; "rank" cursors carry the
+# offset into a relevance-ranked result list.
+
+def encode_cursor(direction: str, timestamp: datetime, message_id: int) -> str:
+    raw = f"{direction}|{timestamp.isoformat()}|{message_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def encode_rank_cursor(offset: int) -> str:
+    return base64.urlsafe_b64encode(f"rank|{offset}".encode()).decode()
+
+def decode_cursor(cursor: str) -> Tuple[str, Optional[datetime], int]:
+    try:
+        parts = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        if parts[0] == "rank" and len(parts) == 2:
+            return "rank", None, int(parts[1])
+        direction, timestamp, message_id = parts
+        if direction not in ("before", "after"):
+            raise ValueError(direction)
+        return direction, datetime.fromisoformat(timestamp), int(message_id)
+    except ValueError:
+        raise InvalidCursorException()
+
+async def get_anchor(db: AsyncSession, room_id: int, message_id: int):
+    result = await db.execute(select(Message.id, Message.timestamp).where(
+        Message.id == message_id,
+        Message.room_id == room_id
+    ))
+    anchor = result.first()
+    if not anchor:
+        raise MessageNotFoundException()
+    return anchor
+
+def format_messages(messages):
+    return [message_dict(msg) for msg in messages]
+
+async def paginate_messages(
+    db: AsyncSession,
+    query,
+    room_id: int,
+    skip: int,
+    limit: int,
+    before_id: Optional[int],
+    after_id: Optional[int],
+    cursor: Optional[str],
+    include_archive: bool = False
+):
+    """
+    Page through messages newest first. With before_id/after_id or a cursor the
+    page is located by (timestamp, id) on idx_messages_room_ts_id, so its cost
+    does not depend on how deep it is. after_id pages run oldest first.
+    With include_archive, pages reaching past the table continue into the
+    room's archived messages.
+    Returns the page and the cursor of the next page, if it may exist.
+    """
+    position = None
+    if cursor:
+        position = decode_cursor(cursor)
+        if position[0] == "rank":
+            raise InvalidCursorException()
+    elif before_id is not None or after_id is not None:
+        direction = "before" if before_id is not None else "after"
+        anchor_id = before_id if before_id is not None else after_id
+        try:
+            anchor = await get_anchor(db, room_id, anchor_id)
+            position = (direction, anchor.timestamp, anchor.id)
+        except MessageNotFoundException:
+            archived = await message_archive.find(room_id, anchor_id) if include_archive else None
+            if archived is None:
+                raise
+            position = (direction, archived["timestamp"], archived["id"])
+
+    if position is None:
+        # Legacy offset paging
+        query = query.order_by(Message.timestamp.desc(), Message.id.desc()).offset(skip)
+        direction = "before"
+    else:
+        direction, timestamp, message_id = position
+        if direction == "before":
+            query = query.where(or_(
+                Message.timestamp < timestamp,
+                and_(Message.timestamp == timestamp, Message.id < message_id)
+            )).order_by(Message.timestamp.desc(), Message.id.desc())
+        else:
+            query = query.where(or_(
+                Message.timestamp > timestamp,
+                and_(Message.timestamp == timestamp, Message.id > message_id)
+            )).order_by(Message.timestamp.asc(), Message.id.asc())
+
+    messages = format_messages((await db.execute(query.limit(limit))).all())
+    if include_archive and message_archive.has_messages(room_id):
+        messages = await _with_archive(db, room_id, messages, position, skip, limit)
+
+    next_cursor = None
+    if len(messages) == limit and messages:
+        last = messages[-1]
+        next_cursor = encode_cursor(direction, last["timestamp"], last["id"])
+
+    return messages, next_cursor
+
+async def _with_archive(db: AsyncSession, room_id: int, page: List[dict], position, skip: int, limit: int) -> List[dict]:
+    first, last = message_archive.key_range(room_id)
+    if position is None:
+        # Offset paging: archived messages follow the table's
+        if len(page) == limit:
+            return page
+        in_table = await db.scalar(select(func.count(Message.id)).where(Message.room_id == room_id))
+        return page + await message_archive.page(room_id, "before", None, limit - len(page), max(0, skip - in_table))
+
+    direction, timestamp, message_id = position
+    key = (timestamp, message_id)
+    # Skip the archive unless it holds keys between the position and the
+    # end of the page, which is rare once the page is full
+    end = message_key(page[-1]) if len(page) == limit else None
+    if direction == "before":
+        if first >= key or (end is not None and last <= end):
+            return page
+    elif last <= key or (end is not None and first >= end):
+        return page
+    archived = await message_archive.page(room_id, direction, key, limit)
+    merged = {message["id"]: message for message in archived}
+    merged.update((message["id"], message) for message in page)
+    return sorted(merged.values(), key=message_key, reverse=direction == "before")[:limit]
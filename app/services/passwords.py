@@ -0,0 +1,82 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+from passlib.context import CryptContext
+
+from ..config import settings
+from ..exceptions import AuthenticationBusyException
+from ..metrics import Histogram
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt on a small thread pool so a burst of logins does not stall
+    the event loop (bcrypt releases the GIL while hashing). At most
+    max_pending hashes may be running or waiting; further requests are
+    refused with a 503 rather than queued behind them.
+    """
+
+    def __init__(self, workers: int, max_pending: int, rounds: int):
+        self.context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=rounds)
+        self.workers = workers
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_time = Histogram()
+        self.hash_time = Histogram()
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.context.hash, password)
+
+    async def verify_and_update(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """
+        Check a password; also returns a new hash when the stored one was
+        made with other settings than the current ones.
+        """
+        return await self._run(self.context.verify_and_update, password, hashed_password)
+
+    async def _run(self, function, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise AuthenticationBusyException()
+
+        self.pending += 1
+        submitted = time.perf_counter()
+        try:
+            result, started, finished = await asyncio.get_running_loop().run_in_executor(
+                self.executor, self._timed, function, args
+            )
+        finally:
+            self.pending -= 1
+        self.wait_time.observe(started - submitted)
+        self.hash_time.observe(finished - started)
+        self.completed += 1
+        return result
+
+    @staticmethod
+    def _timed(function, args):
+        started = time.perf_counter()
+        result = function(*args)
+        return result, started, time.perf_counter()
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "in_flight": min(self.pending, self.workers),
+            "queued": max(self.pending - self.workers, 0),
+            "max_pending": self.max_pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "wait": self.wait_time.snapshot(),
+            "hash": self.hash_time.snapshot()
+        }
+
+
+password_hasher = PasswordHasher(
+    workers=settings.PASSWORD_HASH_WORKERS,
+    max_pending=settings.PASSWORD_HASH_MAX_PENDING,
+    rounds=settings.BCRYPT_ROUNDS
+)
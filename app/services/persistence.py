@@ -0,0 +1,195 @@
+import asyncio
+import time
+from collections import Counter
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import insert
+from sqlalchemy.exc import DataError, IntegrityError, ProgrammingError
+
+from ..config import settings
+from ..database import SessionLocal, engine
+from ..log import get_logger
+from ..metrics import realtime_metrics
+from ..models.message import Message
+from .history import recent_messages
+from .room_stats import record_messages
+from .rooms import room_directory
+
+logger = get_logger("persistence")
+
+# Errors caused by the rows themselves, which no retry can fix
+PERMANENT_ERRORS = (IntegrityError, DataError, ProgrammingError, TypeError, ValueError)
+
+
+class MessageWriter:
+    """
+    Write-behind persistence for chat messages. Messages are queued by the
+    WebSocket path and inserted in batches, one transaction per batch, when
+    either MESSAGE_WRITE_BATCH_SIZE rows are waiting or
+    MESSAGE_WRITE_FLUSH_INTERVAL seconds have passed. A batch that fails
+    because of a bad row is stored again row by row, so only that row is lost.
+    """
+
+    _STOP = object()
+
+    def __init__(self, batch_size: int, flush_interval: float, queue_size: int, max_retries: int):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.queue: Optional[asyncio.Queue] = None
+        self.queue_size = queue_size
+        self.task: Optional[asyncio.Task] = None
+
+        # Flush statistics
+        self.flushed = 0
+        self.failed = 0
+        self.batches = 0
+        self.last_error: Optional[str] = None
+
+    def start(self):
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Flush everything queued so far and stop the writer.
+        """
+        if self.task is None:
+            return
+        await self.queue.put(self._STOP)
+        await self.task
+        self.task = None
+
+    async def enqueue(self, user_id: int, username: str, room_id: int, content: str, timestamp: datetime):
+        # Waits when the queue is full, which slows the sending socket down
+        # instead of letting unpersisted messages pile up in memory
+        queued_at = time.perf_counter()
+        await self.queue.put((queued_at, {
+            "user_id": user_id,
+            "username": username,
+            "room_id": room_id,
+            "content": content,
+            "timestamp": timestamp
+        }))
+
+    def stats(self):
+        return {
+            "queued": self.queue.qsize() if self.queue else 0,
+            "flushed": self.flushed,
+            "failed": self.failed,
+            "batches": self.batches,
+            "last_error": self.last_error
+        }
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self.queue.get()
+            if item is self._STOP:
+                break
+
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is self._STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[tuple]):
+        if await self._store(batch) or len(batch) == 1:
+            return
+        for item in batch:
+            await self._store([item])
+
+    async def _store(self, batch: List[tuple]) -> bool:
+        """
+        Insert a batch, retrying errors that may pass. Returns False if the
+        batch failed on a permanent error and holds more than one row, so the
+        caller can store its rows one by one; otherwise failed rows are dropped.
+        """
+        rows = [row for _, row in batch]
+        for attempt in range(self.max_retries + 1):
+            started = time.perf_counter()
+            try:
+                stored_messages = await self._insert(rows)
+            except PERMANENT_ERRORS as e:
+                self.last_error = str(e)
+                logger.warning("messages.flush_failed", messages=len(batch), attempt=attempt + 1, permanent=True, error=str(e))
+                if len(batch) > 1:
+                    return False
+                break
+            except Exception as e:
+                self.last_error = str(e)
+                logger.warning("messages.flush_failed", messages=len(batch), attempt=attempt + 1, error=str(e))
+                if attempt < self.max_retries:
+                    await asyncio.sleep(min(0.1 * 2 ** attempt, 2))
+                continue
+            finished = time.perf_counter()
+            realtime_metrics.flush_time.observe(finished - started)
+            for queued_at, _ in batch:
+                realtime_metrics.persist_time.observe(finished - queued_at)
+            self.flushed += len(batch)
+            self.batches += 1
+            await recent_messages.append(stored_messages)
+            room_directory.record_messages(stored_messages)
+            return True
+
+        self.failed += len(batch)
+        logger.error("messages.dropped", messages=len(batch), attempts=attempt + 1)
+        return True
+
+    async def _insert(self, batch: List[dict]) -> List[dict]:
+        """
+        Insert a batch with one multi-row INSERT and return the stored messages.
+        """
+        values = [
+            {"user_id": row["user_id"], "room_id": row["room_id"], "content": row["content"], "timestamp": row["timestamp"]}
+            for row in batch
+        ]
+        usernames = {row["user_id"]: row["username"] for row in batch}
+        async with SessionLocal() as db:
+            if engine.dialect.insert_returning:
+                # Rows come back whole, so their order does not matter
+                result = await db.execute(
+                    insert(Message).returning(Message.id, Message.user_id, Message.room_id, Message.content, Message.timestamp),
+                    values
+                )
+                stored = sorted((dict(row._mapping) for row in result), key=lambda message: message["id"])
+            else:
+                # MySQL has no RETURNING; the rows of one INSERT get consecutive
+                # ids, starting at the first row's
+                result = await db.execute(insert(Message).values(values))
+                stored = [dict(row, id=result.lastrowid + offset) for offset, row in enumerate(values)]
+            await record_messages(db, Counter(row["room_id"] for row in batch))
+            await db.commit()
+        return [
+            {
+                "content": message["content"],
+                "id": message["id"],
+                "user_id": message["user_id"],
+                "room_id": message["room_id"],
+                "timestamp": message["timestamp"],
+                "username": usernames[message["user_id"]]
+            }
+            for message in stored
+        ]
+
+
+message_writer = MessageWriter(
+    batch_size=settings.MESSAGE_WRITE_BATCH_SIZE,
+    flush_interval=settings.MESSAGE_WRITE_FLUSH_INTERVAL,
+    queue_size=settings.MESSAGE_WRITE_QUEUE_SIZE,
+    max_retries=settings.MESSAGE_WRITE_MAX_RETRIES
+)
@@ -0,0 +1,79 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Tuple
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..config import settings
+from ..models.user import User
+from ..websockets.backplane import backplane
+
+
+@dataclass(frozen=True)
+class Principal:
+    """
+    The parts of a user that authenticated requests need.
+    """
+    id: int
+    username: str
+
+
+class PrincipalCache:
+    """
+    TTL/LRU cache of token ID -> Principal, so that an authenticated request
+    with a known token needs no user lookup. Entries are dropped when their
+    token is revoked, on every worker. Users' ids and usernames never change
+    and users are never deleted, so an entry is otherwise never stale.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries: "OrderedDict[str, Tuple[Principal, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        backplane.subscribe("revocation", lambda event: self.invalidate_token(event["jti"]))
+
+    def get(self, jti: str) -> Optional[Principal]:
+        entry = self.entries.get(jti)
+        if entry is None:
+            self.misses += 1
+            return None
+        principal, expires_at = entry
+        if expires_at < time.monotonic():
+            self.invalidate_token(jti)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(jti)
+        self.hits += 1
+        return principal
+
+    def put(self, jti: str, principal: Principal):
+        self.entries[jti] = (principal, time.monotonic() + self.ttl)
+        self.entries.move_to_end(jti)
+        while len(self.entries) > self.max_size:
+            oldest, _ = next(iter(self.entries.items()))
+            self.invalidate_token(oldest)
+
+    def invalidate_token(self, jti: str):
+        self.entries.pop(jti, None)
+
+    def stats(self):
+        return {"size": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+principal_cache = PrincipalCache(
+    max_size=settings.PRINCIPAL_CACHE_SIZE,
+    ttl=settings.PRINCIPAL_CACHE_TTL
+)
+
+async def resolve_principal(db: AsyncSession, jti: str, username: str) -> Optional[Principal]:
+    principal = principal_cache.get(jti)
+    if principal is None:
+        user = await db.scalar(select(User).where(User.username == username))
+        if user is None:
+            return None
+        principal = Principal(id=user.id, username=user.username)
+        principal_cache.put(jti, principal)
+    return principal
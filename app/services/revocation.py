@@ -0,0 +1,111 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+from sqlalchemy import delete, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..config import settings
+from ..database import SessionLocal
+from ..log import get_logger
+from ..models.token import RevokedToken
+from ..websockets.backplane import backplane
+
+logger = get_logger("revocation")
+
+
+class RevocationList:
+    """
+    In-process copy of the revoked token IDs that have not expired yet, so
+    that checking a token needs no database round trip. Revocations made by
+    other workers arrive over the backplane, and the list is re-synced from
+    the database every REVOCATION_SYNC_INTERVAL seconds in case an event was
+    missed. Rows whose token has expired are pruned on the same schedule.
+    """
+
+    def __init__(self, sync_interval: float, prune_interval: float):
+        self.sync_interval = sync_interval
+        self.prune_interval = prune_interval
+        # jti -> expiry of the revoked token (None for rows written before
+        # tokens carried a jti, which store the whole token instead)
+        self.revoked: Dict[str, Optional[datetime]] = {}
+        # Database time of the last sync, as revoked_at is set by the database
+        self.synced_at: Optional[datetime] = None
+        self.pruned_at = datetime.utcnow()
+        self.task: Optional[asyncio.Task] = None
+        backplane.subscribe("revocation", self._on_revocation)
+
+    def is_revoked(self, jti: str) -> bool:
+        return jti in self.revoked
+
+    async def revoke(self, jti: str, expires_at: Optional[datetime]):
+        self.revoked[jti] = expires_at
+        await backplane.publish("revocation", {
+            "jti": jti,
+            "expires_at": expires_at.isoformat() if expires_at else None
+        })
+
+    def _on_revocation(self, event: dict):
+        expires_at = event["expires_at"]
+        self.revoked[event["jti"]] = datetime.fromisoformat(expires_at) if expires_at else None
+
+    async def sync(self, db: AsyncSession):
+        """
+        Load revocations from the database: everything on the first call,
+        then only rows revoked since the previous sync.
+        """
+        now = datetime.utcnow()
+        database_now = await db.scalar(select(func.now()))
+        query = select(RevokedToken.jti, RevokedToken.expires_at)
+        if self.synced_at is not None:
+            # Overlap a little for rows committed after their revoked_at
+            query = query.where(RevokedToken.revoked_at >= self.synced_at - timedelta(seconds=self.sync_interval))
+        for row in (await db.execute(query)).all():
+            if row.expires_at is None or row.expires_at > now:
+                self.revoked[row.jti] = row.expires_at
+        self.synced_at = database_now
+
+    async def prune(self, db: AsyncSession):
+        now = datetime.utcnow()
+        legacy_cutoff = await db.scalar(select(func.now())) - timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+        result = await db.execute(delete(RevokedToken).where(
+            (RevokedToken.expires_at < now) |
+            (RevokedToken.expires_at.is_(None) & (RevokedToken.revoked_at < legacy_cutoff))
+        ))
+        await db.commit()
+        deleted = result.rowcount
+
+        self.revoked = {
+            jti: expires_at for jti, expires_at in self.revoked.items()
+            if expires_at is None or expires_at > now
+        }
+        self.pruned_at = now
+        logger.info("revocation.pruned", deleted=deleted)
+
+    async def _maintain(self):
+        async with SessionLocal() as db:
+            await self.sync(db)
+            if (datetime.utcnow() - self.pruned_at).total_seconds() >= self.prune_interval:
+                await self.prune(db)
+
+    async def start(self):
+        await self._maintain()
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                await self._maintain()
+            except Exception as e:
+                logger.error("revocation.sync_failed", error=str(e))
+
+
+revocation_list = RevocationList(
+    sync_interval=settings.REVOCATION_SYNC_INTERVAL,
+    prune_interval=settings.REVOCATION_PRUNE_INTERVAL
+)
@@ -0,0 +1,124 @@
+import asyncio
+from typing import Dict, Optional
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..config import settings
+from ..database import SessionLocal
+from ..log import get_logger
+from ..models.chat_room import ChatRoom
+from ..models.message import Message
+from .archive import message_archive
+
+logger = get_logger("room_stats")
+
+def _message_count():
+    return select(func.count(Message.id)).where(Message.room_id == ChatRoom.id).scalar_subquery()
+
+def _last_message_at():
+    # Served by idx_messages_room_ts_id
+    return select(func.max(Message.timestamp)).where(Message.room_id == ChatRoom.id).scalar_subquery()
+
+async def record_messages(db: AsyncSession, counts: Dict[int, int]):
+    """
+    Add newly inserted messages to the counters of their rooms, in the
+    caller's transaction. The messages must have been flushed already.
+    """
+    # Always lock rooms in the same order so concurrent writers cannot deadlock
+    for room_id in sorted(counts):
+        await db.execute(
+            update(ChatRoom)
+            .where(ChatRoom.id == room_id)
+            .values(message_count=ChatRoom.message_count + counts[room_id], last_message_at=_last_message_at())
+            .execution_options(synchronize_session=False)
+        )
+
+
+class RoomStatsReconciler:
+    """
+    Recounts the messages of every room each ROOM_STATS_RECONCILE_INTERVAL
+    seconds and corrects the rooms whose counters have drifted, e.g. after
+    messages were deleted by hand. Archived messages are counted from the
+    archive's manifests. Rooms are checked ROOM_STATS_RECONCILE_BATCH at a
+    time.
+    """
+
+    def __init__(self, interval: float, batch_size: int):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.task: Optional[asyncio.Task] = None
+        self.runs = 0
+        self.corrected = 0
+
+    async def reconcile(self, db: AsyncSession) -> int:
+        corrected = 0
+        last_id = 0
+        while True:
+            room_ids = (await db.scalars(
+                select(ChatRoom.id).where(ChatRoom.id > last_id).order_by(ChatRoom.id).limit(self.batch_size)
+            )).all()
+            if not room_ids:
+                break
+            last_id = room_ids[-1]
+
+            rows = (await db.execute(
+                select(
+                    ChatRoom.id,
+                    ChatRoom.message_count,
+                    ChatRoom.last_message_at,
+                    _message_count().label("in_table"),
+                    _last_message_at().label("last_in_table")
+                ).where(ChatRoom.id.in_(room_ids))
+            )).all()
+            for row in rows:
+                if not message_archive.settled(row.id):
+                    # Being archived; its messages may be in both places
+                    continue
+                # Archived messages still count, but are no longer in the table
+                archived = message_archive.count(row.id)
+                archived_last = message_archive.last_timestamp(row.id)
+                last_message_at = max(filter(None, (row.last_in_table, archived_last)), default=None)
+                if row.message_count == row.in_table + archived and row.last_message_at == last_message_at:
+                    continue
+                await db.execute(
+                    update(ChatRoom)
+                    .where(ChatRoom.id == row.id)
+                    .values(
+                        message_count=_message_count() + archived,
+                        last_message_at=func.coalesce(_last_message_at(), archived_last)
+                    )
+                    .execution_options(synchronize_session=False)
+                )
+                corrected += 1
+            await db.commit()
+
+        self.runs += 1
+        self.corrected += corrected
+        logger.info("room_stats.reconciled", corrected=corrected)
+        return corrected
+
+    async def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                async with SessionLocal() as db:
+                    await self.reconcile(db)
+            except Exception as e:
+                logger.error("room_stats.reconcile_failed", error=str(e))
+
+    def stats(self):
+        return {"runs": self.runs, "corrected": self.corrected}
+
+
+room_stats_reconciler = RoomStatsReconciler(
+    interval=settings.ROOM_STATS_RECONCILE_INTERVAL,
+    batch_size=settings.ROOM_STATS_RECONCILE_BATCH
+)
@@ -0,0 +1,252 @@
+import asyncio
+import time
+from bisect import bisect_left, insort
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..config import settings
+from ..database import SessionLocal
+from ..log import get_logger
+from ..models.chat_room import ChatRoom
+from ..websockets.backplane import backplane
+
+logger = get_logger("rooms")
+
+# Names are indexed by every substring of up to this many characters, so any
+# query can be answered from the postings of its grams
+GRAM_SIZE = 3
+
+def _grams(text: str, size: int) -> Set[str]:
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+def _name_grams(name: str) -> Set[str]:
+    grams = set()
+    for size in range(1, GRAM_SIZE + 1):
+        grams |= _grams(name, size)
+    return grams
+
+def _index_room(rooms: Dict[int, dict], postings: Dict[str, Set[int]], entry: dict):
+    rooms[entry["id"]] = entry
+    for gram in _name_grams(entry["name"].lower()):
+        postings.setdefault(gram, set()).add(entry["id"])
+
+def _room_entry(room) -> dict:
+    return {
+        "id": room.id,
+        "name": room.name,
+        "created_by": room.created_by,
+        "created_at": room.created_at,
+        "message_count": room.message_count or 0,
+        "last_message_at": room.last_message_at
+    }
+
+
+class RoomDirectory:
+    """
+    In-process copy of the chat room list, so listing and searching rooms
+    needs no database query. Rooms are kept in id order for paging, in
+    name order for prefix matches, and in an n-gram index for substring
+    matches.
+
+    Rooms created on any worker are added over the backplane and message
+    counters follow the "history" events. Every ROOM_DIRECTORY_CHECK_INTERVAL
+    seconds the directory compares its version stamp (room count and
+    highest id) with the database and reloads on a mismatch, which covers
+    lost events; it also reloads every ROOM_DIRECTORY_RELOAD_INTERVAL
+    seconds to pick up reconciled counters.
+    """
+
+    def __init__(self, check_interval: float, reload_interval: float):
+        self.check_interval = check_interval
+        self.reload_interval = reload_interval
+        self.loaded_at: Optional[float] = None
+        self.lock = asyncio.Lock()
+        self.task: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.reloads = 0
+        self._reset()
+        backplane.subscribe("rooms", self._on_room)
+        backplane.subscribe("history", self._on_history)
+
+    def _reset(self):
+        self.rooms: Dict[int, dict] = {}
+        self.by_id: List[int] = []
+        self.by_name: List[Tuple[str, int]] = []
+        self.postings: Dict[str, Set[int]] = {}
+
+    def version(self) -> Tuple[int, int]:
+        return len(self.by_id), self.by_id[-1] if self.by_id else 0
+
+    async def list_rooms(self, db: AsyncSession, skip: int, limit: int) -> List[dict]:
+        await self._ensure_loaded(db)
+        self.hits += 1
+        return [self.rooms[room_id] for room_id in self.by_id[skip:skip + limit]]
+
+    async def get(self, db: AsyncSession, room_id: int) -> Optional[dict]:
+        await self._ensure_loaded(db)
+        self.hits += 1
+        return self.rooms.get(room_id)
+
+    async def search(self, db: AsyncSession, query: str, skip: int, limit: int) -> List[dict]:
+        """
+        Rooms whose name contains the query, ignoring case: names starting
+        with it first, then the rest, each in name order.
+        """
+        await self._ensure_loaded(db)
+        self.hits += 1
+        query = query.lower()
+        wanted = skip + limit
+
+        matches = []
+        position = bisect_left(self.by_name, (query, 0))
+        while position < len(self.by_name) and len(matches) < wanted:
+            name, room_id = self.by_name[position]
+            if not name.startswith(query):
+                break
+            matches.append(room_id)
+            position += 1
+
+        if len(matches) < wanted:
+            others = [
+                (self.rooms[room_id]["name"].lower(), room_id)
+                for room_id in self._candidates(query)
+                if query in self.rooms[room_id]["name"].lower()
+                and not self.rooms[room_id]["name"].lower().startswith(query)
+            ]
+            others.sort()
+            matches.extend(room_id for _, room_id in others[:wanted - len(matches)])
+
+        return [self.rooms[room_id] for room_id in matches[skip:wanted]]
+
+    def _candidates(self, query: str) -> Set[int]:
+        grams = _grams(query, min(len(query), GRAM_SIZE))
+        postings = sorted((self.postings.get(gram, set()) for gram in grams), key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates &= posting
+            if not candidates:
+                break
+        return candidates
+
+    async def add(self, room: ChatRoom):
+        """
+        Record a newly created room here and on the other workers.
+        """
+        entry = _room_entry(room)
+        if self.loaded_at is not None:
+            self._add(entry)
+        await backplane.publish("rooms", {
+            **entry,
+            "created_at": entry["created_at"].isoformat() if entry["created_at"] else None,
+            "last_message_at": None
+        })
+
+    def record_messages(self, messages: List[dict]):
+        """
+        Count newly stored messages; other workers count them from the
+        "history" events of the recent message cache.
+        """
+        for message in messages:
+            entry = self.rooms.get(message["room_id"])
+            if entry is None:
+                continue
+            entry["message_count"] += 1
+            if entry["last_message_at"] is None or message["timestamp"] > entry["last_message_at"]:
+                entry["last_message_at"] = message["timestamp"]
+
+    def _on_room(self, event: dict):
+        if self.loaded_at is None:
+            return
+        created_at = event["created_at"]
+        self._add({**event, "created_at": datetime.fromisoformat(created_at) if created_at else None})
+
+    def _on_history(self, event: dict):
+        self.record_messages([
+            {"room_id": message["room_id"], "timestamp": datetime.fromisoformat(message["timestamp"])}
+            for message in event["messages"]
+        ])
+
+    def _add(self, entry: dict):
+        room_id = entry["id"]
+        if room_id in self.rooms:
+            return
+        _index_room(self.rooms, self.postings, entry)
+        if not self.by_id or room_id > self.by_id[-1]:
+            self.by_id.append(room_id)
+        else:
+            insort(self.by_id, room_id)
+        insort(self.by_name, (entry["name"].lower(), room_id))
+
+    async def _ensure_loaded(self, db: AsyncSession):
+        if self.loaded_at is not None:
+            return
+        async with self.lock:
+            if self.loaded_at is None:
+                await self._load(db)
+
+    async def _load(self, db: AsyncSession):
+        rows = (await db.execute(select(
+            ChatRoom.id,
+            ChatRoom.name,
+            ChatRoom.created_by,
+            ChatRoom.created_at,
+            ChatRoom.message_count,
+            ChatRoom.last_message_at
+        ).order_by(ChatRoom.id))).all()
+        if self.loaded_at is not None and len(rows) == len(self.rooms) and all(row.id in self.rooms for row in rows):
+            # Same rooms, only the counters need refreshing
+            for row in rows:
+                entry = self.rooms[row.id]
+                entry["message_count"] = row.message_count or 0
+                entry["last_message_at"] = row.last_message_at
+        else:
+            # Build aside and swap, serving the old copy meanwhile
+            rooms: Dict[int, dict] = {}
+            postings: Dict[str, Set[int]] = {}
+            for position, row in enumerate(rows, 1):
+                _index_room(rooms, postings, _room_entry(row))
+                if position % 1000 == 0:
+                    await asyncio.sleep(0)
+            self.rooms = rooms
+            self.postings = postings
+            self.by_id = [row.id for row in rows]
+            self.by_name = sorted((entry["name"].lower(), room_id) for room_id, entry in rooms.items())
+        self.loaded_at = time.monotonic()
+        self.reloads += 1
+
+    async def _check(self, db: AsyncSession):
+        count, max_id = (await db.execute(select(func.count(ChatRoom.id), func.max(ChatRoom.id)))).one()
+        stale = (count, max_id or 0) != self.version()
+        if stale or time.monotonic() - self.loaded_at >= self.reload_interval:
+            async with self.lock:
+                await self._load(db)
+
+    async def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            if self.loaded_at is None:
+                continue
+            try:
+                async with SessionLocal() as db:
+                    await self._check(db)
+            except Exception as e:
+                logger.error("rooms.refresh_failed", error=str(e))
+
+    def stats(self):
+        return {"rooms": len(self.rooms), "hits": self.hits, "reloads": self.reloads}
+
+
+room_directory = RoomDirectory(
+    check_interval=settings.ROOM_DIRECTORY_CHECK_INTERVAL,
+    reload_interval=settings.ROOM_DIRECTORY_RELOAD_INTERVAL
+)
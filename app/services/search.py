@@ -0,0 +1,312 @@
+import asyncio
+import heapq
+import math
+import re
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from sqlalchemy import func, or_, select
+from sqlalchemy.dialects.mysql import match
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Dict, List, Optional, Tuple
+
+from ..config import settings
+from ..models.message import Message
+from ..models.user import User
+from ..exceptions import InvalidCursorException
+from .pagination import decode_cursor, encode_rank_cursor, format_messages, paginate_messages
+
+# InnoDB ignores shorter words (innodb_ft_min_token_size)
+FULLTEXT_MIN_TOKEN_SIZE = 3
+# Most skipped ids the inverted index keeps looking for
+MAX_INDEX_GAPS = 10000
+
+def tokenize(text: str) -> List[str]:
+    return re.findall(r"\w+", text.lower())
+
+def _message_query():
+    return select(
+        Message.id,
+        Message.content,
+        Message.user_id,
+        Message.room_id,
+        Message.timestamp,
+        User.username
+    ).join(User)
+
+def _rank_offset(skip: int, cursor: Optional[str]) -> int:
+    if not cursor:
+        return skip
+    direction, _, offset = decode_cursor(cursor)
+    if direction != "rank":
+        raise InvalidCursorException()
+    return offset
+
+
+class LikeSearchBackend:
+    """
+    Substring search with LIKE '%query%'. Scans every message in the room;
+    results are newest first and support keyset pagination.
+    """
+
+    async def search_messages(
+        self,
+        db: AsyncSession,
+        room_id: int,
+        query: str,
+        skip: int,
+        limit: int,
+        before_id: Optional[int],
+        after_id: Optional[int],
+        cursor: Optional[str]
+    ):
+        search_pattern = f"%{query}%"
+        messages = _message_query().where(
+            Message.room_id == room_id,
+            Message.content.like(search_pattern)
+        )
+        return await paginate_messages(db, messages, room_id, skip, limit, before_id, after_id, cursor)
+
+
+class FullTextSearchBackend(LikeSearchBackend):
+    """
+    MySQL FULLTEXT search in boolean mode. Every query word must match as a
+    word prefix, and results are ranked by relevance. Falls back to LIKE on
+    other databases or when the query only has words InnoDB does not index.
+    """
+
+    def _against(self, query: str) -> Optional[str]:
+        terms = [term for term in tokenize(query) if len(term) >= FULLTEXT_MIN_TOKEN_SIZE]
+        if not terms:
+            return None
+        return " ".join(f"+{term}*" for term in terms)
+
+    async def search_messages(self, db, room_id, query, skip, limit, before_id, after_id, cursor):
+        against = self._against(query)
+        if db.bind.dialect.name != "mysql" or against is None:
+            return await super().search_messages(db, room_id, query, skip, limit, before_id, after_id, cursor)
+
+        offset = _rank_offset(skip, cursor)
+        score = match(Message.content, against=against).in_boolean_mode()
+        messages = _message_query().where(Message.room_id == room_id, score)
+        if before_id is not None:
+            messages = messages.where(Message.id < before_id)
+        if after_id is not None:
+            messages = messages.where(Message.id > after_id)
+        messages = messages.order_by(score.desc(), Message.id.desc()).offset(offset).limit(limit)
+        messages = (await db.execute(messages)).all()
+
+        next_cursor = encode_rank_cursor(offset + limit) if len(messages) == limit else None
+        return format_messages(messages), next_cursor
+
+
+class _RoomIndex:
+    def __init__(self):
+        self.postings: Dict[str, Dict[int, int]] = {}
+        # message id -> its distinct tokens
+        self.documents: Dict[int, List[str]] = {}
+        self.vocabulary: List[str] = []
+        self.vocabulary_dirty = False
+
+    @property
+    def doc_count(self) -> int:
+        return len(self.documents)
+
+    def add(self, message_id: int, content: str):
+        if message_id in self.documents:
+            return
+        tokens = tokenize(content)
+        for token in tokens:
+            docs = self.postings.get(token)
+            if docs is None:
+                docs = self.postings[token] = {}
+                self.vocabulary_dirty = True
+            docs[message_id] = docs.get(message_id, 0) + 1
+        self.documents[message_id] = list(dict.fromkeys(tokens))
+
+    def remove(self, message_id: int):
+        for token in self.documents.pop(message_id, ()):
+            docs = self.postings[token]
+            del docs[message_id]
+            if not docs:
+                del self.postings[token]
+                self.vocabulary_dirty = True
+
+    def expand(self, term: str) -> List[str]:
+        """
+        All indexed tokens starting with term.
+        """
+        if self.vocabulary_dirty:
+            self.vocabulary = sorted(self.postings)
+            self.vocabulary_dirty = False
+        tokens = []
+        position = bisect_left(self.vocabulary, term)
+        while position < len(self.vocabulary) and self.vocabulary[position].startswith(term):
+            tokens.append(self.vocabulary[position])
+            position += 1
+        return tokens
+
+
+class InvertedIndexSearchBackend(LikeSearchBackend):
+    """
+    In-process inverted index per room. Every query word must match as a word
+    prefix, and results are ranked by TF-IDF. A room is indexed on its first
+    search. Before every search, the messages inserted since the last one
+    (id above a high-water mark, so a primary key range scan) are added to the
+    cached rooms, which also picks up messages written by other workers. Ids
+    the high-water mark skipped are looked up again for SEARCH_INDEX_GAP_TIMEOUT
+    seconds, as their transaction may commit later. Messages that have left
+    the table, e.g. for the archive, are dropped when a search ranks them.
+    Only the SEARCH_INDEX_MAX_ROOMS most recently searched rooms are kept.
+    Catch-ups run one at a time; each room is built by one search at a time,
+    while the others wait, and is cached only once complete.
+    """
+
+    def __init__(self, max_rooms: int, gap_timeout: float):
+        self.max_rooms = max_rooms
+        self.gap_timeout = gap_timeout
+        self.rooms: "OrderedDict[int, _RoomIndex]" = OrderedDict()
+        self.last_id: Optional[int] = None
+        # Skipped id -> when to stop looking for it, oldest first
+        self.gaps: "OrderedDict[int, float]" = OrderedDict()
+        # Messages caught up while their room is being built
+        self.pending: Dict[int, List[Tuple[int, str]]] = {}
+        self.catch_up_lock = asyncio.Lock()
+        self.build_locks: Dict[int, asyncio.Lock] = {}
+
+    async def _catch_up(self, db: AsyncSession):
+        if self.last_id is None:
+            self.last_id = await db.scalar(select(func.max(Message.id))) or 0
+            return
+
+        now = time.monotonic()
+        while self.gaps and next(iter(self.gaps.values())) < now:
+            self.gaps.popitem(last=False)
+        condition = Message.id > self.last_id
+        if self.gaps:
+            condition = or_(condition, Message.id.in_(list(self.gaps)))
+
+        new_messages = await db.stream(select(Message.id, Message.room_id, Message.content).where(
+            condition
+        ).order_by(Message.id).execution_options(yield_per=1000))
+        async for msg in new_messages:
+            if msg.id > self.last_id:
+                for skipped in range(max(self.last_id + 1, msg.id - MAX_INDEX_GAPS), msg.id):
+                    self.gaps[skipped] = now + self.gap_timeout
+                self.last_id = msg.id
+            else:
+                self.gaps.pop(msg.id, None)
+            index = self.rooms.get(msg.room_id)
+            if index is not None:
+                index.add(msg.id, msg.content)
+            elif msg.room_id in self.pending:
+                self.pending[msg.room_id].append((msg.id, msg.content))
+        while len(self.gaps) > MAX_INDEX_GAPS:
+            self.gaps.popitem(last=False)
+
+    async def _get_index(self, db: AsyncSession, room_id: int) -> _RoomIndex:
+        async with self.catch_up_lock:
+            if room_id not in self.rooms:
+                # From here on, catch-ups keep this room's messages for its build
+                self.pending.setdefault(room_id, [])
+            await self._catch_up(db)
+
+        index = self.rooms.get(room_id)
+        if index is not None:
+            self.rooms.move_to_end(room_id)
+            return index
+
+        async with self.build_locks.setdefault(room_id, asyncio.Lock()):
+            index = self.rooms.get(room_id)
+            if index is not None:
+                # Built by the search this one waited for
+                return index
+            try:
+                index = _RoomIndex()
+                messages = await db.stream(select(Message.id, Message.content).where(
+                    Message.room_id == room_id
+                ).execution_options(yield_per=1000))
+                async for msg in messages:
+                    index.add(msg.id, msg.content)
+
+                async with self.catch_up_lock:
+                    for message_id, content in self.pending.pop(room_id, ()):
+                        index.add(message_id, content)
+                    self.rooms[room_id] = index
+                    while len(self.rooms) > self.max_rooms:
+                        evicted, _ = self.rooms.popitem(last=False)
+                        self.build_locks.pop(evicted, None)
+            finally:
+                if room_id not in self.rooms:
+                    self.pending.pop(room_id, None)
+            return index
+
+    async def search_messages(self, db, room_id, query, skip, limit, before_id, after_id, cursor):
+        terms = tokenize(query)
+        if not terms:
+            return [], None
+
+        offset = _rank_offset(skip, cursor)
+        index = await self._get_index(db, room_id)
+
+        # Every term has to match; a document's score is the sum of the
+        # TF-IDF weights of the tokens it matched. Terms are applied rarest
+        # first so later ones only probe the surviving candidates.
+        term_tokens = sorted(
+            (index.expand(term) for term in terms),
+            key=lambda tokens: sum(len(index.postings[token]) for token in tokens)
+        )
+        scores: Optional[Dict[int, float]] = None
+        for tokens in term_tokens:
+            term_scores: Dict[int, float] = {}
+            for token in tokens:
+                docs = index.postings[token]
+                idf = math.log(1 + index.doc_count / len(docs))
+                if scores is None:
+                    for message_id, tf in docs.items():
+                        term_scores[message_id] = term_scores.get(message_id, 0.0) + tf * idf
+                else:
+                    for message_id in scores:
+                        tf = docs.get(message_id)
+                        if tf:
+                            term_scores[message_id] = term_scores.get(message_id, 0.0) + tf * idf
+            if scores is not None:
+                term_scores = {message_id: scores[message_id] + score for message_id, score in term_scores.items()}
+            scores = term_scores
+            if not scores:
+                return [], None
+
+        if before_id is not None or after_id is not None:
+            scores = {
+                message_id: score for message_id, score in scores.items()
+                if (before_id is None or message_id < before_id) and (after_id is None or message_id > after_id)
+            }
+        while True:
+            ranked = heapq.nlargest(offset + limit, scores.items(), key=lambda item: (item[1], item[0]))[offset:]
+            if not ranked:
+                return [], None
+
+            ids = [message_id for message_id, _ in ranked]
+            rows = {msg.id: msg for msg in (await db.execute(_message_query().where(Message.id.in_(ids)))).all()}
+            missing = [message_id for message_id in ids if message_id not in rows]
+            if not missing:
+                break
+            # Archived since they were indexed; rank again without them
+            for message_id in missing:
+                index.remove(message_id)
+                del scores[message_id]
+        messages = [rows[message_id] for message_id in ids]
+
+        next_cursor = encode_rank_cursor(offset + limit) if len(ranked) == limit else None
+        return format_messages(messages), next_cursor
+
+
+def create_search_backend(kind: str) -> LikeSearchBackend:
+    if kind == "fulltext":
+        return FullTextSearchBackend()
+    if kind == "memory":
+        return InvertedIndexSearchBackend(settings.SEARCH_INDEX_MAX_ROOMS, settings.SEARCH_INDEX_GAP_TIMEOUT)
+    return LikeSearchBackend()
+
+
+search_backend = create_search_backend(settings.SEARCH_BACKEND)
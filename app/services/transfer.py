@@ -0,0 +1,176 @@
+import zlib
+from datetime import datetime, timezone
+from typing import AsyncIterator, Dict, List, Optional
+
+import orjson
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..config import settings
+from ..database import SessionLocal
+from ..exceptions import InvalidImportException
+from ..log import get_logger
+from ..models.message import Message
+from ..models.user import User
+from ..serialization import message_dict
+from .archive import merge_sorted, message_archive
+from .history import recent_messages
+from .room_stats import record_messages
+from .rooms import room_directory
+
+logger = get_logger("transfer")
+
+# gzip framing for compressobj/decompressobj
+GZIP_WBITS = 31
+
+
+async def _table_messages(db: AsyncSession, room_id: int) -> AsyncIterator[List[dict]]:
+    result = await db.stream(
+        select(Message.id, Message.content, Message.user_id, Message.room_id, Message.timestamp, User.username)
+        .join(User, User.id == Message.user_id)
+        .where(Message.room_id == room_id)
+        .order_by(Message.timestamp, Message.id)
+        .execution_options(yield_per=settings.MESSAGE_EXPORT_BATCH_SIZE)
+    )
+    async for rows in result.partitions():
+        yield [message_dict(row) for row in rows]
+
+
+async def _all_messages(db: AsyncSession, room_id: int) -> AsyncIterator[List[dict]]:
+    """
+    The room's archived and table messages merged in key order, in batches
+    of MESSAGE_EXPORT_BATCH_SIZE.
+    """
+    async def table():
+        async for batch in _table_messages(db, room_id):
+            for message in batch:
+                yield message
+
+    batch = []
+    async for message in merge_sorted(message_archive.iter_messages(room_id), table()):
+        batch.append(message)
+        if len(batch) >= settings.MESSAGE_EXPORT_BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def export_messages(room_id: int, compress: bool) -> AsyncIterator[bytes]:
+    """
+    Every message of a room as NDJSON, oldest first, in the format of the
+    message list endpoint, archived messages included. Rows come from a
+    server-side cursor MESSAGE_EXPORT_BATCH_SIZE at a time, so memory use
+    does not depend on the size of the room. The export opens its own
+    session, because the request's session is closed before a streamed body
+    is sent.
+    """
+    compressor = zlib.compressobj(wbits=GZIP_WBITS) if compress else None
+    exported = 0
+    async with SessionLocal() as db:
+        if message_archive.has_messages(room_id):
+            batches = _all_messages(db, room_id)
+        else:
+            batches = _table_messages(db, room_id)
+        async for messages in batches:
+            chunk = b"".join(orjson.dumps(message, option=orjson.OPT_APPEND_NEWLINE) for message in messages)
+            exported += len(messages)
+            if compressor is not None:
+                chunk = compressor.compress(chunk)
+            if chunk:
+                yield chunk
+    if compressor is not None:
+        yield compressor.flush()
+    logger.info("transfer.exported", room_id=room_id, messages=exported, compressed=compress)
+
+
+async def _lines(body: AsyncIterator[bytes], compressed: bool) -> AsyncIterator[bytes]:
+    decompressor = zlib.decompressobj(wbits=GZIP_WBITS) if compressed else None
+    pending = b""
+    async for chunk in body:
+        if decompressor is not None:
+            chunk = decompressor.decompress(chunk)
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
+
+
+def _parse(line: bytes) -> dict:
+    message = orjson.loads(line)
+    content, username = message["content"], message["username"]
+    if not isinstance(content, str) or not content or not isinstance(username, str):
+        raise ValueError("content and username must be strings")
+    timestamp = datetime.fromisoformat(message["timestamp"])
+    if timestamp.tzinfo is not None:
+        # Stored timestamps are naive UTC
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return {"username": username, "content": content, "timestamp": timestamp}
+
+
+async def _insert(db: AsyncSession, room_id: int, batch: List[dict], user_ids: Dict[str, Optional[int]]) -> int:
+    """
+    Insert one batch in its own transaction and return how many messages
+    had an author known here.
+    """
+    missing = {message["username"] for message in batch} - user_ids.keys()
+    if missing:
+        found = dict((await db.execute(select(User.username, User.id).where(User.username.in_(missing)))).all())
+        user_ids.update({username: found.get(username) for username in missing})
+
+    rows = [
+        {"user_id": user_ids[message["username"]], "room_id": room_id, "content": message["content"], "timestamp": message["timestamp"]}
+        for message in batch
+        if user_ids[message["username"]] is not None
+    ]
+    if rows:
+        await db.execute(insert(Message), rows)
+        await record_messages(db, {room_id: len(rows)})
+        await db.commit()
+        room_directory.record_messages(rows)
+    return len(rows)
+
+
+async def import_messages(db: AsyncSession, room_id: int, body: AsyncIterator[bytes], compressed: bool) -> dict:
+    """
+    Add the messages of an NDJSON export to a room, MESSAGE_IMPORT_BATCH_SIZE
+    rows per insert and transaction, reading the body as it arrives. Authors
+    are matched by username; messages by users unknown here are skipped, and
+    the ids in the file are not kept. An invalid line stops the import, with
+    the batches before it already committed.
+    """
+    # username -> user id here, None for unknown users
+    user_ids: Dict[str, Optional[int]] = {}
+    imported = skipped = 0
+    batch: List[dict] = []
+    line_number = 0
+    try:
+        async for line in _lines(body, compressed):
+            line_number += 1
+            if not line.strip():
+                continue
+            try:
+                batch.append(_parse(line))
+            except (ValueError, KeyError, TypeError):
+                raise InvalidImportException(line_number, imported)
+            if len(batch) >= settings.MESSAGE_IMPORT_BATCH_SIZE:
+                inserted = await _insert(db, room_id, batch, user_ids)
+                imported += inserted
+                skipped += len(batch) - inserted
+                batch = []
+        if batch:
+            inserted = await _insert(db, room_id, batch, user_ids)
+            imported += inserted
+            skipped += len(batch) - inserted
+    except zlib.error:
+        # The body is not gzip
+        raise InvalidImportException(line_number + 1, imported)
+    finally:
+        if imported:
+            # Imported messages may be older than the cached ones, and are too
+            # many to send over the backplane
+            await recent_messages.invalidate(room_id)
+        logger.info("transfer.imported", room_id=room_id, messages=imported, skipped=skipped)
+    return {"imported": imported, "skipped": skipped}
@@ -0,0 +1,243 @@
+import abc
+import asyncio
+import orjson
+import os
+import socket
+import struct
+import time
+import uuid
+from typing import Callable, Dict, List, Set, Tuple
+
+from ..config import settings
+from ..log import get_logger
+from ..serialization import encode_event
+
+logger = get_logger("backplane")
+
+
+class Backplane(abc.ABC):
+    """
+    Relays events between the worker processes serving the app. Events are
+    published on a named channel and delivered to the handlers subscribed to
+    that channel on every *other* worker; the publishing worker handles its
+    own copy locally.
+    """
+
+    def __init__(self):
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.handlers: Dict[str, List[Callable[[dict], None]]] = {}
+        # Events some peer never received
+        self.dropped = 0
+
+    def subscribe(self, channel: str, handler: Callable[[dict], None]):
+        self.handlers.setdefault(channel, []).append(handler)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    @abc.abstractmethod
+    async def publish(self, channel: str, data: dict):
+        ...
+
+    def _deliver(self, channel: str, data: dict):
+        for handler in self.handlers.get(channel, []):
+            try:
+                handler(data)
+            except Exception as e:
+                logger.error("backplane.handler_failed", channel=channel, error=str(e))
+
+    def stats(self):
+        return {"dropped": self.dropped}
+
+
+class InProcessBackplane(Backplane):
+    """
+    Delivers events to other backplanes attached to the same hub within this
+    process. With a single worker there are no peers and publishing is free.
+    """
+
+    def __init__(self, hub: List["InProcessBackplane"]):
+        super().__init__()
+        self.hub = hub
+
+    async def start(self):
+        self.hub.append(self)
+
+    async def stop(self):
+        if self in self.hub:
+            self.hub.remove(self)
+
+    async def publish(self, channel: str, data: dict):
+        for peer in list(self.hub):
+            if peer is not self:
+                peer._deliver(channel, data)
+
+
+class LocalIPCBackplane(Backplane):
+    """
+    Brokerless backplane for workers on the same host. Every worker binds a
+    Unix datagram socket in a shared directory and publishes by sending one
+    datagram to each peer socket found there. Events too large for one
+    datagram are sent in fragments. A publish waits up to PEER_SEND_TIMEOUT
+    for a peer whose queue is full before the event is dropped for that peer;
+    until that peer takes an event again, events it cannot take right away
+    are dropped without waiting.
+    """
+
+    PEER_REFRESH_INTERVAL = 1.0  # seconds
+    PEER_SEND_TIMEOUT = 1.0  # seconds
+    # A full peer queue is not reported by poll() on an unconnected socket
+    SEND_RETRY_DELAY = 0.005  # seconds
+    # Unix datagrams must fit in the socket send buffer (~208KB by default)
+    MAX_DATAGRAM_SIZE = 192 * 1024
+    # Fragments start with this byte, whole events with "{"
+    FRAGMENT_MARK = b"#"
+    # Event number, fragment index, fragment count
+    FRAGMENT_HEADER = struct.Struct("!QII")
+
+    def __init__(self, directory: str):
+        super().__init__()
+        self.directory = directory
+        self.path = os.path.join(directory, f"{self.worker_id}.sock")
+        self.sock = None
+        self.peers: List[str] = []
+        self.peers_refreshed_at = 0.0
+        self.fragmented = 0
+        self.sequence = 0
+        self.send_lock = asyncio.Lock()
+        # Peers that timed out and have not taken an event since
+        self.behind: Set[str] = set()
+        # Sender -> number and fragments so far of the event being reassembled
+        self.partial: Dict[str, Tuple[int, List[bytes]]] = {}
+
+    async def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self.sock.bind(self.path)
+        asyncio.get_running_loop().add_reader(self.sock.fileno(), self._on_readable)
+
+    async def stop(self):
+        if self.sock is None:
+            return
+        asyncio.get_running_loop().remove_reader(self.sock.fileno())
+        self.sock.close()
+        self.sock = None
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    async def publish(self, channel: str, data: dict):
+        event = encode_event({"channel": channel, "data": data}).encode()
+        if len(event) <= self.MAX_DATAGRAM_SIZE:
+            datagrams = [event]
+        else:
+            datagrams = self._fragment(event)
+            self.fragmented += 1
+        # One event at a time, so every peer gets events and fragments in order
+        async with self.send_lock:
+            for peer in self._get_peers():
+                await self._send(peer, channel, datagrams)
+
+    def _fragment(self, event: bytes) -> List[bytes]:
+        size = self.MAX_DATAGRAM_SIZE - len(self.FRAGMENT_MARK) - self.FRAGMENT_HEADER.size
+        count = -(-len(event) // size)
+        self.sequence += 1
+        return [
+            self.FRAGMENT_MARK + self.FRAGMENT_HEADER.pack(self.sequence, index, count) + event[index * size:(index + 1) * size]
+            for index in range(count)
+        ]
+
+    async def _send(self, peer: str, channel: str, datagrams: List[bytes]):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (0 if peer in self.behind else self.PEER_SEND_TIMEOUT)
+        try:
+            for datagram in datagrams:
+                while True:
+                    try:
+                        self.sock.sendto(datagram, peer)
+                        break
+                    except BlockingIOError:
+                        if loop.time() >= deadline:
+                            self.dropped += 1
+                            if peer not in self.behind:
+                                self.behind.add(peer)
+                                logger.warning("backplane.peer_behind", peer=peer, channel=channel)
+                            return
+                        await asyncio.sleep(self.SEND_RETRY_DELAY)
+            self.behind.discard(peer)
+        except (FileNotFoundError, ConnectionRefusedError):
+            # The peer exited without cleaning up its socket
+            self._remove_peer(peer)
+        except OSError as e:
+            self.dropped += 1
+            logger.error("backplane.publish_failed", peer=peer, channel=channel, error=str(e))
+
+    def _get_peers(self) -> List[str]:
+        now = time.monotonic()
+        if now - self.peers_refreshed_at >= self.PEER_REFRESH_INTERVAL:
+            self.peers = [
+                os.path.join(self.directory, name)
+                for name in os.listdir(self.directory)
+                if name.endswith(".sock") and os.path.join(self.directory, name) != self.path
+            ]
+            self.peers_refreshed_at = now
+        return self.peers
+
+    def _remove_peer(self, peer: str):
+        self.behind.discard(peer)
+        if peer in self.peers:
+            self.peers.remove(peer)
+        try:
+            os.unlink(peer)
+        except OSError:
+            pass
+
+    def _on_readable(self):
+        while True:
+            try:
+                datagram, sender = self.sock.recvfrom(self.MAX_DATAGRAM_SIZE)
+            except (BlockingIOError, InterruptedError):
+                return
+            if datagram.startswith(self.FRAGMENT_MARK):
+                datagram = self._reassemble(sender, datagram)
+                if datagram is None:
+                    continue
+            event = orjson.loads(datagram)
+            self._deliver(event["channel"], event["data"])
+
+    def _reassemble(self, sender: str, datagram: bytes):
+        """
+        Collect a fragment; returns the whole event with its last fragment.
+        """
+        number, index, count = self.FRAGMENT_HEADER.unpack_from(datagram, len(self.FRAGMENT_MARK))
+        if index == 0:
+            # A sender's fragments arrive in order, so this also gives up on an
+            # event whose sending timed out part way
+            self.partial[sender] = (number, [])
+        current = self.partial.get(sender)
+        if current is None or current[0] != number or len(current[1]) != index:
+            return None
+        current[1].append(datagram[len(self.FRAGMENT_MARK) + self.FRAGMENT_HEADER.size:])
+        if index + 1 < count:
+            return None
+        del self.partial[sender]
+        return b"".join(current[1])
+
+    def stats(self):
+        return {"peers": len(self.peers), "dropped": self.dropped, "fragmented": self.fragmented}
+
+
+_in_process_hub: List[InProcessBackplane] = []
+
+def create_backplane(kind: str, ipc_directory: str) -> Backplane:
+    if kind == "ipc":
+        return LocalIPCBackplane(ipc_directory)
+    return InProcessBackplane(_in_process_hub)
+
+
+backplane = create_backplane(settings.WS_BACKPLANE, settings.WS_BACKPLANE_IPC_DIR)
@@ -0,0 +1,116 @@
+from typing import Dict, List, Optional, Union
+
+import msgpack
+import orjson
+
+from ..serialization import encode_event
+
+# Events are dicts; a few replies, such as the invalid JSON notice, are plain text
+Event = Union[dict, str]
+
+# A two entry map holding "type": "batch" and the "events" key, up to the array
+BATCH_MAP_HEADER = b"\x82" + msgpack.packb("type") + msgpack.packb("batch") + msgpack.packb("events")
+
+
+class JsonCodec:
+    """
+    JSON text frames, used when the client asks for no subprotocol.
+    """
+
+    subprotocol: Optional[str] = "chat.json"
+
+    def encode(self, event: Event) -> Union[str, bytes]:
+        return event if isinstance(event, str) else encode_event(event)
+
+    def decode(self, frame: Union[str, bytes]):
+        """
+        A received frame as Python objects; raises ValueError if it cannot
+        be parsed.
+        """
+        return orjson.loads(frame)
+
+    def encode_batch(self, encoded: List[Union[str, bytes]]) -> Union[str, bytes]:
+        """
+        A {"type": "batch", "events": [...]} frame from already encoded events.
+        """
+        return '{"type":"batch","events":[' + ",".join(encoded) + "]}"
+
+
+class MessagePackCodec(JsonCodec):
+    """
+    MessagePack binary frames, for clients that offer the "chat.msgpack"
+    subprotocol. Text frames from these clients are still read as JSON.
+    """
+
+    subprotocol = "chat.msgpack"
+
+    def encode(self, event: Event) -> Union[str, bytes]:
+        return msgpack.packb(event)
+
+    def decode(self, frame: Union[str, bytes]):
+        if isinstance(frame, str):
+            return super().decode(frame)
+        try:
+            return msgpack.unpackb(frame)
+        except (msgpack.UnpackException, TypeError) as e:
+            # Truncated data, or a map with unhashable keys
+            raise ValueError(str(e)) from e
+
+    def encode_batch(self, encoded: List[Union[str, bytes]]) -> Union[str, bytes]:
+        return BATCH_MAP_HEADER + msgpack.Packer().pack_array_header(len(encoded)) + b"".join(encoded)
+
+
+json_codec = JsonCodec()
+CODECS: Dict[str, JsonCodec] = {codec.subprotocol: codec for codec in (json_codec, MessagePackCodec())}
+
+
+def negotiate(offered: List[str]):
+    """
+    The codec for the first subprotocol the client offers that the server
+    supports, and the subprotocol to accept; JSON and no subprotocol if
+    there is none.
+    """
+    for subprotocol in offered:
+        codec = CODECS.get(subprotocol)
+        if codec is not None:
+            return codec, subprotocol
+    return json_codec, None
+
+
+class Outgoing:
+    """
+    An event on its way to one or more sockets. It is encoded on first use
+    for each codec, so a broadcast is encoded at most once per codec however
+    many sockets receive it.
+    """
+
+    __slots__ = ("event", "encoded")
+
+    def __init__(self, event: Event):
+        self.event = event
+        self.encoded: Dict[str, Union[str, bytes]] = {}
+
+    def encode(self, codec: JsonCodec) -> Union[str, bytes]:
+        data = self.encoded.get(codec.subprotocol)
+        if data is None:
+            data = self.encoded[codec.subprotocol] = codec.encode(self.event)
+        return data
+
+
+class Batch(Outgoing):
+    """
+    Several room events sent as one frame. Each event keeps its own cached
+    encoding, so a batch only joins them.
+    """
+
+    __slots__ = ("events",)
+
+    def __init__(self, events: List[Outgoing]):
+        super().__init__(None)
+        self.events = events
+
+    def encode(self, codec: JsonCodec) -> Union[str, bytes]:
+        data = self.encoded.get(codec.subprotocol)
+        if data is None:
+            data = self.encoded[codec.subprotocol] = codec.encode_batch([event.encode(codec) for event in self.events])
+        return data
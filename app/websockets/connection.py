@@ -1,144 +1,340 @@
 from datetime import datetime
-from fastapi import WebSocket, WebSocketDisconnect, Depends, HTTPException
-from typing import Dict, Set
-import json
+from fastapi import WebSocket, WebSocketDisconnect, HTTPException
+from typing import Dict, List, Optional, Set, Tuple
+import asyncio
+import time
 from jose import JWTError, jwt
-from sqlalchemy.orm import Session
+from pydantic import ValidationError
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from ..config import settings
-from ..database import get_db
-from ..models.user import User
-from ..models.message import Message
-from ..models.token import RevokedToken
+from ..database import SessionLocal
+from ..log import get_logger
+from ..metrics import realtime_metrics
+from ..models.chat_room import ChatRoom
 from ..schemas.message import MessageCreate
+from ..services.auth import get_token_id
+from ..services.persistence import message_writer
+from ..services.principals import resolve_principal
+from ..services.revocation import revocation_list
+from .backplane import Backplane, backplane
+from .codecs import Batch, JsonCodec, Outgoing, negotiate
+from .fanout import OutboundQueue
+from .presence import PresenceTracker, presence_tracker
+from .sharding import ShardRouter, shard_router
+
+logger = get_logger("ws")
 
 
 class ConnectionManager:
-    def __init__(self):
+    def __init__(self, backplane: Backplane, presence: PresenceTracker, shards: ShardRouter):
         self.active_connections: Dict[int, Set[WebSocket]] = {}
         self.user_connections: Dict[int, Set[WebSocket]] = {}
+        self.outbound: Dict[WebSocket, OutboundQueue] = {}
+        self.connection_owners: Dict[WebSocket, Tuple[int, int]] = {}
+        # Sockets that asked for batched frames, and the room events waiting
+        # for the end of the current window
+        self.coalescing: Dict[int, Set[WebSocket]] = {}
+        self.pending: Dict[int, List[Outgoing]] = {}
+        self.flush_timers: Dict[int, asyncio.TimerHandle] = {}
+        # When each socket last sent a frame, for the heartbeat sweep
+        self.last_seen: Dict[WebSocket, float] = {}
+        self.heartbeat_task: Optional[asyncio.Task] = None
+
+        # Events published by other workers are only fanned out locally
+        self.backplane = backplane
+        self.backplane.subscribe("room", lambda event: self._send_to_room(event["room_id"], Outgoing(event["event"])))
+        self.backplane.subscribe("user", lambda event: self._send_to_user(event["user_id"], Outgoing(event["event"])))
+        # Presence diffs are worked out on each worker for its own sockets
+        self.presence = presence
+        self.presence.subscribe(lambda room_id, event: self._send_to_room(room_id, Outgoing(event)))
+        self.shards = shards
+
+    async def connect(self, websocket: WebSocket, room_id: int, user_id: int, username: str, coalesce: bool = False) -> JsonCodec:
+        """
+        Accept the socket with the first subprotocol it offers that we
+        support, and return the codec for its frames. With coalesce, room
+        events reach it in batches, one frame per window. The socket is sent
+        who is online in the room; the others hear of it in the next
+        presence diff.
+        """
+        codec, subprotocol = negotiate(websocket.scope.get("subprotocols", []))
+        await websocket.accept(subprotocol=subprotocol)
+        coalesce = coalesce and settings.WS_COALESCE_WINDOW > 0
+        logger.info("ws.connect", room_id=room_id, user_id=user_id, username=username, subprotocol=subprotocol, coalesce=coalesce)
 
-    async def connect(self, websocket: WebSocket, room_id: int, user_id: int, username: str):
-        await websocket.accept()
-        print(f"[CONNECT] WebSocket connected: room={room_id}, user_id={user_id}, username={username}")
+        self.outbound[websocket] = OutboundQueue(websocket, settings.WS_MESSAGE_QUEUE_SIZE, codec)
+        self.connection_owners[websocket] = (room_id, user_id)
+        self.last_seen[websocket] = time.monotonic()
 
         if room_id not in self.active_connections:
             self.active_connections[room_id] = set()
         self.active_connections[room_id].add(websocket)
 
+        if coalesce:
+            if room_id not in self.coalescing:
+                self.coalescing[room_id] = set()
+            self.coalescing[room_id].add(websocket)
+
         if user_id not in self.user_connections:
             self.user_connections[user_id] = set()
         self.user_connections[user_id].add(websocket)
 
-        await self.broadcast(
-            room_id,
-            {
-                "type": "system",
-                "content": f"User {username} has joined the chat"
-            }
-        )
+        self.send(websocket, Outgoing(self.presence.connect(room_id, user_id, username)))
+        return codec
 
     def disconnect(self, websocket: WebSocket, room_id: int, user_id: int):
+        # Sockets evicted by the server are disconnected again when their
+        # endpoint sees the close
+        if websocket not in self.connection_owners:
+            return
+
         if room_id in self.active_connections:
             if websocket in self.active_connections[room_id]:
                 self.active_connections[room_id].remove(websocket)
             if len(self.active_connections[room_id]) == 0:
                 del self.active_connections[room_id]
 
+        if room_id in self.coalescing:
+            self.coalescing[room_id].discard(websocket)
+            if len(self.coalescing[room_id]) == 0:
+                del self.coalescing[room_id]
+                self.pending.pop(room_id, None)
+                timer = self.flush_timers.pop(room_id, None)
+                if timer is not None:
+                    timer.cancel()
+
         if user_id in self.user_connections:
             if websocket in self.user_connections[user_id]:
                 self.user_connections[user_id].remove(websocket)
             if len(self.user_connections[user_id]) == 0:
                 del self.user_connections[user_id]
 
-        print(f"[DISCONNECT] User {user_id} disconnected from room {room_id}")
+        outbound = self.outbound.pop(websocket, None)
+        if outbound is not None:
+            outbound.close()
+        del self.connection_owners[websocket]
+        self.last_seen.pop(websocket, None)
+        self.presence.disconnect(room_id, user_id)
+
+        logger.info("ws.disconnect", room_id=room_id, user_id=user_id)
+
+    def send(self, websocket: WebSocket, outgoing: Outgoing):
+        """
+        Queue an event for one socket, applying the slow consumer policy if
+        its outbound queue is full.
+        """
+        outbound = self.outbound.get(websocket)
+        if outbound is None or outbound.put(outgoing):
+            return
+
+        if settings.WS_SLOW_CONSUMER_POLICY == "disconnect":
+            room_id, user_id = self.connection_owners[websocket]
+            logger.warning("ws.slow_consumer_disconnect", room_id=room_id, user_id=user_id)
+            realtime_metrics.slow_consumer_disconnects += 1
+            self.disconnect(websocket, room_id, user_id)
+            asyncio.create_task(self.close(websocket, 1013))
+
+    async def close(self, websocket: WebSocket, code: int):
+        try:
+            await websocket.close(code=code)
+        except Exception as e:
+            logger.error("ws.close_failed", error=str(e))
+
+    def touch(self, websocket: WebSocket):
+        if websocket in self.last_seen:
+            self.last_seen[websocket] = time.monotonic()
+
+    def sweep(self):
+        """
+        Evict sockets whose writer has given up after a failed send. With an
+        idle timeout, also ping sockets that have been quiet for a heartbeat
+        interval, and evict those quiet for longer than the timeout.
+        """
+        now = time.monotonic()
+        ping = Outgoing({"type": "ping"})
+        for websocket, seen_at in list(self.last_seen.items()):
+            outbound = self.outbound.get(websocket)
+            if outbound is not None and outbound.closed:
+                self._reap(websocket, "send_failed")
+            elif settings.WS_IDLE_TIMEOUT <= 0:
+                continue
+            elif now - seen_at >= settings.WS_IDLE_TIMEOUT:
+                self._reap(websocket, "idle")
+            elif now - seen_at >= settings.WS_HEARTBEAT_INTERVAL:
+                self.send(websocket, ping)
+                realtime_metrics.pings += 1
+
+    def _reap(self, websocket: WebSocket, reason: str):
+        room_id, user_id = self.connection_owners[websocket]
+        logger.info("ws.reaped", room_id=room_id, user_id=user_id, reason=reason)
+        realtime_metrics.reaped[reason] = realtime_metrics.reaped.get(reason, 0) + 1
+        self.disconnect(websocket, room_id, user_id)
+        asyncio.create_task(self.close(websocket, 1001))
+
+    async def start(self):
+        if settings.WS_HEARTBEAT_INTERVAL > 0:
+            self.heartbeat_task = asyncio.create_task(self._run_heartbeat())
+
+    async def stop(self):
+        if self.heartbeat_task is not None:
+            self.heartbeat_task.cancel()
+            self.heartbeat_task = None
+
+    async def _run_heartbeat(self):
+        # Sweeping twice per interval pings a socket at most half an interval late
+        while True:
+            await asyncio.sleep(settings.WS_HEARTBEAT_INTERVAL / 2)
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error("ws.sweep_failed", error=str(e))
 
     async def broadcast(self, room_id: int, message: dict):
-        print(f"[BROADCAST] Broadcasting in room {room_id}: {message}")
-        if room_id in self.active_connections:
-            for connection in self.active_connections[room_id]:
-                try:
-                    await connection.send_text(json.dumps(message))
-                except Exception as e:
-                    print(f"[ERROR] Failed to send message to a client: {e}")
+        logger.debug("ws.broadcast", room_id=room_id, type=message.get("type"))
+        realtime_metrics.broadcasts += 1
+        self._send_to_room(room_id, Outgoing(message))
+        # With sharding every socket of the room is on this worker, its owner
+        if not self.shards.sharded:
+            await self.backplane.publish("room", {"room_id": room_id, "event": message})
 
     async def send_personal_message(self, user_id: int, message: dict):
+        self._send_to_user(user_id, Outgoing(message))
+        await self.backplane.publish("user", {"user_id": user_id, "event": message})
+
+    def _send_to_room(self, room_id: int, outgoing: Outgoing):
+        if room_id in self.active_connections:
+            started = time.perf_counter()
+            coalescing = self.coalescing.get(room_id, ())
+            connections = [connection for connection in self.active_connections[room_id] if connection not in coalescing]
+            for connection in connections:
+                self.send(connection, outgoing)
+            realtime_metrics.deliveries += len(connections)
+            if coalescing:
+                self._coalesce(room_id, outgoing)
+            realtime_metrics.fanout_time.observe(time.perf_counter() - started)
+
+    def _coalesce(self, room_id: int, outgoing: Outgoing):
+        pending = self.pending.setdefault(room_id, [])
+        pending.append(outgoing)
+        if len(pending) >= settings.WS_COALESCE_MAX_EVENTS:
+            self._flush_room(room_id)
+        elif room_id not in self.flush_timers:
+            self.flush_timers[room_id] = asyncio.get_running_loop().call_later(
+                settings.WS_COALESCE_WINDOW, self._flush_room, room_id
+            )
+
+    def _flush_room(self, room_id: int):
+        """
+        Send the room events of the window that just ended to the sockets
+        that asked for batches, as one frame each.
+        """
+        timer = self.flush_timers.pop(room_id, None)
+        if timer is not None:
+            timer.cancel()
+        events = self.pending.pop(room_id, None)
+        if not events:
+            return
+        # A lone event goes out as it is, so quiet rooms see no batch frames
+        outgoing = events[0] if len(events) == 1 else Batch(events)
+        connections = list(self.coalescing.get(room_id, ()))
+        for connection in connections:
+            self.send(connection, outgoing)
+        realtime_metrics.deliveries += len(connections) * len(events)
+        realtime_metrics.coalesced_frames += len(connections)
+        realtime_metrics.coalesced_events += len(connections) * len(events)
+
+    def _send_to_user(self, user_id: int, outgoing: Outgoing):
         if user_id in self.user_connections:
-            for connection in self.user_connections[user_id]:
-                await connection.send_text(json.dumps(message))
+            for connection in list(self.user_connections[user_id]):
+                self.send(connection, outgoing)
 
 
-manager = ConnectionManager()
+manager = ConnectionManager(backplane, presence_tracker, shard_router)
 
-async def get_user_from_token(token: str, db: Session):
+async def get_user_from_token(token: str, db: AsyncSession):
     credentials_exception = HTTPException(status_code=401, detail="Could not validate credentials")
-    revoked_token = db.query(RevokedToken).filter(RevokedToken.jti == token).first()
-    if revoked_token:
-        print(f"[TOKEN] Token revoked for: {token}")
-        raise credentials_exception
-
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
-            print("[TOKEN] Username not found in token payload")
+            logger.warning("auth.token_invalid", reason="no subject")
             raise credentials_exception
     except JWTError as e:
-        print(f"[TOKEN ERROR] JWTError: {e}")
+        logger.warning("auth.token_invalid", reason=str(e))
+        raise credentials_exception
+
+    jti = get_token_id(payload, token)
+    if revocation_list.is_revoked(jti):
+        logger.warning("auth.token_revoked", token=jti)
         raise credentials_exception
 
-    user = db.query(User).filter(User.username == username).first()
-    if user is None:
-        print(f"[AUTH ERROR] User not found: {username}")
+    principal = await resolve_principal(db, jti, username)
+    if principal is None:
+        logger.warning("auth.user_not_found", username=username)
         raise credentials_exception
 
-    return user
+    return principal
 
 
-async def websocket_endpoint(
-    websocket: WebSocket,
-    room_id: int,
-    token: str,
-    db: Session = Depends(get_db)
-):
-    print(f"[REQUEST] WebSocket connection attempt in room {room_id} with token {token[:10]}...")
+async def websocket_endpoint(websocket: WebSocket, room_id: int, token: str, batch: bool = False):
+    logger.debug("ws.connect_attempt", room_id=room_id, token=token)
 
+    if not shard_router.owns(room_id):
+        await shard_router.route(websocket, room_id)
+        return
+
+    # Sockets live for hours, so they only hold a database connection while
+    # they query; messages are stored by the message writer's own sessions
     try:
-        user = await get_user_from_token(token, db)
-        print(f"[AUTH] Authenticated user: {user.username} (ID: {user.id})")
+        async with SessionLocal() as db:
+            user = await get_user_from_token(token, db)
+            room = await db.scalar(select(ChatRoom.id).where(ChatRoom.id == room_id))
+        logger.debug("ws.authenticated", room_id=room_id, user_id=user.id)
     except HTTPException:
         await websocket.close(code=1008)
-        print(f"[AUTH FAILED] Closing socket for token {token[:10]}...")
+        logger.info("ws.auth_failed", room_id=room_id, token=token)
+        return
+    if room is None:
+        await websocket.close(code=1008)
+        logger.info("ws.room_not_found", room_id=room_id, user_id=user.id)
         return
 
-    await manager.connect(websocket, room_id, user.id, user.username)
+    codec = await manager.connect(websocket, room_id, user.id, user.username, coalesce=batch)
 
     try:
         while True:
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(frame.get("code", 1000))
+            manager.touch(websocket)
+            data = frame["text"] if frame.get("text") is not None else frame.get("bytes")
+            logger.debug("ws.receive", room_id=room_id, user_id=user.id, data=data)
             try:
-                data = await websocket.receive_text()
-                print(f"[RECEIVE] From {user.username}: {data}")
-                message_data = json.loads(data)
-            except json.JSONDecodeError as e:
-                print(f"[ERROR] JSON decode failed: {e}")
-                await websocket.send_text("Invalid JSON format. Please send proper JSON.")
+                message_data = codec.decode(data)
+            except ValueError as e:
+                logger.info("ws.invalid_frame", room_id=room_id, user_id=user.id, error=str(e))
+                manager.send(websocket, Outgoing("Invalid JSON format. Please send proper JSON."))
                 continue
 
-            if "content" in message_data:
-                content = message_data["content"]
-                timestamp = datetime.utcnow()
-
-                new_message = Message(
-                    user_id=user.id,
-                    room_id=room_id,
-                    content=content,
-                    timestamp=timestamp
-                )
-                db.add(new_message)
-                db.commit()
-                db.refresh(new_message)
+            if isinstance(message_data, dict) and message_data.get("type") in ("ping", "pong"):
+                # Heartbeats only need to reach touch(); client pings are answered
+                if message_data["type"] == "ping":
+                    manager.send(websocket, Outgoing({"type": "pong"}))
+                continue
 
-                print(f"[DB] Stored message from {user.username} in DB: {content}")
+            if isinstance(message_data, dict) and "content" in message_data:
+                try:
+                    # Strict, so MessagePack bytes are not taken for text
+                    content = MessageCreate.model_validate(message_data, strict=True).content
+                except ValidationError:
+                    logger.info("ws.invalid_content", room_id=room_id, user_id=user.id)
+                    manager.send(websocket, Outgoing("Invalid message. Content must be a non-empty string."))
+                    continue
+                realtime_metrics.messages_received += 1
+                # Whole seconds, as stored by the TIMESTAMP column
+                timestamp = datetime.utcnow().replace(microsecond=0)
 
                 await manager.broadcast(
                     room_id,
@@ -150,18 +346,15 @@ async def websocket_endpoint(
                         "timestamp": timestamp.isoformat()
                     }
                 )
+
+                await message_writer.enqueue(user.id, user.username, room_id, content, timestamp)
+                logger.debug("ws.message_queued", room_id=room_id, user_id=user.id, content=content)
             else:
-                print(f"[WARN] Message from {user.username} missing 'content': {message_data}")
+                logger.info("ws.missing_content", room_id=room_id, user_id=user.id, payload=message_data)
 
     except WebSocketDisconnect:
-        print(f"[DISCONNECT] {user.username} disconnected.")
         manager.disconnect(websocket, room_id, user.id)
-        await manager.broadcast(
-            room_id,
-            {
-                "type": "system",
-                "content": f"User {user.username} has left the chat"
-            }
-        )
-    except Exception as e:
-        print(f"[ERROR] Unhandled exception: {e}")
+    except Exception:
+        logger.error("ws.unhandled_error", room_id=room_id, user_id=user.id, exc_info=True)
+        manager.disconnect(websocket, room_id, user.id)
+        await manager.close(websocket, 1011)
@@ -0,0 +1,58 @@
+import asyncio
+import time
+from fastapi import WebSocket
+
+from ..log import get_logger
+from ..metrics import realtime_metrics
+from .codecs import JsonCodec, Outgoing
+
+logger = get_logger("ws.fanout")
+
+
+class OutboundQueue:
+    """
+    Bounded send queue for a single WebSocket, drained by its own writer task
+    so that a slow client never delays delivery to the rest of the room.
+    """
+
+    def __init__(self, websocket: WebSocket, maxsize: int, codec: JsonCodec):
+        self.websocket = websocket
+        self.codec = codec
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self.closed = False
+        self.task = asyncio.create_task(self._writer())
+
+    def put(self, outgoing: Outgoing) -> bool:
+        """
+        Queue an event for this socket. Returns False if the queue is full.
+        """
+        if self.closed:
+            return True
+        try:
+            self.queue.put_nowait((time.perf_counter(), outgoing))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            realtime_metrics.dropped += 1
+            return False
+        return True
+
+    def close(self):
+        self.closed = True
+        self.task.cancel()
+
+    async def _writer(self):
+        while True:
+            queued_at, outgoing = await self.queue.get()
+            try:
+                data = outgoing.encode(self.codec)
+                if isinstance(data, bytes):
+                    await self.websocket.send_bytes(data)
+                else:
+                    await self.websocket.send_text(data)
+            except Exception as e:
+                logger.warning("ws.send_failed", error=str(e))
+                realtime_metrics.send_failures += 1
+                self.closed = True
+                return
+            realtime_metrics.delivery_time.observe(time.perf_counter() - queued_at)
@@ -0,0 +1,213 @@
+import asyncio
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from ..config import settings
+from ..log import get_logger
+from ..metrics import realtime_metrics
+from .backplane import Backplane, backplane
+
+logger = get_logger("presence")
+
+# room_id -> user_id -> username
+RoomUsers = Dict[int, Dict[int, str]]
+
+
+class PresenceTracker:
+    """
+    Who is online in each room, across all workers, kept in memory.
+
+    A user is online in a room while they have at least one socket in it on
+    some worker. When their last local socket closes they stay online for
+    PRESENCE_LEAVE_GRACE seconds, so a reconnect goes unnoticed. Changes are
+    collected for PRESENCE_FLUSH_INTERVAL seconds and then sent to the local
+    sockets of each changed room as one diff, and the changed rooms of this
+    worker are published on the backplane. Every worker also publishes its
+    whole view every PRESENCE_SYNC_INTERVAL seconds; a worker that has not
+    been heard from for three intervals is assumed gone.
+    """
+
+    def __init__(self, backplane: Backplane, leave_grace: float, flush_interval: float, sync_interval: float):
+        self.backplane = backplane
+        self.leave_grace = leave_grace
+        self.flush_interval = flush_interval
+        self.sync_interval = sync_interval
+        # Open sockets per room and user on this worker
+        self.sockets: Dict[int, Dict[int, int]] = {}
+        # Users online through this worker, including those within the grace period
+        self.local: RoomUsers = {}
+        # worker_id -> (last heard from, its rooms)
+        self.remote: Dict[str, Tuple[float, RoomUsers]] = {}
+        # What the local sockets of each room have been told
+        self.announced: RoomUsers = {}
+        self.leave_timers: Dict[Tuple[int, int], asyncio.TimerHandle] = {}
+        # Rooms whose local users changed, and rooms that may need a diff
+        self.changed: Set[int] = set()
+        self.dirty: Set[int] = set()
+        self.flush_timer: Optional[asyncio.TimerHandle] = None
+        self.handlers: List[Callable[[int, dict], None]] = []
+        self.task: Optional[asyncio.Task] = None
+        self.backplane.subscribe("presence", self._on_presence)
+
+    def subscribe(self, handler: Callable[[int, dict], None]):
+        """
+        Register a handler called with a room id and a presence event for
+        the local sockets of that room.
+        """
+        self.handlers.append(handler)
+
+    def online(self, room_id: int) -> Dict[int, str]:
+        users = dict(self.local.get(room_id, {}))
+        for _, rooms in self.remote.values():
+            users.update(rooms.get(room_id, {}))
+        return users
+
+    def connect(self, room_id: int, user_id: int, username: str) -> dict:
+        """
+        Record a new local socket and return the snapshot event for it.
+        """
+        users = self.sockets.setdefault(room_id, {})
+        users[user_id] = users.get(user_id, 0) + 1
+
+        timer = self.leave_timers.pop((room_id, user_id), None)
+        if timer is not None:
+            timer.cancel()
+        elif self.local.get(room_id, {}).get(user_id) != username:
+            self.local.setdefault(room_id, {})[user_id] = username
+            self._mark(room_id, changed=True)
+
+        online = self.online(room_id)
+        if room_id not in self.announced:
+            # The first local socket of the room gets everything in its snapshot
+            self.announced[room_id] = online
+        return {"type": "presence", "room_id": room_id, "online": _user_list(online)}
+
+    def disconnect(self, room_id: int, user_id: int):
+        users = self.sockets.get(room_id)
+        if not users or user_id not in users:
+            return
+        users[user_id] -= 1
+        if users[user_id] > 0:
+            return
+        del users[user_id]
+        if not users:
+            del self.sockets[room_id]
+            self.announced.pop(room_id, None)
+        self.leave_timers[(room_id, user_id)] = asyncio.get_running_loop().call_later(
+            self.leave_grace, self._leave, room_id, user_id
+        )
+
+    def _leave(self, room_id: int, user_id: int):
+        self.leave_timers.pop((room_id, user_id), None)
+        users = self.local.get(room_id)
+        if users is None or users.pop(user_id, None) is None:
+            return
+        if not users:
+            del self.local[room_id]
+        self._mark(room_id, changed=True)
+
+    def _mark(self, room_id: int, changed: bool = False):
+        if changed:
+            self.changed.add(room_id)
+        self.dirty.add(room_id)
+        if self.flush_timer is None:
+            self.flush_timer = asyncio.get_running_loop().call_later(self.flush_interval, self._flush)
+
+    def _flush(self):
+        self.flush_timer = None
+        if self.changed:
+            rooms = {room_id: self.local.get(room_id, {}) for room_id in self.changed}
+            self.changed = set()
+            asyncio.create_task(self._publish(rooms))
+
+        dirty, self.dirty = self.dirty, set()
+        for room_id in dirty:
+            announced = self.announced.get(room_id)
+            if announced is None:
+                # No local sockets to tell
+                continue
+            online = self.online(room_id)
+            joined = {user_id: username for user_id, username in online.items() if announced.get(user_id) != username}
+            left = {user_id: username for user_id, username in announced.items() if user_id not in online}
+            if not joined and not left:
+                continue
+            self.announced[room_id] = online
+            realtime_metrics.presence_events += 1
+            event = {"type": "presence", "room_id": room_id, "joined": _user_list(joined), "left": _user_list(left)}
+            for handler in self.handlers:
+                handler(room_id, event)
+
+    async def _publish(self, rooms: RoomUsers, full: bool = False, hello: bool = False):
+        await self.backplane.publish("presence", {
+            "worker": self.backplane.worker_id,
+            "full": full,
+            "hello": hello,
+            # JSON object keys are strings, so rooms travel as lists
+            "rooms": [[room_id, list(users.items())] for room_id, users in rooms.items()]
+        })
+
+    def _on_presence(self, event: dict):
+        rooms = {room_id: {user_id: username for user_id, username in users} for room_id, users in event["rooms"]}
+        _, known = self.remote.get(event["worker"], (0.0, {}))
+        if event["full"]:
+            updated = {room_id: users for room_id, users in rooms.items() if users}
+        else:
+            updated = {**known, **rooms}
+            updated = {room_id: users for room_id, users in updated.items() if users}
+        self.remote[event["worker"]] = (time.monotonic(), updated)
+        for room_id in known.keys() | rooms.keys():
+            self._mark(room_id)
+        if event["hello"]:
+            # A worker that just started wants everyone's view
+            asyncio.create_task(self._publish(self.local, full=True))
+
+    def _expire(self):
+        cutoff = time.monotonic() - 3 * self.sync_interval
+        for worker_id, (heard_at, rooms) in list(self.remote.items()):
+            if heard_at < cutoff:
+                logger.info("presence.worker_expired", worker=worker_id, rooms=len(rooms))
+                del self.remote[worker_id]
+                for room_id in rooms:
+                    self._mark(room_id)
+
+    async def start(self):
+        await self._publish({}, full=True, hello=True)
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        if self.flush_timer is not None:
+            self.flush_timer.cancel()
+            self.flush_timer = None
+        # Take this worker's users off the other workers' lists
+        await self._publish({}, full=True)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                self._expire()
+                await self._publish(self.local, full=True)
+            except Exception as e:
+                logger.error("presence.sync_failed", error=str(e))
+
+    def stats(self):
+        return {
+            "rooms": len(self.sockets),
+            "local_users": sum(len(users) for users in self.local.values()),
+            "remote_workers": len(self.remote)
+        }
+
+
+def _user_list(users: Dict[int, str]) -> List[dict]:
+    return [{"user_id": user_id, "username": username} for user_id, username in sorted(users.items())]
+
+
+presence_tracker = PresenceTracker(
+    backplane,
+    leave_grace=settings.PRESENCE_LEAVE_GRACE,
+    flush_interval=settings.PRESENCE_FLUSH_INTERVAL,
+    sync_interval=settings.PRESENCE_SYNC_INTERVAL
+)
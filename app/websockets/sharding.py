@@ -0,0 +1,182 @@
+import asyncio
+import bisect
+import hashlib
+import os
+from typing import List
+
+import websockets
+from fastapi import WebSocket
+from websockets.asyncio.client import unix_connect
+
+from ..config import settings
+from ..log import get_logger
+from .codecs import Outgoing, negotiate
+
+logger = get_logger("sharding")
+
+# Close code telling a client to reconnect to the URL in the redirect event
+REDIRECT_CLOSE_CODE = 4001
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+def shard_socket_path(directory: str, index: int) -> str:
+    return os.path.join(directory, f"shard-{index}.sock")
+
+
+class ShardRing:
+    """
+    Consistent hash ring of a fixed number of shards, with `replicas`
+    points per shard so rooms spread evenly.
+    """
+
+    def __init__(self, count: int, replicas: int = 160):
+        points = sorted((_hash(f"shard-{index}-{replica}"), index) for index in range(count) for replica in range(replicas))
+        self.hashes = [point for point, _ in points]
+        self.shards = [index for _, index in points]
+
+    def owner(self, room_id: int) -> int:
+        position = bisect.bisect(self.hashes, _hash(str(room_id))) % len(self.hashes)
+        return self.shards[position]
+
+
+class ShardRouter:
+    """
+    Sends each room's sockets to the worker process that owns the room, so
+    its events are fanned out and its messages stored by that worker alone,
+    instead of being relayed to every worker over the backplane.
+
+    A socket opened on another worker is either relayed to the owner over
+    the owner's Unix socket ("proxy"), frame by frame and without decoding,
+    or sent a redirect event with the owner's URL and closed with
+    REDIRECT_CLOSE_CODE ("redirect"). With a single shard every worker owns
+    every room.
+    """
+
+    def __init__(self, count: int, index: int, mode: str, ipc_directory: str, base_port: int, urls: List[str]):
+        self.count = count
+        self.index = index
+        self.mode = mode
+        self.ipc_directory = ipc_directory
+        self.base_port = base_port
+        self.urls = urls
+        self.ring = ShardRing(count) if count > 1 else None
+        self.routed = {"proxy": 0, "redirect": 0}
+        self.proxying = 0
+        self.proxy_failures = 0
+
+    @property
+    def sharded(self) -> bool:
+        return self.ring is not None
+
+    def owner(self, room_id: int) -> int:
+        return self.ring.owner(room_id) if self.ring is not None else self.index
+
+    def owns(self, room_id: int) -> bool:
+        return self.owner(room_id) == self.index
+
+    async def route(self, websocket: WebSocket, room_id: int):
+        """
+        Serve a socket for a room owned by another shard until it closes.
+        """
+        owner = self.owner(room_id)
+        self.routed[self.mode] += 1
+        logger.debug("shard.route", room_id=room_id, owner=owner, mode=self.mode)
+        if self.mode == "redirect":
+            await self._redirect(websocket, owner)
+        else:
+            await self._proxy(websocket, owner)
+
+    def _owner_url(self, websocket: WebSocket, owner: int) -> str:
+        if self.urls:
+            return f"{self.urls[owner].rstrip('/')}{websocket.url.path}?{websocket.url.query}"
+        return str(websocket.url.replace(port=self.base_port + owner))
+
+    async def _redirect(self, websocket: WebSocket, owner: int):
+        codec, subprotocol = negotiate(websocket.scope.get("subprotocols", []))
+        await websocket.accept(subprotocol=subprotocol)
+        event = Outgoing({"type": "redirect", "shard": owner, "url": self._owner_url(websocket, owner)})
+        data = event.encode(codec)
+        if isinstance(data, str):
+            await websocket.send_text(data)
+        else:
+            await websocket.send_bytes(data)
+        await websocket.close(code=REDIRECT_CLOSE_CODE)
+
+    async def _proxy(self, websocket: WebSocket, owner: int):
+        # The owner authenticates the socket and picks its subprotocol
+        try:
+            upstream = await unix_connect(
+                shard_socket_path(self.ipc_directory, owner),
+                f"ws://shard-{owner}{websocket.url.path}?{websocket.url.query}",
+                subprotocols=websocket.scope.get("subprotocols") or None,
+                compression=None,
+                ping_interval=None,
+                max_size=None
+            )
+        except websockets.InvalidStatus:
+            # The owner turned the socket away, e.g. for a bad token
+            await websocket.close(code=1008)
+            return
+        except (OSError, websockets.InvalidHandshake) as e:
+            self.proxy_failures += 1
+            logger.error("shard.proxy_failed", owner=owner, error=str(e))
+            await websocket.close(code=1013)
+            return
+
+        await websocket.accept(subprotocol=upstream.subprotocol)
+        self.proxying += 1
+        tasks = [asyncio.create_task(self._to_owner(websocket, upstream)), asyncio.create_task(self._to_client(websocket, upstream))]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            self.proxying -= 1
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await upstream.close()
+        if upstream.close_code is not None:
+            try:
+                await websocket.close(code=upstream.close_code)
+            except Exception:
+                # The client has gone already
+                pass
+
+    async def _to_owner(self, websocket: WebSocket, upstream):
+        while True:
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                return
+            await upstream.send(frame["text"] if frame.get("text") is not None else frame["bytes"])
+
+    async def _to_client(self, websocket: WebSocket, upstream):
+        try:
+            async for data in upstream:
+                if isinstance(data, str):
+                    await websocket.send_text(data)
+                else:
+                    await websocket.send_bytes(data)
+        except websockets.ConnectionClosed:
+            pass
+
+    def stats(self):
+        return {
+            "shard": self.index,
+            "shards": self.count,
+            "mode": self.mode,
+            "routed": dict(self.routed),
+            "proxying": self.proxying,
+            "proxy_failures": self.proxy_failures
+        }
+
+
+shard_router = ShardRouter(
+    count=settings.WS_SHARD_COUNT,
+    index=settings.WS_SHARD_INDEX,
+    mode=settings.WS_SHARD_MODE,
+    ipc_directory=settings.WS_SHARD_IPC_DIR,
+    base_port=settings.WS_SHARD_BASE_PORT,
+    urls=settings.WS_SHARD_URLS
+)
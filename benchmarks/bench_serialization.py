@@ -0,0 +1,122 @@
+"""
+Compare encoding a page of messages through the response model, as FastAPI
+does, with the direct path of app.serialization.
+
+    python -m benchmarks.bench_serialization --page-size 100
+
+Builds pages of random messages and times, per page: validating and dumping
+them through List[MessageDetailResponse] into a JSONResponse, against
+encode_messages; and json.dumps against encode_event for WebSocket events.
+Checks that both paths produce the same bytes and prints one JSON object per
+comparison.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+from fastapi._compat import ModelField
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+
+from app.schemas.message import MessageDetailResponse
+from app.serialization import encode_event, encode_messages, message_dict
+from .bench_search import build_vocabulary
+from .common import Reporter, latency_summary
+
+
+class Row:
+    # Stands in for a result row of the message query
+    def __init__(self, **values):
+        self.__dict__.update(values)
+
+
+def build_pages(pages: int, page_size: int) -> List[List[dict]]:
+    rng = random.Random(3)
+    words, cum_weights = build_vocabulary(2000, random.Random(42))
+    started_at = datetime(2025, 1, 1)
+    return [
+        [
+            message_dict(Row(
+                id=page * page_size + i,
+                content=" ".join(rng.choices(words, cum_weights=cum_weights, k=rng.randint(3, 30))) + rng.choice(["", " é", " 👍", "\n"]),
+                user_id=rng.randint(1, 1000),
+                room_id=7,
+                timestamp=started_at + timedelta(seconds=page * page_size + i, microseconds=rng.choice([0, 250000])),
+                username=f"user{rng.randint(1, 1000)}"
+            ))
+            for i in range(page_size)
+        ]
+        for page in range(pages)
+    ]
+
+
+async def through_response_model(field: ModelField, page: List[dict]) -> bytes:
+    content = await serialize_response(field=field, response_content=page)
+    return JSONResponse(content).body
+
+
+def time_each(function, items) -> List[float]:
+    timings = []
+    for item in items:
+        started = time.perf_counter()
+        function(item)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+async def run(args, reporter: Reporter):
+    field = create_model_field(name="Response", type_=List[MessageDetailResponse], mode="serialization")
+    pages = build_pages(args.pages, args.page_size)
+
+    for page in pages:
+        assert await through_response_model(field, page) == encode_messages(page), "encodings differ"
+
+    model_timings = []
+    for page in pages:
+        started = time.perf_counter()
+        await through_response_model(field, page)
+        model_timings.append(time.perf_counter() - started)
+    direct_timings = time_each(encode_messages, pages)
+    model, direct = latency_summary(model_timings), latency_summary(direct_timings)
+    reporter.report({
+        "benchmark": "serialization",
+        "case": f"message_page_{args.page_size}",
+        "response_model_p50_ms": model["p50_ms"],
+        "direct_p50_ms": direct["p50_ms"],
+        "speedup": round(sum(model_timings) / sum(direct_timings), 1)
+    })
+
+    events = [
+        {"type": "message", "user_id": m["user_id"], "username": m["username"], "content": m["content"], "timestamp": m["timestamp"].isoformat()}
+        for page in pages for m in page
+    ]
+    for event in events[:100]:
+        assert json.loads(encode_event(event)) == event
+    stdlib_timings = time_each(json.dumps, events)
+    direct_timings = time_each(encode_event, events)
+    reporter.report({
+        "benchmark": "serialization",
+        "case": "ws_event",
+        "json_dumps_p50_us": round(sorted(stdlib_timings)[len(events) // 2] * 1e6, 2),
+        "direct_p50_us": round(sorted(direct_timings)[len(events) // 2] * 1e6, 2),
+        "speedup": round(sum(stdlib_timings) / sum(direct_timings), 1)
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--output", default=None, help="append results to this JSON lines file")
+    args = parser.parse_args()
+    # No database involved
+    asyncio.run(run(args, Reporter(args.output, "none")))
+
+
+if __name__ == "__main__":
+    main()
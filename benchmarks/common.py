@@ -0,0 +1,184 @@
+"""
+Helpers shared by the benchmarks: starting the app under uvicorn, logging in,
+summarising latencies and writing results.
+
+Every benchmark prints one JSON object per result. With --output the objects
+are also appended to a JSON lines file, tagged with the git revision and the
+database, so runs can be compared with benchmarks.compare.
+"""
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import List, Optional
+
+import httpx
+
+PASSWORD = "benchmark"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def temporary_database(name: str) -> str:
+    return "sqlite+aiosqlite:///" + os.path.join(tempfile.mkdtemp(), f"{name}.db")
+
+
+def default_search_backend(database_url: str) -> str:
+    # FULLTEXT indexes only exist on MySQL
+    return "fulltext" if database_url.startswith("mysql") else "like"
+
+
+def start_server(database_url: str, port: int, workers: int = 1, sharded: bool = False, **env) -> subprocess.Popen:
+    """
+    Start the app on port. Several workers share events over the ipc
+    backplane; sharded workers are started by app.launcher on ports port to
+    port + workers - 1, redirecting sockets to the shard owning their room.
+    """
+    env = {
+        **os.environ,
+        "DATABASE_URL": database_url,
+        "SECRET_KEY": os.environ.get("SECRET_KEY", "benchmark"),
+        "SEARCH_BACKEND": default_search_backend(database_url),
+        "LOG_LEVEL": "WARNING",
+        **{key: str(value) for key, value in env.items()}
+    }
+    if workers > 1 or sharded:
+        env.update({"WS_BACKPLANE_IPC_DIR": tempfile.mkdtemp(), "WS_SHARD_IPC_DIR": tempfile.mkdtemp()})
+    if sharded:
+        command = ["app.launcher", "--workers", str(workers), "--port", str(port), "--mode", "redirect"]
+    else:
+        command = ["uvicorn", "app.main:app", "--port", str(port), "--workers", str(workers)]
+        if workers > 1:
+            env["WS_BACKPLANE"] = "ipc"
+    return subprocess.Popen(
+        [sys.executable, "-m", *command, "--log-level", "warning"],
+        env=env,
+        stdout=subprocess.DEVNULL
+    )
+
+
+def stop_server(server: subprocess.Popen):
+    server.terminate()
+    server.wait()
+
+
+def _process_tree(pid: int) -> List[int]:
+    pids = [pid]
+    for process in pids:
+        try:
+            with open(f"/proc/{process}/task/{process}/children") as children:
+                pids.extend(int(child) for child in children.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+def cpu_seconds(pid: int) -> Optional[float]:
+    """
+    User plus system CPU time used so far by a process and its worker
+    processes, from /proc; None where there is no /proc.
+    """
+    total = None
+    for process in _process_tree(pid):
+        try:
+            with open(f"/proc/{process}/stat") as stat_file:
+                # Fields after the command name, which may contain spaces
+                fields = stat_file.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        total = (total or 0) + (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    return total
+
+
+def resident_memory(pid: int) -> Optional[int]:
+    """
+    Resident memory of a process in bytes, from /proc; None where there is
+    no /proc.
+    """
+    try:
+        with open(f"/proc/{pid}/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return None
+
+
+async def wait_until_ready(client: httpx.AsyncClient, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if (await client.get("/api/health")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        if time.monotonic() > deadline:
+            raise RuntimeError("server did not start")
+        await asyncio.sleep(0.2)
+
+
+async def login(client: httpx.AsyncClient, username: str, register: bool = True) -> str:
+    if register:
+        await client.post("/api/register", json={"username": username, "email": f"{username}@example.com", "password": PASSWORD})
+    response = await client.post("/api/login", data={"username": username, "password": PASSWORD})
+    return response.json()["access_token"]
+
+
+def latency_summary(timings: List[float]) -> dict:
+    """
+    Percentiles in milliseconds of a list of durations in seconds.
+    """
+    if not timings:
+        return {"samples": 0}
+    timings = sorted(timings)
+
+    def percentile(q: float) -> float:
+        return round(timings[min(len(timings) - 1, int(len(timings) * q))] * 1000, 3)
+
+    return {
+        "samples": len(timings),
+        "p50_ms": percentile(0.5),
+        "p90_ms": percentile(0.9),
+        "p99_ms": percentile(0.99),
+        "max_ms": round(timings[-1] * 1000, 3)
+    }
+
+
+def _revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Reporter:
+    """
+    Prints results and appends them, with the run's metadata, to the output
+    file if one was given.
+    """
+
+    def __init__(self, output: Optional[str], database_url: str):
+        self.output = output
+        self.metadata = {
+            "revision": _revision(),
+            "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "database": database_url.split(":", 1)[0],
+            "python": platform.python_version(),
+            "cpus": os.cpu_count()
+        }
+
+    def report(self, result: dict):
+        print(json.dumps(result))
+        if self.output:
+            with open(self.output, "a") as output:
+                output.write(json.dumps({**result, **self.metadata}) + "\n")
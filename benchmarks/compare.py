@@ -0,0 +1,55 @@
+"""
+Compare two benchmark result files written with --output.
+
+    python -m benchmarks.compare results/before.jsonl results/after.jsonl
+
+Results are matched by benchmark and case; when a file holds several runs of
+the same case, the last one is used. Prints the change of every latency and
+rate they share, marking changes beyond --threshold percent.
+"""
+import argparse
+import json
+from typing import Dict, Tuple
+
+KEY_FIELDS = ("benchmark", "case", "phase", "backend")
+# Lower is better for latencies, CPU time and memory, higher for rates
+METRICS = (
+    "p50_ms", "p90_ms", "p99_ms", "max_ms", "direct_p50_ms", "direct_p50_us", "server_cpu_seconds", "rss_growth_mb",
+    "requests_per_second", "messages_per_second", "deliveries_per_second", "delivered_ratio"
+)
+
+
+def load(path: str) -> Dict[Tuple, dict]:
+    results = {}
+    with open(path) as results_file:
+        for line in results_file:
+            if line.strip():
+                result = json.loads(line)
+                results[tuple(result.get(field) for field in KEY_FIELDS)] = result
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=5.0, help="percent")
+    args = parser.parse_args()
+
+    before, after = load(args.before), load(args.after)
+    for key in sorted(before.keys() & after.keys(), key=lambda key: [str(part) for part in key]):
+        name = " ".join(str(part) for part in key if part is not None)
+        for metric in METRICS:
+            old, new = before[key].get(metric), after[key].get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * 100
+            better = change < 0 if metric.endswith(("_ms", "_us", "_seconds", "_mb")) else change > 0
+            mark = "" if abs(change) < args.threshold else ("  better" if better else "  WORSE")
+            print(f"{name:45} {metric:22} {old:>12} -> {new:>12} {change:+7.1f}%{mark}")
+    for key in sorted(before.keys() ^ after.keys(), key=lambda key: [str(part) for part in key]):
+        print(f"{' '.join(str(part) for part in key if part is not None):45} only in {args.before if key in before else args.after}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Run every benchmark with the same settings and collect the results in one file.
+
+    python -m benchmarks.suite --output results/$(git rev-parse --short HEAD).jsonl
+    python -m benchmarks.suite --quick --output results/quick.jsonl
+
+Each benchmark starts from an empty database of its own, in a temporary SQLite
+file unless --database-url is given. --quick uses small data sets and short
+runs, to check a change in a minute or two; compare full runs before drawing
+conclusions. Compare result files with benchmarks.compare.
+"""
+import argparse
+import subprocess
+import sys
+
+FULL = {
+    "bench_export": ["--messages", "200000"],
+    "bench_rest": ["--messages", "200000", "--rooms", "200", "--requests", "1000"],
+    "bench_search": ["--messages", "100000"],
+    "bench_serialization": ["--pages", "500"],
+    "bench_ws_latency": ["--samples", "200"],
+    "bench_ws_throughput": ["--clients", "100", "--rooms", "10", "--duration", "10"]
+}
+QUICK = {
+    "bench_export": ["--messages", "20000"],
+    "bench_rest": ["--messages", "20000", "--rooms", "50", "--requests", "200", "--login-requests", "10"],
+    "bench_search": ["--messages", "10000", "--repeat", "2"],
+    "bench_serialization": ["--pages", "100"],
+    "bench_ws_latency": ["--messages", "200", "--samples", "50", "--rest-clients", "4"],
+    "bench_ws_throughput": ["--clients", "20", "--rooms", "4", "--duration", "3"]
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", required=True, help="JSON lines file the results are appended to")
+    parser.add_argument("--quick", action="store_true")
+    parser.add_argument("--only", nargs="*", help="benchmarks to run, all by default")
+    parser.add_argument("--database-url", default=None)
+    args = parser.parse_args()
+
+    failed = []
+    for name, options in (QUICK if args.quick else FULL).items():
+        if args.only and name not in args.only:
+            continue
+        command = [sys.executable, "-m", f"benchmarks.{name}", *options, "--output", args.output]
+        if args.database_url and name != "bench_serialization":
+            command += ["--database-url", args.database_url]
+        print(f"# {name}", flush=True)
+        if subprocess.run(command).returncode != 0:
+            failed.append(name)
+    if failed:
+        sys.exit(f"failed: {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -16,6 +16,8 @@ CREATE TABLE IF NOT EXISTS chat_rooms (
     name VARCHAR(100) UNIQUE NOT NULL,
     created_by INT NOT NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    message_count INT NOT NULL DEFAULT 0,
+    last_message_at TIMESTAMP NULL,
     FOREIGN KEY (created_by) REFERENCES users(id) ON DELETE CASCADE
 );
 
@@ -26,6 +28,8 @@ CREATE TABLE IF NOT EXISTS messages (
     room_id INT NOT NULL,
     content TEXT NOT NULL,
     timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_messages_room_ts_id (room_id, timestamp, id),
+    FULLTEXT INDEX ft_messages_content (content),
     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
     FOREIGN KEY (room_id) REFERENCES chat_rooms(id) ON DELETE CASCADE
 );
@@ -34,5 +38,7 @@ CREATE TABLE IF NOT EXISTS messages (
 CREATE TABLE IF NOT EXISTS revoked_tokens (
     id INT AUTO_INCREMENT PRIMARY KEY,
     jti VARCHAR(255) UNIQUE NOT NULL,
-    revoked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    revoked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP NULL,
+    INDEX idx_revoked_tokens_expires_at (expires_at)
 );
\ No newline at end of file
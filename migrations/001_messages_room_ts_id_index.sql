@@ -0,0 +1,5 @@
+-- Composite index used by keyset pagination of room history.
+-- init.sql already creates it for new databases; run this on existing ones.
+USE chat_app;
+
+CREATE INDEX idx_messages_room_ts_id ON messages (room_id, timestamp, id);
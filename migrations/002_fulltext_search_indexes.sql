@@ -0,0 +1,6 @@
+-- FULLTEXT indexes used by SEARCH_BACKEND=fulltext.
+-- init.sql already creates them for new databases; run this on existing ones.
+USE chat_app;
+
+ALTER TABLE messages ADD FULLTEXT INDEX ft_messages_content (content);
+ALTER TABLE chat_rooms ADD FULLTEXT INDEX ft_chat_rooms_name (name);
@@ -0,0 +1,7 @@
+-- Expiry of revoked tokens, used to prune rows once the token has expired.
+-- init.sql already creates it for new databases; run this on existing ones.
+USE chat_app;
+
+ALTER TABLE revoked_tokens
+    ADD COLUMN expires_at TIMESTAMP NULL,
+    ADD INDEX idx_revoked_tokens_expires_at (expires_at);
@@ -0,0 +1,12 @@
+-- Per-room message counters maintained on insert, so room details and the
+-- room list need no COUNT over the room's history.
+-- init.sql already creates them for new databases; run this on existing ones.
+USE chat_app;
+
+ALTER TABLE chat_rooms
+    ADD COLUMN message_count INT NOT NULL DEFAULT 0,
+    ADD COLUMN last_message_at TIMESTAMP NULL;
+
+UPDATE chat_rooms
+SET message_count = (SELECT COUNT(*) FROM messages WHERE messages.room_id = chat_rooms.id),
+    last_message_at = (SELECT MAX(timestamp) FROM messages WHERE messages.room_id = chat_rooms.id);
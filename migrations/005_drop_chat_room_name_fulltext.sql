@@ -0,0 +1,6 @@
+-- Room names are searched in memory by the room directory, so the FULLTEXT
+-- index added by 002 only slows down room inserts.
+-- init.sql no longer creates it; run this on existing databases.
+USE chat_app;
+
+ALTER TABLE chat_rooms DROP INDEX ft_chat_rooms_name;
@@ -0,0 +1,77 @@
+import os
+import tempfile
+import uuid
+from types import SimpleNamespace
+
+# Settings are read on import, so the test environment is set before the app
+# is imported. aiosqlite stands in for MySQL.
+_directory = tempfile.mkdtemp(prefix="chat-tests-")
+os.environ.update({
+    "DATABASE_URL": f"sqlite+aiosqlite:///{os.path.join(_directory, 'chat.db')}",
+    "SECRET_KEY": "test-secret",
+    "BCRYPT_ROUNDS": "4",
+    "LOG_LEVEL": "WARNING",
+    "WS_BACKPLANE_IPC_DIR": os.path.join(_directory, "backplane"),
+    "MESSAGE_ARCHIVE_DIR": os.path.join(_directory, "archive")
+})
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import insert
+
+from app.database import SessionLocal
+from app.main import app
+from app.models.message import Message
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def run(client):
+    """
+    Run a coroutine function on the app's event loop, where its engine,
+    caches and background tasks live.
+    """
+    def run(function, *args):
+        return client.portal.call(function, *args)
+    return run
+
+
+@pytest.fixture
+def user(client):
+    username = f"user{uuid.uuid4().hex[:10]}"
+    registered = client.post("/api/register", json={"username": username, "email": f"{username}@example.com", "password": "secret1"})
+    token = client.post("/api/login", data={"username": username, "password": "secret1"}).json()["access_token"]
+    return SimpleNamespace(
+        id=registered.json()["id"],
+        username=username,
+        token=token,
+        headers={"Authorization": f"Bearer {token}"}
+    )
+
+
+@pytest.fixture
+def room(client, user):
+    response = client.post("/api/chat/rooms", json={"name": f"room-{uuid.uuid4().hex[:10]}"}, headers=user.headers)
+    return response.json()["id"]
+
+
+@pytest.fixture
+def insert_messages(run):
+    """
+    Insert message rows directly, as another worker or an import would, and
+    return their ids.
+    """
+    def insert_messages(rows):
+        async def write():
+            async with SessionLocal() as db:
+                result = await db.execute(insert(Message).returning(Message.id), rows)
+                ids = sorted(result.scalars())
+                await db.commit()
+                return ids
+        return run(write)
+    return insert_messages
@@ -0,0 +1,64 @@
+import asyncio
+import time
+
+import pytest
+
+from app.websockets.backplane import Backplane, LocalIPCBackplane
+
+
+def test_backplane_must_implement_publish():
+    with pytest.raises(TypeError):
+        Backplane()
+
+
+def _pair(directory):
+    return LocalIPCBackplane(str(directory)), LocalIPCBackplane(str(directory))
+
+
+def test_ipc_events_arrive_whole_and_in_order(tmp_path):
+    async def scenario():
+        sender, receiver = _pair(tmp_path)
+        await sender.start()
+        await receiver.start()
+        received = []
+        receiver.subscribe("room", received.append)
+        try:
+            await sender.publish("room", {"large": "x" * (1024 * 1024)})
+            for number in range(1000):
+                await sender.publish("room", {"number": number, "padding": "y" * 1000})
+            await asyncio.sleep(0.2)
+        finally:
+            await sender.stop()
+            await receiver.stop()
+        return received, sender.stats()
+
+    received, stats = asyncio.run(scenario())
+
+    assert len(received[0]["large"]) == 1024 * 1024
+    assert [event["number"] for event in received[1:]] == list(range(1000))
+    assert stats["dropped"] == 0
+    assert stats["fragmented"] == 1
+
+
+def test_ipc_peer_that_stops_reading_costs_one_timeout(tmp_path):
+    async def scenario():
+        sender, receiver = _pair(tmp_path)
+        await sender.start()
+        await receiver.start()
+        asyncio.get_running_loop().remove_reader(receiver.sock.fileno())
+        started = time.monotonic()
+        try:
+            for number in range(500):
+                await sender.publish("room", {"number": number, "padding": "y" * 1000})
+        finally:
+            elapsed = time.monotonic() - started
+            asyncio.get_running_loop().add_reader(receiver.sock.fileno(), receiver._on_readable)
+            await sender.stop()
+            await receiver.stop()
+        return elapsed, sender.stats()
+
+    elapsed, stats = asyncio.run(scenario())
+
+    assert stats["dropped"] > 0
+    # One wait of PEER_SEND_TIMEOUT, then drops without waiting
+    assert elapsed < LocalIPCBackplane.PEER_SEND_TIMEOUT * 2
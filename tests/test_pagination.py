@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta
+
+from app.services.pagination import encode_rank_cursor
+
+
+def _rows(room_id, user_id, offsets):
+    # Whole seconds, as stored; several messages share each timestamp
+    base = datetime.utcnow().replace(microsecond=0) - timedelta(minutes=10)
+    return [
+        {"user_id": user_id, "room_id": room_id, "content": f"message {index}", "timestamp": base + timedelta(seconds=offset)}
+        for index, offset in enumerate(offsets)
+    ]
+
+
+def _walk(client, user, room, limit, **params):
+    """
+    Follow X-Next-Cursor from the first page to the end.
+    """
+    ids, pages = [], 0
+    while True:
+        response = client.get(f"/api/chat/rooms/{room}/messages", params={"limit": limit, **params}, headers=user.headers)
+        assert response.status_code == 200
+        ids += [message["id"] for message in response.json()]
+        pages += 1
+        cursor = response.headers.get("x-next-cursor")
+        if not cursor:
+            return ids, pages
+        params = {"cursor": cursor}
+
+
+def test_cursor_pages_visit_every_message_once(client, user, room, insert_messages):
+    ids = insert_messages(_rows(room, user.id, [0, 0, 0, 1, 1, 2, 2]))
+    timestamps = dict(zip(ids, [0, 0, 0, 1, 1, 2, 2]))
+
+    walked, pages = _walk(client, user, room, limit=2)
+
+    assert walked == sorted(ids, key=lambda message_id: (timestamps[message_id], message_id), reverse=True)
+    assert pages == 4
+
+
+def test_page_ending_on_the_last_message_is_followed_by_an_empty_one(client, user, room, insert_messages):
+    ids = insert_messages(_rows(room, user.id, [0, 0, 1, 1]))
+
+    walked, pages = _walk(client, user, room, limit=2)
+
+    assert sorted(walked) == ids
+    assert pages == 3
+
+
+def test_after_id_pages_run_oldest_first(client, user, room, insert_messages):
+    ids = insert_messages(_rows(room, user.id, [0, 0, 1, 1, 1, 2]))
+
+    walked, _ = _walk(client, user, room, limit=2, after_id=ids[0])
+
+    assert walked == ids[1:]
+
+
+def test_new_messages_do_not_shift_later_pages(client, user, room, insert_messages):
+    ids = insert_messages(_rows(room, user.id, [0, 1, 2, 3]))
+    first = client.get(f"/api/chat/rooms/{room}/messages", params={"limit": 2}, headers=user.headers)
+    insert_messages(_rows(room, user.id, [4, 5]))
+
+    second = client.get(
+        f"/api/chat/rooms/{room}/messages",
+        params={"limit": 2, "cursor": first.headers["x-next-cursor"]},
+        headers=user.headers
+    )
+
+    assert [message["id"] for message in first.json()] == [ids[3], ids[2]]
+    assert [message["id"] for message in second.json()] == [ids[1], ids[0]]
+
+
+def test_invalid_cursors_are_rejected(client, user, room, insert_messages):
+    insert_messages(_rows(room, user.id, [0]))
+
+    for cursor in ("not-a-cursor", encode_rank_cursor(10)):
+        response = client.get(f"/api/chat/rooms/{room}/messages", params={"cursor": cursor}, headers=user.headers)
+        assert response.status_code == 400
+
+
+def test_anchor_from_another_room_is_not_found(client, user, room, insert_messages):
+    other = client.post("/api/chat/rooms", json={"name": f"other-{room}"}, headers=user.headers).json()["id"]
+    [foreign] = insert_messages(_rows(other, user.id, [0]))
+
+    response = client.get(f"/api/chat/rooms/{room}/messages", params={"before_id": foreign}, headers=user.headers)
+
+    assert response.status_code == 404
@@ -0,0 +1,55 @@
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, insert, select
+
+from app.database import SessionLocal
+from app.models.token import RevokedToken
+from app.services.revocation import RevocationList
+
+
+def test_logout_revokes_the_token(client, user):
+    assert client.get("/api/chat/rooms", headers=user.headers).status_code == 200
+
+    assert client.post("/api/logout", headers=user.headers).status_code == 200
+
+    assert client.get("/api/chat/rooms", headers=user.headers).status_code == 401
+
+
+def test_sync_picks_up_revocations_from_other_workers(run):
+    revocations = RevocationList(sync_interval=30, prune_interval=600)
+    expires_at = datetime.utcnow() + timedelta(hours=1)
+    committed_late, fresh = f"late-{uuid.uuid4().hex}", f"fresh-{uuid.uuid4().hex}"
+
+    async def scenario():
+        async with SessionLocal() as db:
+            await revocations.sync(db)
+            watermark = revocations.synced_at
+            # Database time, whatever the session's time zone
+            assert abs((await db.scalar(select(func.now())) - watermark).total_seconds()) < 5
+
+            await db.execute(insert(RevokedToken), [
+                # Stamped before the last sync, committed after it
+                {"jti": committed_late, "expires_at": expires_at, "revoked_at": watermark - timedelta(seconds=5)},
+                {"jti": fresh, "expires_at": expires_at}
+            ])
+            await db.commit()
+            await revocations.sync(db)
+    run(scenario)
+
+    assert revocations.is_revoked(committed_late)
+    assert revocations.is_revoked(fresh)
+
+
+def test_expired_revocations_are_not_loaded(run):
+    revocations = RevocationList(sync_interval=30, prune_interval=600)
+    expired = f"expired-{uuid.uuid4().hex}"
+
+    async def scenario():
+        async with SessionLocal() as db:
+            await db.execute(insert(RevokedToken), [{"jti": expired, "expires_at": datetime.utcnow() - timedelta(minutes=1)}])
+            await db.commit()
+            await revocations.sync(db)
+    run(scenario)
+
+    assert not revocations.is_revoked(expired)
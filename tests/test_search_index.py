@@ -0,0 +1,119 @@
+import asyncio
+import time
+from datetime import datetime
+
+from sqlalchemy import delete, func, select
+
+from app.database import SessionLocal
+from app.models.message import Message
+from app.services.persistence import message_writer
+from app.services.search import InvertedIndexSearchBackend
+
+
+def _search(run, backend, room, query, limit=50):
+    async def search():
+        async with SessionLocal() as db:
+            messages, _ = await backend.search_messages(db, room, query, 0, limit, None, None, None)
+            return [message["id"] for message in messages]
+    return run(search)
+
+
+def _next_id(run):
+    async def next_id():
+        async with SessionLocal() as db:
+            return (await db.scalar(select(func.max(Message.id))) or 0) + 1
+    return run(next_id)
+
+
+def _row(room, user, content, message_id=None):
+    row = {"user_id": user.id, "room_id": room, "content": content, "timestamp": datetime.utcnow().replace(microsecond=0)}
+    if message_id is not None:
+        row["id"] = message_id
+    return row
+
+
+def test_write_behind_messages_are_searchable_in_send_order(client, run, user, room):
+    backend = InvertedIndexSearchBackend(max_rooms=10, gap_timeout=60)
+    assert _search(run, backend, room, "ordered") == []
+    flushed = message_writer.stats()["flushed"]
+
+    async def send():
+        for number in range(20):
+            await message_writer.enqueue(user.id, user.username, room, f"ordered {number}", datetime.utcnow().replace(microsecond=0))
+    run(send)
+    deadline = time.monotonic() + 5
+    while message_writer.stats()["flushed"] < flushed + 20:
+        assert time.monotonic() < deadline, "write-behind did not flush"
+        time.sleep(0.02)
+
+    found = _search(run, backend, room, "ordered")
+    history = client.get(f"/api/chat/rooms/{room}/messages", params={"limit": 20}, headers=user.headers).json()
+
+    assert len(found) == 20
+    assert [message["content"] for message in sorted(history, key=lambda message: message["id"])] == [f"ordered {number}" for number in range(20)]
+    assert sorted(found) == sorted(message["id"] for message in history)
+
+
+def test_message_committed_below_the_high_water_mark_is_indexed(run, user, room, insert_messages):
+    backend = InvertedIndexSearchBackend(max_rooms=10, gap_timeout=60)
+    first = _next_id(run)
+    insert_messages([_row(room, user, "late one", first)])
+    assert _search(run, backend, room, "late") == [first]
+
+    # Another transaction commits a higher id first
+    insert_messages([_row(room, user, "late three", first + 2)])
+    assert sorted(_search(run, backend, room, "late")) == [first, first + 2]
+    insert_messages([_row(room, user, "late two", first + 1)])
+
+    assert sorted(_search(run, backend, room, "late")) == [first, first + 1, first + 2]
+    assert first + 1 not in backend.gaps
+
+
+def test_concurrent_searches_index_each_message_once(run, user, room, insert_messages):
+    backend = InvertedIndexSearchBackend(max_rooms=10, gap_timeout=60)
+    insert_messages([_row(room, user, "hello world") for _ in range(200)])
+
+    async def searches():
+        async def search():
+            async with SessionLocal() as db:
+                return len((await backend.search_messages(db, room, "hello", 0, 1000, None, None, None))[0])
+        return await asyncio.gather(search(), search(), search())
+
+    assert run(searches) == [200, 200, 200]
+    insert_messages([_row(room, user, "hello again") for _ in range(50)])
+    assert run(searches) == [250, 250, 250]
+    index = backend.rooms[room]
+    assert index.doc_count == 250
+    assert max(index.postings["hello"].values()) == 1
+
+
+def test_building_one_room_does_not_block_another(client, run, user, room, insert_messages):
+    backend = InvertedIndexSearchBackend(max_rooms=10, gap_timeout=60)
+    other = client.post("/api/chat/rooms", json={"name": f"quiet-{room}"}, headers=user.headers).json()["id"]
+    [message_id] = insert_messages([_row(other, user, "unblocked")])
+
+    async def search_while_building():
+        lock = backend.build_locks.setdefault(room, asyncio.Lock())
+        async with lock:
+            async with SessionLocal() as db:
+                messages, _ = await asyncio.wait_for(
+                    backend.search_messages(db, other, "unblocked", 0, 10, None, None, None), 5
+                )
+                return [message["id"] for message in messages]
+
+    assert run(search_while_building) == [message_id]
+
+
+def test_messages_removed_from_the_table_leave_the_index(run, user, room, insert_messages):
+    backend = InvertedIndexSearchBackend(max_rooms=10, gap_timeout=60)
+    kept, archived = insert_messages([_row(room, user, "archive me"), _row(room, user, "archive me too")])
+    assert sorted(_search(run, backend, room, "archive")) == [kept, archived]
+
+    async def archive():
+        async with SessionLocal() as db:
+            await db.execute(delete(Message).where(Message.id == archived))
+            await db.commit()
+    run(archive)
+
+    assert _search(run, backend, room, "archive", limit=1) == [kept]
+    assert archived not in backend.rooms[room].documents
@@ -0,0 +1,79 @@
+import json
+
+import pytest
+from starlette.websockets import WebSocketDisconnect
+
+from app.websockets import connection
+from app.websockets.sharding import REDIRECT_CLOSE_CODE, ShardRing, ShardRouter
+
+
+def _events(frame):
+    return frame["events"] if frame.get("type") == "batch" else [frame]
+
+
+def _contents(receive, count):
+    contents = []
+    while len(contents) < count:
+        contents += [event["content"] for event in _events(receive()) if event.get("type") == "message"]
+    return contents
+
+
+def test_batched_and_plain_sockets_get_every_message_in_order(client, user, room):
+    url = f"/ws/{room}?token={user.token}"
+    with client.websocket_connect(f"{url}&batch=true") as batched, client.websocket_connect(url) as plain:
+        batched.receive_json()
+        plain.receive_json()
+        for number in range(10):
+            plain.send_text(json.dumps({"content": f"message {number}"}))
+
+        expected = [f"message {number}" for number in range(10)]
+        assert _contents(batched.receive_json, 10) == expected
+        assert _contents(plain.receive_json, 10) == expected
+
+
+def test_invalid_content_is_rejected_and_not_broadcast(client, user, room):
+    with client.websocket_connect(f"/ws/{room}?token={user.token}") as websocket:
+        websocket.receive_json()
+        for content in ({"nested": 1}, "", 5):
+            websocket.send_text(json.dumps({"content": content}))
+            assert "Invalid message" in websocket.receive_text()
+        websocket.send_text(json.dumps({"content": "valid"}))
+        assert _contents(websocket.receive_json, 1) == ["valid"]
+
+
+def test_unknown_room_is_closed(client, user):
+    with pytest.raises(WebSocketDisconnect) as closed:
+        with client.websocket_connect(f"/ws/999999999?token={user.token}") as websocket:
+            websocket.receive_text()
+    assert closed.value.code == 1008
+
+
+def test_shard_ring_spreads_rooms_and_keeps_their_owner():
+    ring = ShardRing(4)
+    owners = [ring.owner(room_id) for room_id in range(4000)]
+
+    assert owners == [ShardRing(4).owner(room_id) for room_id in range(4000)]
+    for shard in range(4):
+        assert 600 < owners.count(shard) < 1400
+
+
+def test_single_shard_owns_every_room():
+    router = ShardRouter(count=1, index=0, mode="proxy", ipc_directory="", base_port=8000, urls=[])
+
+    assert not router.sharded
+    assert all(router.owns(room_id) for room_id in range(100))
+
+
+def test_socket_for_another_shard_is_redirected(client, user, monkeypatch):
+    router = ShardRouter(count=2, index=0, mode="redirect", ipc_directory="", base_port=8000, urls=[])
+    room_id = next(room_id for room_id in range(1, 100) if router.owner(room_id) == 1)
+    monkeypatch.setattr(connection, "shard_router", router)
+
+    with pytest.raises(WebSocketDisconnect) as closed:
+        with client.websocket_connect(f"/ws/{room_id}?token={user.token}") as websocket:
+            redirect = websocket.receive_json()
+            assert redirect["type"] == "redirect"
+            assert redirect["shard"] == 1
+            assert ":8001/ws/" in redirect["url"]
+            websocket.receive_text()
+    assert closed.value.code == REDIRECT_CLOSE_CODE